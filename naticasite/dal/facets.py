@@ -0,0 +1,89 @@
+"""
+Facet counts (distinct values and their counts, per category) of the
+rows of voi.siap matching a search.
+
+All categories are counted in one scan of the matching rows (GROUPING
+SETS: one grouping per category) and each keeps its MAX_VALUES most
+frequent values.  Results are remembered per normalized WHERE clause for
+TTL seconds, and until natica stores new metadata.
+"""
+import re
+import time
+import threading
+from collections import OrderedDict
+
+from natica import generation
+
+# (SQL expression, category name)
+CATEGORIES = [
+    ("prop_id", "prop_id"),
+    ("surveyid", "survey_id"),
+    ("dtpi", "pi"),
+    ("concat(telescope, ',', instrument)", "telescope_instrument"),
+    ("filter", "filter"),
+    ("obstype", "observation_type"),
+    ("obsmode", "observation_mode"),
+    ("prodtype", "product"),
+    ("proctype", "processing"),
+]
+MAX_VALUES = 1000   # per category (most frequent first)
+TTL = 300           # seconds
+MAX_CACHED = 500    # WHERE clauses
+
+_lock = threading.Lock()
+_cache = OrderedDict() # where key -> (expires, generation, categories)
+
+def facet_sql(where_clause, max_values=MAX_VALUES):
+    """One query for counts of every category of rows in WHERE_CLAUSE.
+Rows are (grouping mask, value of each category, count, nth)."""
+    names = [name for _,name in CATEGORIES]
+    columns = ', '.join(names)
+    matched = ', '.join('{} AS {}'.format(expr, name)
+                        for expr,name in CATEGORIES)
+    sets = ', '.join('({})'.format(name) for name in names)
+    return ('SELECT * FROM ('
+            ' SELECT GROUPING({columns}) AS grp, {columns}, count(*) AS total,'
+            ' row_number() OVER (PARTITION BY GROUPING({columns})'
+            ' ORDER BY count(*) DESC) AS nth'
+            ' FROM (SELECT {matched} FROM voi.siap {where}) AS matched'
+            ' GROUP BY GROUPING SETS ({sets})'
+            ') AS facets WHERE nth <= {max_values}'
+            .format(columns=columns, matched=matched, where=where_clause,
+                    sets=sets, max_values=int(max_values)))
+
+def categories_of(rows):
+    """Dict of category -> list of {category: value, 'total': count},
+most frequent first, from ROWS of facet_sql()."""
+    ncat = len(CATEGORIES)
+    full = (1 << ncat) - 1
+    # GROUPING() bit is 1 for columns NOT grouped; leftmost is the high bit
+    index_of_mask = dict((full ^ (1 << (ncat - 1 - i)), i)
+                         for i in range(ncat))
+    categories = OrderedDict((name, list()) for _,name in CATEGORIES)
+    for row in sorted(rows, key=lambda r: (r[0], r[-1])):
+        i = index_of_mask[row[0]]
+        name = CATEGORIES[i][1]
+        categories[name].append({name: row[1 + i], 'total': row[1 + ncat]})
+    return categories
+
+def where_key(where_clause):
+    return re.sub(r'\s+', ' ', where_clause).strip()
+
+def categories(cursor, where_clause):
+    """Facet counts of rows of voi.siap in WHERE_CLAUSE (cached)."""
+    key = where_key(where_clause)
+    gen = generation.current()
+    now = time.time()
+    with _lock:
+        hit = _cache.get(key)
+        if hit is not None and hit[0] > now and hit[1] == gen:
+            _cache.move_to_end(key)
+            return hit[2]
+    cursor.execute(facet_sql(where_clause))
+    result = categories_of(cursor.fetchall())
+    with _lock:
+        _cache[key] = (now + TTL, gen, result)
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_CACHED:
+            _cache.popitem(last=False)
+    return result
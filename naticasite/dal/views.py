@@ -2,10 +2,10 @@
 import json
 from os import path
 import coreapi
-import jsonschema
 from django.db import connections
 from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
 from django.conf import settings
 from rest_framework import response
 from rest_framework.decorators import api_view, renderer_classes
@@ -14,7 +14,10 @@ from tada.models import FilePrefix
 from astropy.coordinates import SkyCoord
 
 from . import exceptions as dex
+from natica import search_service
+from natica.views import search_response
 from . import utils
+from . import facets
 from .serializers import FilePrefixSerializer
 
 dal_version = '0.1.7' # MVP. mostly untested
@@ -86,106 +89,8 @@ def search_by_json(request, query=None): # @Portal
     if request.content_type != "application/json" :
         raise Exception("Only accepts content_type = application/json. Got '{}'"
                         .format(request.content_type))
-    logging.debug('DBG-1 search.request.body={}'.format(request.body))
-    page_limit = int(request.GET.get('limit','100')) # num of records per page
-    page = int(request.GET.get('page','1'))
-    offset = (page-1) * page_limit
-    # order:: comma delimitied, leading +/-  (ascending/descending)
-    order_fields = request.GET.get('order','original_filename')
     jsearch = json.loads(request.body.decode('utf-8'))
-    logging.debug('DBG jsearch={}'.format(jsearch))
-
-    # Validate against schema
-    try:
-        schemafile = '/etc/natica/search-schema.json'
-        with open(schemafile) as f:
-            schema = json.load(f)
-            jsonschema.validate(jsearch, schema)
-    except Exception as err:
-        raise nex.SearchSyntaxError('JSON did not validate against'
-                                    ' {}; {}'.format(schemafile, err))
-
-
-    used_fields = set(jsearch.keys())
-    if not (search_fields >= used_fields):
-        unavail = used_fields - search_fields
-        raise nex.ExtraSearchFieldError('Extra fields ({}) in search'
-                                     .format(unavail))
-    assert(search_fields >= used_fields)
-
-    q = make_qobj(jsearch)
-
-    #fullqs = FitsFile.objects.filter(q).distinct().order_by(order_fields)
-    fullqs = FitsFile.objects.filter(q)
-    #total_count = len(fullqs) #.count()   tot seconds: 2.8
-    total_count = fullqs.count() #       tot seconds: 4.9
-    logging.debug('DBG: do query')
-    try:
-        qs = fullqs.order_by(order_fields)[offset:page_limit]
-    except Exception as err:
-        return JsonResponse(dict(error='query failed: {}'.format(err)))
-    query = str(qs.query)
-    logging.debug('DBG: query={}'.format(query))
-
-    results = list()
-    #!for fobj in qs.iterator():
-    for fobj in qs:
-        logging.debug('DBG: fobj.md5sum={}, instrum={}'.format(fobj.md5sum, fobj.instrument))
-        ra = [fobj.ra.lower, fobj.ra.upper] if fobj.ra != None else None
-        dec = [fobj.dec.lower, fobj.dec.upper] if fobj.dec != None else None
-        exposure = [fobj.exposure.lower, fobj.exposure.upper] if fobj.exposure != None else None
-        obsdate = [fobj.date_obs.lower, fobj.date_obs.upper] if fobj.date_obs != None else None
-        results.append(
-            dict(
-                id=fobj.id,
-                ra=ra,
-                dec=dec,
-                #depth,
-                exposure=exposure,
-                filename=fobj.archive_filename,
-                filesize=fobj.filesize,
-                filter=fobj.extras.get('FILTER'), # FILTER, FILTERS, FILTER1, FILTER2
-                image_type=fobj.extras.get('IMAGETYP'), 
-                instrument=fobj.instrument.name,
-                md5sum=fobj.md5sum,
-                obs_date=obsdate,
-                observation_mode=fobj.extras.get('OBSMODE'),
-                observation_type=fobj.extras.get('OBSTYPE'), 
-                original_filename=fobj.original_filename,
-                pi=fobj.extras.get('PROPOSER'),
-                product=fobj.extras.get('PRODTYPE'),
-                prop_id=fobj.extras.get('DTPROPID'),
-                release_date=fobj.release_date,
-                seeing=fobj.extras.get('SEEING'),
-                #survey_id
-                telescope=fobj.telescope.name,
-            ))
-    logging.debug('DBG: results={}'.format(results))
-    meta = OrderedDict.fromkeys(['total_count',
-                                 'page_result_count',
-                                 'to_here_count',
-                                 'api_version',
-                                 'timestamp',
-                                 'comment',
-                                 'query', ])
-    meta.update(
-        api_version = api_version,
-        timestamp = datetime.datetime.now(),
-        comment = ('WARNING: RESULTS missing values: surver_id, depth.'
-                   '  (Where do they come from???)'
-                   ),
-        query = query,
-        page_result_count = len(results),
-        to_here_count = offset + len(results),
-        total_count = total_count,
-        offset = offset,
-        page_limit = page_limit,
-        debug=1
-    )
-    #logging.debug('DBG: query={}'.format(qs.query))
-    jresponse = OrderedDict(meta=meta, resultset=results)
-    #!logging.debug('DBG: jresponse={}'.format(jresponse)) # BIG
-    return JsonResponse(jresponse)
+    return search_response(jsearch, search_service.params(request.GET))
                         
 
 
@@ -217,25 +122,8 @@ def get_categories_for_query(request):  # @Portal
     # get uniques for filters
     query = json.loads(request.body.decode('utf-8'))
     cursor = connections['archive'].cursor()
-    category_fields = [
-        "prop_id",
-        "surveyid as survey_id",
-        "dtpi as pi",
-        "concat(telescope, ',', instrument) as telescope_instrument",
-        "filter",
-        "obstype as observation_type",
-        "obsmode as observation_mode",
-        "prodtype as product",
-        "proctype as processing"
-    ]
-
     where_clause = utils.process_query(jsearch=query, page=1, page_limit=50000, order_fields='', return_where_clause=True)
-    categories = {}
-    for category in category_fields:
-        indx = category.split(" as ").pop()
-        sql1 = ('SELECT {}, count(*) as total  FROM voi.siap {} group by {}'.format(category, where_clause, indx))
-        cursor.execute(sql1)
-        categories[indx] = utils.dictfetchall(cursor)
+    categories = facets.categories(cursor, where_clause)
 
     resp = {"status":"success", "categories":categories}
     return JsonResponse(resp, safe=False)
@@ -1,5 +1,6 @@
 from django.contrib import admin
 from .models import FitsFile, Hdu, Proposal, Site, Telescope, Instrument
+from .models import FilePrefix, ObsType, ProcType, ProdType, IngestJob
 from pathlib import PurePath
 
 
@@ -73,3 +74,25 @@ class TelescopeAdmin(admin.ModelAdmin):
 @admin.register(Instrument)
 class InstrumentAdmin(admin.ModelAdmin):
     pass
+
+@admin.register(FilePrefix)
+class FilePrefixAdmin(admin.ModelAdmin):
+    list_display = ('prefix', 'site', 'telescope', 'instrument')
+
+@admin.register(ObsType)
+class ObsTypeAdmin(admin.ModelAdmin):
+    list_display = ('name', 'code')
+
+@admin.register(ProcType)
+class ProcTypeAdmin(admin.ModelAdmin):
+    list_display = ('name', 'code')
+
+@admin.register(ProdType)
+class ProdTypeAdmin(admin.ModelAdmin):
+    list_display = ('name', 'code')
+
+@admin.register(IngestJob)
+class IngestJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'state', 'name', 'archive_filename', 'error',
+                    'submitted', 'finished')
+    list_filter = ('state',)
@@ -0,0 +1,92 @@
+"""
+Aggregate header values of all HDUs of a FITS file into the values stored
+with its FitsFile, in one pass over the HDU dicts.
+
+How each keyword is aggregated is declared in MODES.  Keywords not listed
+there are DISTINCT.
+  FIRST:: value from first HDU that has the keyword
+  DISTINCT:: list of distinct values (in order seen), at most DISTINCT_CAP
+  RANGE:: min,max over HDUs as a Postgres range.  If there is a CONVERT
+    function, distinct raw values are collected and converted together
+    (CONVERT takes a list and returns a NumPy array)
+  SKIP:: not aggregated (stays only in Hdu.extras)
+"""
+from psycopg2.extras import NumericRange, DateRange
+
+from .coords import ra_to_deg, dec_to_deg
+
+FIRST = 'first'
+DISTINCT = 'distinct'
+RANGE = 'range'
+SKIP = 'skip'
+
+DISTINCT_CAP = 20
+
+def mode(kind, convert=None, range_type=NumericRange):
+    return (kind, convert, range_type)
+
+MODES = {
+    # FitsFile columns (see views.KEYWORD_FIELDS)
+    'DTPROPID': mode(FIRST),
+    'PROPOSER': mode(FIRST),
+    'PRODTYPE': mode(FIRST),
+    'PROCTYPE': mode(FIRST),
+    'OBSTYPE':  mode(FIRST),
+    'OBSMODE':  mode(FIRST),
+    'IMAGETYP': mode(FIRST),
+    'FILTER':   mode(FIRST),
+    'SEEING':   mode(FIRST),
+    'DATE-OBS': mode(RANGE, range_type=DateRange),
+    'EXPTIME':  mode(RANGE),
+    'RA':       mode(RANGE, convert=ra_to_deg),
+    'DEC':      mode(RANGE, convert=dec_to_deg),
+    # Commentary and per-HDU checksums mean nothing for a whole file
+    'COMMENT':  mode(SKIP),
+    'HISTORY':  mode(SKIP),
+    '':         mode(SKIP),
+    'CHECKSUM': mode(SKIP),
+    'DATASUM':  mode(SKIP),
+}
+DEFAULT_MODE = mode(DISTINCT)
+
+def aggregate_hdus(hdudict_list, modes=MODES, cap=DISTINCT_CAP):
+    """Aggregate HDUDICT_LIST (one dict per HDU).  Return (agg, range_keys):
+AGG is dict keyed by keyword; RANGE_KEYS are the keywords whose value is a
+range (or None if no HDU has the keyword)."""
+    agg = dict()
+    lo = dict()
+    hi = dict()
+    raw = dict() # keyword -> set of raw values (to CONVERT)
+    for hdudict in hdudict_list:
+        for k,v in hdudict.items():
+            kind, convert, _ = modes.get(k, DEFAULT_MODE)
+            if kind is DISTINCT:
+                vals = agg.get(k)
+                if vals is None:
+                    agg[k] = [v]
+                elif len(vals) < cap and v not in vals:
+                    vals.append(v)
+            elif kind is FIRST:
+                if k not in agg:
+                    agg[k] = v
+            elif kind is RANGE:
+                if v is None:
+                    continue
+                if convert is not None:
+                    raw.setdefault(k, set()).add(v)
+                elif k in lo:
+                    if v < lo[k]:
+                        lo[k] = v
+                    elif v > hi[k]:
+                        hi[k] = v
+                else:
+                    lo[k] = hi[k] = v
+    for k,vals in raw.items():
+        converted = modes[k][1](list(vals))
+        lo[k], hi[k] = float(converted.min()), float(converted.max())
+    range_keys = set()
+    for k,(kind, _, range_type) in modes.items():
+        if kind is RANGE:
+            range_keys.add(k)
+            agg[k] = range_type(lo[k], hi[k], '[]') if k in lo else None
+    return agg, range_keys
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class NaticaConfig(AppConfig):
     name = 'natica'
+
+    def ready(self):
+        from . import refdata
+        refdata.connect_signals()
@@ -0,0 +1,83 @@
+"""
+Conversion of sexagesimal (or decimal) coordinates, as found in FITS
+headers, to degrees.
+
+Conversion is vectorized: each distinct string in the input is parsed once
+(and parsed strings are remembered across calls, since the same pointing
+appears in every HDU of a file and in many files) and the result is a
+NumPy array.  Agrees with astropy.coordinates.Angle to well under 1e-9 deg
+at a fraction of the cost.
+"""
+import re
+import math
+import functools
+
+import numpy as np
+
+from . import exceptions as nex
+
+# Sean: RA is measured in units of time (hours, minutes, seconds)
+# while Dec is measured in the usual units of angular measurement
+# (degrees, minutes, seconds),
+# https://community.dur.ac.uk/physics.astrolab/one_lab/pm_coord.html
+
+# e.g. "21:33:27.02", "-00 49 23.7", "12h30m00s", "-5d30m", "12:30.5"
+_sexagesimal = re.compile(r'''
+    ^\s*(?P<sign>[-+])?\s*
+    (?P<whole>\d+)          \s*[:hd\s]\s*
+    (?P<minutes>\d+(?:\.\d*)?)
+    (?:\s*[:m\s]\s*(?P<seconds>\d+(?:\.\d*)?))?
+    \s*[ms]?\s*$''', re.VERBOSE)
+
+@functools.lru_cache(maxsize=4096)
+def parse_angle(text):
+    """Value of sexagesimal or decimal TEXT in its own units (hours or
+degrees).  Raise ValueError if TEXT is not a valid angle."""
+    try:
+        value = float(text)
+    except ValueError:
+        match = _sexagesimal.match(text)
+        if match is None:
+            raise ValueError('Not a sexagesimal or decimal angle: "{}"'
+                             .format(text))
+        minutes = float(match.group('minutes'))
+        seconds = float(match.group('seconds') or 0)
+        if minutes >= 60 or seconds >= 60:
+            raise ValueError('Minutes or seconds not less than 60: "{}"'
+                             .format(text))
+        value = int(match.group('whole')) + minutes/60 + seconds/3600
+        if match.group('sign') == '-':
+            value = -value
+    if not math.isfinite(value):
+        raise ValueError('Not a finite angle: "{}"'.format(text))
+    return value
+
+def to_degrees(values, scale, lo, hi, name):
+    """Array of degrees for VALUES (list or array). Each is parsed in its
+own units then multiplied by SCALE; result must be in [LO, HI]."""
+    values = np.asarray(values)
+    if values.size == 0:
+        return np.empty(0)
+    uniq, inverse = np.unique(values, return_inverse=True)
+    try:
+        degs = np.array([parse_angle(v) for v in uniq.tolist()]) * scale
+    except ValueError as err:
+        raise nex.BadFitsHdrContent('Bad {}; {}'.format(name, err))
+    bad = (degs < lo) | (degs > hi)
+    if bad.any():
+        raise nex.BadFitsHdrContent('{} out of range [{},{}] deg: "{}"'
+                                    .format(name, lo, hi, uniq[bad][0]))
+    return degs[inverse]
+
+def ra_to_deg(values):
+    """Degrees of RA VALUES (hours; sexagesimal or decimal)"""
+    return to_degrees(values, 15.0, 0.0, 360.0, 'RA')
+
+def dec_to_deg(values):
+    """Degrees of DEC VALUES (degrees; sexagesimal or decimal)"""
+    return to_degrees(values, 1.0, -90.0, 90.0, 'DEC')
+
+def RAtodeg(sexstr):
+    return float(ra_to_deg([sexstr])[0])
+def DECtodeg(sexstr):
+    return float(dec_to_deg([sexstr])[0])
@@ -0,0 +1,90 @@
+"""
+How the total number of search matches is found.  An exact COUNT(*) over
+millions of rows takes seconds, so it should not be done on every page.
+
+  exact:: SELECT COUNT(*)
+  cached:: exact count, remembered per normalized query until the archive
+      generation changes (see generation.py)
+  estimate:: row estimate of the query plan (EXPLAIN); no rows are read
+  auto:: cached if available; else estimate, unless the estimate is small
+      enough (< EXACT_BELOW) that an exact count is cheap
+"""
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from django.db import connection
+
+from . import exceptions as nex
+from . import generation
+
+MODES = ('auto', 'exact', 'cached', 'estimate')
+EXACT_BELOW = 50000   # auto: count exactly if estimate is below this
+MAX_CACHED = 1000     # queries
+
+_lock = threading.Lock()
+_cache = OrderedDict() # query key -> (generation, count)
+
+def query_key(jsearch):
+    """Normalized (canonical JSON) form of search JSEARCH."""
+    return json.dumps(jsearch, sort_keys=True, separators=(',', ':'))
+
+def exact(qs):
+    return qs.count()
+
+def estimate(qs):
+    """Planner's estimate of number of rows of QS."""
+    sql, params = qs.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+def cached(key):
+    """Count remembered for KEY in current generation, else None."""
+    gen = generation.current()
+    with _lock:
+        hit = _cache.get(key)
+        if hit is None or hit[0] != gen:
+            return None
+        _cache.move_to_end(key)
+        return hit[1]
+
+def remember(key, count, gen):
+    with _lock:
+        _cache[key] = (gen, count)
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_CACHED:
+            _cache.popitem(last=False)
+
+def cached_exact(qs, key):
+    count = cached(key)
+    if count is None:
+        gen = generation.current() # before counting; a bump during is seen
+        count = exact(qs)
+        remember(key, count, gen)
+    return count
+
+def count(qs, jsearch, mode='auto'):
+    """Number of rows of QS (the result of search JSEARCH) by MODE.
+Return (count, mode actually used)."""
+    if mode not in MODES:
+        raise nex.UsageError('Unknown count mode "{}"; use one of: {}'
+                             .format(mode, ', '.join(MODES)))
+    key = query_key(jsearch)
+    if mode == 'exact':
+        return exact(qs), 'exact'
+    if mode == 'cached':
+        return cached_exact(qs, key), 'cached'
+    if mode == 'auto':
+        hit = cached(key)
+        if hit is not None:
+            return hit, 'cached'
+    est = estimate(qs)
+    if mode == 'auto' and est < EXACT_BELOW:
+        return cached_exact(qs, key), 'exact'
+    logging.debug('counting: estimate {} for {}'.format(est, key))
+    return est, 'estimate'
@@ -57,6 +57,18 @@ class InstrumentError(BaseNaticaException):
 
 class FitsError(BaseNaticaException):
     status_code = 400
+
+class BadFitsHdrContent(BaseNaticaException):
+    status_code = 400
+
+class ChecksumError(BaseNaticaException):
+    status_code = 400
+
+class UploadNotFound(BaseNaticaException):
+    status_code = 404
+
+class UploadOffsetError(BaseNaticaException):
+    status_code = 409
     
     
 class PropNotFound(BaseNaticaException):
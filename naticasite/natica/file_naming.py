@@ -1,6 +1,25 @@
+import os
+import uuid
 import datetime as dt
 from pathlib import PurePath 
 from . import settings
+from . import refdata
+
+def new_staging_path(suffix='.fits'):
+    '''Create (empty) uniquely named staging file. Return its path.
+Staging is under settings.staging_root so it can be renamed into archive.
+Created with the umask default mode (not mkstemp's 0600): it keeps its
+mode when renamed into the archive.'''
+    os.makedirs(settings.staging_root, exist_ok=True)
+    while True:
+        path = os.path.join(settings.staging_root,
+                            'upload-{}{}'.format(uuid.uuid4().hex, suffix))
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666)
+        except FileExistsError:
+            continue
+        os.close(fd)
+        return path
 
 def fits_extension(fname):
     '''Return extension of any file matching <basename>.fits.*, basename.fits
@@ -33,12 +52,12 @@ def generate_archive_path(hdr, ext='.fits.fz', tag=None):
 
 
     fnfields = dict(
-        prefix=settings.stiLUT.get((site, telescope, instrument), 'uuuu'),
+        prefix=refdata.file_prefix(site, telescope, instrument, 'uuuu'),
         date=date,
         time=time,
-        obstype=settings.obsLUT.get(obstype, 'u'),  # if not in LUT, use "u"!!!
-        proctype=settings.procLUT.get(proctype,'u'),
-        prodtype=settings.prodLUT.get(prodtype,'u'),
+        obstype=refdata.obs_code(obstype, 'u'),  # if not in LUT, use "u"!!!
+        proctype=refdata.proc_code(proctype,'u'),
+        prodtype=refdata.prod_code(prodtype,'u'),
         flavor=flavor, # optional (may be null string)
         ext=ext,
         )
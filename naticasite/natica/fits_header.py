@@ -0,0 +1,269 @@
+"""
+Extract FITS header cards without reading data units (and without astropy).
+
+HDU dicts produced here look like those from
+  [OrderedDict(hdu.header.items()) for hdu in astropy.io.fits.open(f)]
+including the image header astropy presents for tile-compressed HDUs
+(.fits.fz).  Data unit sizes are computed from BITPIX, NAXISn, PCOUNT,
+GCOUNT so data can be skipped (seek) rather than read.
+"""
+import os
+import re
+from collections import OrderedDict
+from functools import reduce
+from operator import mul
+
+from . import exceptions as nex
+
+BLOCK_SIZE = 2880
+CARD_SIZE = 80
+
+COMMENTARY_KEYS = {'COMMENT', 'HISTORY', ''}
+
+# Keywords that only describe the binary table used to hold a compressed
+# image.  Dropped (or mapped) to get the header of the image itself.
+_zmap = OrderedDict([('ZTENSION', 'XTENSION'),
+                     ('ZBITPIX', 'BITPIX'),
+                     ('ZNAXIS', 'NAXIS'),
+                     ('ZPCOUNT', 'PCOUNT'),
+                     ('ZGCOUNT', 'GCOUNT'),
+                     ('ZHECKSUM', 'CHECKSUM'),
+                     ('ZDATASUM', 'DATASUM'),
+])
+_ztable_re = re.compile(r'^(ZIMAGE|ZCMPTYPE|ZQUANTIZ|ZDITHER0|ZSIMPLE|ZEXTEND'
+                        r'|ZBLOCKED|ZTILE\d+|ZNAME\d+|ZVAL\d+|ZNAXIS\d+'
+                        r'|TFIELDS|THEAP|TTYPE\d+|TFORM\d+|TUNIT\d+|TNULL\d+'
+                        r'|TSCAL\d+|TZERO\d+|TDISP\d+|TDIM\d+'
+                        r'|XTENSION|BITPIX|NAXIS\d*|PCOUNT|GCOUNT'
+                        r'|CHECKSUM|DATASUM)$')
+
+def parse_value(valstr):
+    """Convert the value field of a card (after '= ') to a python value."""
+    s = valstr.lstrip()
+    if s.startswith("'"):
+        # String: embedded quotes are doubled, trailing blanks insignificant
+        chars = []
+        idx = 1
+        while idx < len(s):
+            c = s[idx]
+            if c == "'":
+                if s[idx+1:idx+2] == "'":
+                    chars.append("'")
+                    idx += 2
+                    continue
+                break
+            chars.append(c)
+            idx += 1
+        return ''.join(chars).rstrip()
+
+    token = s.split('/', 1)[0].strip()
+    if token == '':
+        return None  # undefined value
+    if token == 'T':
+        return True
+    if token == 'F':
+        return False
+    try:
+        return int(token)
+    except ValueError:
+        pass
+    try:
+        return float(token.replace('D', 'E'))
+    except ValueError:
+        pass
+    if token.startswith('(') and token.endswith(')'):
+        try:
+            re_, im_ = token[1:-1].split(',')
+            return complex(float(re_.replace('D', 'E')),
+                           float(im_.replace('D', 'E')))
+        except ValueError:
+            pass
+    return token
+
+def parse_card(card):
+    """Return (keyword, value) for one 80 character card image."""
+    key = card[:8].rstrip()
+    if key == 'HIERARCH':
+        if '=' not in card:
+            return key, card[8:].rstrip()
+        hkey, hval = card[8:].split('=', 1)
+        return hkey.strip(), parse_value(hval)
+    if (key in COMMENTARY_KEYS) or (card[8:10] != '= '):
+        return key, card[8:].rstrip()
+    return key, parse_value(card[10:])
+
+def parse_cards(cards):
+    """Convert list of card images (END excluded) into a header dict."""
+    hdr = OrderedDict()
+    prevkey = None
+    for card in cards:
+        key, value = parse_card(card)
+        if (key == 'CONTINUE'
+            and isinstance(hdr.get(prevkey), str)
+            and hdr[prevkey].endswith('&')):
+            # Long string convention
+            hdr[prevkey] = hdr[prevkey][:-1] + parse_value(card[8:])
+            continue
+        hdr[key] = value
+        prevkey = key
+    return hdr
+
+def data_size(hdr):
+    """Number of bytes (excluding padding) in data unit described by HDR."""
+    naxis = hdr.get('NAXIS', 0)
+    if naxis == 0:
+        return 0
+    dims = [hdr.get('NAXIS{}'.format(i), 0) for i in range(1, naxis+1)]
+    if hdr.get('GROUPS') is True and dims[0] == 0:
+        dims = dims[1:]  # random groups
+    nbits = (abs(hdr['BITPIX'])
+             * hdr.get('GCOUNT', 1)
+             * (hdr.get('PCOUNT', 0) + reduce(mul, dims, 1)))
+    return nbits // 8
+
+def padded(nbytes):
+    return -(-nbytes // BLOCK_SIZE) * BLOCK_SIZE
+
+def is_compressed(hdr):
+    return (hdr.get('XTENSION') == 'BINTABLE') and (hdr.get('ZIMAGE') is True)
+
+def image_header(hdr):
+    """Header of the image stored in a tile-compressed HDU (as astropy)."""
+    img = OrderedDict()
+    img['XTENSION'] = hdr.get('ZTENSION', 'IMAGE')
+    img['BITPIX'] = hdr['ZBITPIX']
+    img['NAXIS'] = hdr['ZNAXIS']
+    for i in range(1, hdr['ZNAXIS']+1):
+        img['NAXIS{}'.format(i)] = hdr['ZNAXIS{}'.format(i)]
+    img['PCOUNT'] = hdr.get('ZPCOUNT', 0)
+    img['GCOUNT'] = hdr.get('ZGCOUNT', 1)
+    for k in ('ZHECKSUM', 'ZDATASUM'):
+        if k in hdr:
+            img[_zmap[k]] = hdr[k]
+    for k, v in hdr.items():
+        if _ztable_re.match(k) or (k in _zmap):
+            continue
+        img[k] = v
+    return img
+
+
+class HeaderStream():
+    """Parse headers of a FITS byte stream fed in arbitrary sized pieces.
+Data units are skipped without being buffered.
+
+    hs = HeaderStream()
+    for chunk in chunks: hs.feed(chunk)
+    hdudicts = hs.close()
+
+After each HDU header, hs.offsets gets a dict of byte offsets (from start
+of stream): header, data (start of data unit), datasize (unpadded).
+"""
+    def __init__(self):
+        self.hdudicts = list()
+        self.offsets = list()
+        self._block = bytearray()
+        self._cards = list()
+        self._pos = 0      # bytes of stream consumed so far
+        self._hdrpos = 0   # offset of current header
+        self._skip = 0     # bytes of current data unit (+padding) to skip
+        self._pad = 0      # padding at end of current data unit
+        self._trailing = False # saw non-HDU bytes after last HDU
+
+    @property
+    def done(self):
+        """True if remaining bytes of stream are not HDUs."""
+        return self._trailing
+
+    @property
+    def to_skip(self):
+        """Bytes of data unit (+padding) that the next feed would skip."""
+        return self._skip
+
+    def skip(self, nbytes):
+        """Caller bypassed NBYTES of data unit (e.g. with seek)."""
+        nbytes = min(nbytes, self._skip)
+        self._skip -= nbytes
+        self._pos += nbytes
+
+    def feed(self, data):
+        pos = 0
+        size = len(data)
+        while pos < size:
+            if self._trailing:
+                return
+            if self._skip > 0:
+                nskip = min(self._skip, size - pos)
+                self.skip(nskip)
+                pos += nskip
+                continue
+            need = BLOCK_SIZE - len(self._block)
+            piece = data[pos:pos+need]
+            self._block += piece
+            pos += len(piece)
+            self._pos += len(piece)
+            if len(self._block) == BLOCK_SIZE:
+                self._header_block(bytes(self._block))
+                self._block.clear()
+
+    def _header_block(self, block):
+        text = block.decode('ascii', errors='replace')
+        if len(self._cards) == 0:
+            first = text[:8]
+            if len(self.hdudicts) == 0 and first != 'SIMPLE  ':
+                raise nex.FitsError('Not a FITS file (no SIMPLE card)')
+            if len(self.hdudicts) > 0 and first != 'XTENSION':
+                self._trailing = True # junk or padding after last HDU
+                return
+            self._hdrpos = self._pos - BLOCK_SIZE
+        for idx in range(0, BLOCK_SIZE, CARD_SIZE):
+            card = text[idx:idx+CARD_SIZE]
+            if card.rstrip() == 'END':
+                self._end_header()
+                return
+            self._cards.append(card)
+
+    def _end_header(self):
+        raw = parse_cards(self._cards)
+        self._cards = list()
+        try:
+            nbytes = data_size(raw)
+        except (KeyError, TypeError) as err:
+            raise nex.FitsError('Bad data unit description in HDU {}; {}'
+                                .format(len(self.hdudicts), err))
+        self._skip = padded(nbytes)
+        self._pad = self._skip - nbytes
+        self.offsets.append(dict(header=self._hdrpos,
+                                 data=self._pos,
+                                 datasize=nbytes))
+        self.hdudicts.append(image_header(raw) if is_compressed(raw) else raw)
+
+    def close(self):
+        """Return list of HDU dicts. Raise if stream ended inside an HDU."""
+        if len(self.hdudicts) == 0 or len(self._cards) > 0:
+            raise nex.FitsError('Truncated FITS header')
+        if len(self._block) > 0 and not self._trailing:
+            raise nex.FitsError('Truncated FITS header')
+        if self._skip > self._pad:
+            raise nex.FitsError('Truncated FITS data unit ({} bytes missing)'
+                                .format(self._skip - self._pad))
+        return self.hdudicts
+
+
+def read_headers(fitsfile, offsets=False):
+    """Return list of HDU dicts from FITSFILE (.fits or .fits.fz) reading
+only header blocks.  If OFFSETS, return (hdudicts, offsets) where offsets
+are as in HeaderStream.offsets."""
+    hs = HeaderStream()
+    filesize = os.path.getsize(fitsfile)
+    with open(fitsfile, 'rb') as f:
+        while not hs.done:
+            if hs.to_skip > 0:
+                nbytes = min(hs.to_skip, filesize - f.tell())
+                f.seek(nbytes, os.SEEK_CUR)
+                hs.skip(nbytes)
+            block = f.read(BLOCK_SIZE)
+            if len(block) == 0:
+                break
+            hs.feed(block)
+    hdudicts = hs.close()
+    return (hdudicts, hs.offsets) if offsets else hdudicts
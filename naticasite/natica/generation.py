@@ -0,0 +1,44 @@
+"""
+Archive generation: changes whenever FitsFile metadata is stored or
+updated.  Anything computed from search results (counts, cached result
+pages) is valid only for the generation it was computed in.
+
+The generation is the mtime of settings.search_generation_stamp, so every
+worker sees a bump by any other worker (one stat per lookup), plus a
+counter for bumps made in this process.
+"""
+import os
+import time
+import logging
+import threading
+
+from . import settings
+
+_lock = threading.Lock()
+_local = 0
+
+def current():
+    try:
+        stamp = os.stat(settings.search_generation_stamp).st_mtime_ns
+    except OSError:
+        stamp = 0
+    return (stamp, _local)
+
+def bump():
+    """Invalidate everything computed from earlier generations."""
+    global _local
+    with _lock:
+        _local += 1
+    path = settings.search_generation_stamp
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            old = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            open(path, 'a').close()
+            old = 0
+        new = max(int(time.time() * 1e9), old + 1)
+        os.utime(path, ns=(new, new))
+    except OSError as err:
+        logging.warning('generation: could not touch {}; other workers may '
+                        'serve stale search counts. {}'.format(path, err))
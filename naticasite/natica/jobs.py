@@ -0,0 +1,126 @@
+"""
+Asynchronous ingest.  An upload is staged (durably) and queued as an
+IngestJob row; the client gets the job id immediately.  Ingest workers
+(manage.py ingest_worker) claim queued jobs and run the rest of the
+pipeline: placement into archive and storing metadata.
+
+A claimed job is leased to its worker for settings.ingest_job_lease
+seconds.  If the worker dies the job stays 'running'; once the lease is
+over another worker claims it again.  Only the worker holding the
+current lease records the outcome.
+"""
+import time
+import datetime
+import logging
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import IngestJob
+from . import exceptions as nex
+from . import fits_header
+from . import settings
+from .upload_handlers import StagedFitsFile
+
+
+def enqueue(f, md5sum, overwrite=False):
+    """Queue staged upload F (StagedFitsFile) for ingest. Return IngestJob.
+Checks that need no archive state are done now so the client hears about
+a bad upload immediately."""
+    from .views import validate_header
+    if f.md5sum != md5sum:
+        raise nex.ChecksumError(
+            'Checksum mismatch for {}; client={}, server={}'
+            .format(f.name, md5sum, f.md5sum))
+    if f.fits_error is not None:
+        raise f.fits_error
+    validate_header(f.hdudicts)
+    return IngestJob.objects.create(staged_path=f.temporary_file_path(),
+                                    name=f.name,
+                                    md5sum=f.md5sum,
+                                    size=f.size,
+                                    overwrite=overwrite)
+
+def claim_next():
+    """Mark oldest queued job (or running job whose lease is over) as
+running and return it (None if no jobs).  Safe with many workers: rows
+locked by another worker are skipped."""
+    expired = timezone.now() - datetime.timedelta(
+        seconds=settings.ingest_job_lease)
+    with transaction.atomic():
+        job = (IngestJob.objects
+               .select_for_update(skip_locked=True)
+               .filter(Q(state='queued')
+                       | Q(state='running', started__lt=expired))
+               .order_by('id')
+               .first())
+        if job is None:
+            return None
+        if job.state == 'running':
+            logging.warning('Ingest job {} lease (started {}) is over;'
+                            ' running it again'.format(job.id, job.started))
+        job.state = 'running'
+        job.started = timezone.now()
+        job.save(update_fields=['state', 'started'])
+    return job
+
+def run_job(job):
+    """Archive staged file of JOB and store its metadata.  The staged file
+is gone afterwards, whether or not the job succeeded."""
+    from .views import handle_uploaded_file, silentremove
+    try:
+        f = StagedFitsFile(job.staged_path, job.name, 'application/fits',
+                           job.size, None, job.md5sum,
+                           fits_header.read_headers(job.staged_path), None)
+        try:
+            job.archive_filename = handle_uploaded_file(
+                f, job.md5sum, overwrite=job.overwrite)
+        finally:
+            f.close()
+        job.state = 'done'
+    except nex.BaseNaticaException as err:
+        job.state = 'failed'
+        job.error = err.error_message
+    except Exception as err:
+        logging.exception('Ingest job {} failed'.format(job.id))
+        job.state = 'failed'
+        job.error = 'Unexpected Error: {}'.format(err)
+    finally:
+        silentremove(job.staged_path) # only still there if we failed
+    job.finished = timezone.now()
+    # Not if our lease ran out and another worker claimed the job since
+    (IngestJob.objects
+     .filter(pk=job.pk, state='running', started=job.started)
+     .update(state=job.state, archive_filename=job.archive_filename,
+             error=job.error, finished=job.finished))
+    return job
+
+def work(poll=2.0, once=False):
+    """Process queued jobs until killed (or queue is empty if ONCE).
+Sleep POLL seconds whenever the queue is empty."""
+    count = 0
+    while True:
+        job = claim_next()
+        if job is None:
+            if once:
+                return count
+            time.sleep(poll)
+            continue
+        run_job(job)
+        logging.info('Ingest job {} {}: {} {}'
+                     .format(job.id, job.state, job.name,
+                             job.archive_filename or job.error))
+        count += 1
+
+def status(job):
+    """Dict describing JOB for status response."""
+    return dict(job_id=job.id,
+                state=job.state,
+                name=job.name,
+                md5sum=job.md5sum,
+                archive_filename=job.archive_filename or None,
+                errorMessage=job.error or None,
+                submitted=job.submitted,
+                started=job.started,
+                finished=job.finished)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from natica import resumable
+
+# Remove resumable uploads that were abandoned (never finished).
+#
+# EXAMPLE (from cron):
+#   python3 manage.py expire_uploads --hours 48
+
+class Command(BaseCommand):
+    help = 'Remove partial resumable uploads not written to recently.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=48.0,
+                            help='Remove uploads idle longer than this')
+
+    def handle(self, *args, **options):
+        removed = resumable.expire(options['hours'] * 3600)
+        self.stdout.write(self.style.SUCCESS(
+            'Removed {} partial uploads'.format(len(removed))))
@@ -0,0 +1,62 @@
+# Measure ingest throughput of the store service vs. number of concurrent clients.
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+import requests
+from natica.views import md5
+
+# EXAMPLES:
+#   Server must run enough workers to service the concurrent uploads, e.g.:
+#     gunicorn -w 8 naticasite.wsgi -b 0.0.0.0:8000
+#   then:
+#     find /data/tada-test-data/basic -name "*.fits.fz" -print0 | xargs -0 python3 manage.py ingest_throughput --clients 1,2,4,8
+#
+# Files are re-ingested with overwrite=13 so every pass stores every file.
+# Output is one row per client count: files/sec and MB/sec (wall clock).
+
+def post(url, path, md5sum):
+    with open(path, 'rb') as f:
+        r = requests.post(url,
+                          params=dict(overwrite=13),
+                          data=dict(md5sum=md5sum),
+                          files={'file':f})
+    return r.status_code
+
+
+class Command(BaseCommand):
+    help = 'Report ingest throughput for 1,2,4,8 (etc) concurrent uploads.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('fits', nargs='+',
+                            help='Path to FITS file to ingest into NATICA' )
+        parser.add_argument('--clients', default='1,2,4,8',
+                            help='Comma separated list of concurrency levels')
+        parser.add_argument('--url',
+                            default='http://0.0.0.0:8000/natica/store/',
+                            help='URL of NATICA store service')
+
+    def handle(self, *args, **options):
+        files = options['fits']
+        sums = dict((f, md5(f)) for f in files)
+        nbytes = sum(os.path.getsize(f) for f in files)
+        levels = [int(n) for n in options['clients'].split(',')]
+
+        self.stdout.write('{:>8} {:>8} {:>10} {:>10} {:>8}'
+                          .format('clients','files','files/s','MB/s','errors'))
+        for nclients in levels:
+            start = time.time()
+            with ThreadPoolExecutor(max_workers=nclients) as pool:
+                codes = list(pool.map(lambda f: post(options['url'],
+                                                     f, sums[f]),
+                                      files))
+            elapsed = time.time() - start
+            errors = len([c for c in codes if c != 200])
+            self.stdout.write('{:>8} {:>8} {:>10.2f} {:>10.2f} {:>8}'
+                              .format(nclients, len(files),
+                                      len(files)/elapsed,
+                                      nbytes/elapsed/1e6,
+                                      errors))
+            if errors == len(files):
+                raise CommandError('All uploads failed with {} clients'
+                                   .format(nclients))
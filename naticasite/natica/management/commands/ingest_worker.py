@@ -0,0 +1,47 @@
+import multiprocessing
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from natica import jobs
+
+# Process asynchronous ingest jobs (queued by POST /natica/store/?async=1).
+#
+# EXAMPLES:
+#   python3 manage.py ingest_worker --processes 4
+#   python3 manage.py ingest_worker --once    # drain queue then exit
+
+def worker(poll, once):
+    return jobs.work(poll=poll, once=once)
+
+class Command(BaseCommand):
+    help = 'Run pool of workers that process queued ingest jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Number of worker processes')
+        parser.add_argument('--poll', type=float, default=2.0,
+                            help='Seconds to sleep when queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit when queue is empty')
+
+    def handle(self, *args, **options):
+        nproc = options['processes']
+        if nproc == 1:
+            count = worker(options['poll'], options['once'])
+            self.stdout.write(self.style.SUCCESS(
+                'Processed {} ingest jobs'.format(count)))
+            return
+
+        # Each process must open its own DB connection.
+        connections.close_all()
+        procs = [multiprocessing.Process(target=worker,
+                                         args=(options['poll'],
+                                               options['once']))
+                 for i in range(nproc)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        failed = [p for p in procs if p.exitcode != 0]
+        if len(failed) > 0:
+            raise CommandError('{}/{} worker processes failed'
+                               .format(len(failed), nproc))
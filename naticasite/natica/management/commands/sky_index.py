@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from natica.models import FitsFile
+from natica import sky
+
+# Compute the sky index (cone search) of FitsFiles stored before it
+# existed.  New files get it at ingest.
+#
+# EXAMPLE:
+#   python3 manage.py sky_index
+#   python3 manage.py sky_index --all   # recompute (e.g. ZONE_HEIGHT changed)
+
+class Command(BaseCommand):
+    help = 'Compute sky index (sky_cells, center, fov_radius) of FitsFiles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute for every file, not just missing')
+
+    def handle(self, *args, **options):
+        qs = FitsFile.objects.exclude(ra=None).exclude(dec=None)
+        if not options['all']:
+            qs = qs.filter(sky_cells=None)
+        updated = sky.backfill(qs)
+        self.stdout.write(self.style.SUCCESS(
+            'Indexed {} files'.format(updated)))
@@ -0,0 +1,81 @@
+import json
+import time
+import tracemalloc
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from psycopg2.extras import NumericRange, DateRange
+import astropy.coordinates as coord
+import astropy.units as u
+from natica.aggregate import aggregate_hdus
+
+# Compare time and memory of aggregating HDU header values for a FitsFile:
+# the previous implementation (set of every value of every keyword, then
+# ranges recomputed) vs. natica.aggregate (one pass, per-keyword modes).
+#
+# EXAMPLES:
+#   python3 manage.py time_aggregate --hdus 70 /data/small-json-scrape/c4d_170815_054546_ori.fits.json
+
+def RAtodeg(sexstr):
+    return coord.Angle(sexstr, unit=u.h).degree
+def DECtodeg(sexstr):
+    return coord.Angle(sexstr, unit=u.deg).degree
+
+def legacy_aggregate(hdudict_list):
+    """views.aggregate_extras() + get_range_values() before natica.aggregate"""
+    agg = defaultdict(set)
+    for hdudict in hdudict_list:
+        for k,v in hdudict.items():
+            agg[k].add(v)
+    list_agg = dict()
+    for k in agg:
+        list_agg[k] = list(agg[k])
+    ra = dec = exposure = None
+    dateobs = DateRange(min(agg['DATE-OBS']), max(agg['DATE-OBS']), bounds='[]')
+    if 'RA' in agg:
+        vals = [RAtodeg(val) for val in agg['RA']]
+        ra = NumericRange(min(vals), max(vals), '[]')
+    if 'DEC' in agg:
+        vals = [DECtodeg(val) for val in agg['DEC']]
+        dec = NumericRange(min(vals), max(vals), '[]')
+    if 'EXPTIME' in agg:
+        exposure = NumericRange(min(agg['EXPTIME']), max(agg['EXPTIME']),'[]')
+    range_dict = {'RA': ra, 'DEC': dec, 'EXPTIME': exposure,
+                  'DATE-OBS': dateobs}
+    list_agg.update(range_dict)
+    return list_agg, set(range_dict.keys())
+
+class Command(BaseCommand):
+    help = 'Time aggregation of HDU values into FitsFile (legacy vs one-pass).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('jfits', nargs='+',
+                            help='Path to json file (list of HDU dicts)' )
+        parser.add_argument('--hdus', type=int, default=0,
+                            help=('Pad each file to this many HDUs by '
+                                  'repeating its last HDU (with new EXTNAME)'))
+        parser.add_argument('--repeat', type=int, default=200,
+                            help='Number of aggregations per file')
+
+    def handle(self, *args, **options):
+        nrep = options['repeat']
+        for jfits in options['jfits']:
+            with open(jfits) as f:
+                hdudict_list = json.load(f)
+            while len(hdudict_list) < options['hdus']:
+                hdudict_list.append(dict(hdudict_list[-1],
+                                         EXTNAME='X{}'.format(len(hdudict_list))))
+            self.stdout.write('{}: {} HDUs, {} cards'
+                              .format(jfits, len(hdudict_list),
+                                      sum(len(h) for h in hdudict_list)))
+            for name,func in [('legacy', legacy_aggregate),
+                              ('one-pass', aggregate_hdus)]:
+                tracemalloc.start()
+                func(hdudict_list)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                start = time.time()
+                for i in range(nrep):
+                    func(hdudict_list)
+                elapsed = time.time() - start
+                self.stdout.write('{:>10}: {:8.1f} usec/file, peak {:7.1f} KiB'
+                                  .format(name, 1e6*elapsed/nrep, peak/1024))
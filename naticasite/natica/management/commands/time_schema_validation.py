@@ -0,0 +1,47 @@
+import json
+import time
+import jsonschema
+from django.core.management.base import BaseCommand, CommandError
+from natica import schemas
+
+# Compare cost per request of schema validation: re-reading the schema file
+# every time (old behavior) vs. cached compiled validator.
+#
+# EXAMPLES:
+#   python3 manage.py time_schema_validation natica/search-requests/search-1.json
+#   python3 manage.py time_schema_validation --schema fits_header /data/small-json-scrape/c4d_170815_054546_ori.fits.json
+
+class Command(BaseCommand):
+    help = 'Time JSON schema validation per request (uncached vs cached).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('instance',
+                            help='JSON file containing instance to validate')
+        parser.add_argument('--schema', default='search',
+                            choices=['search', 'fits_header'],
+                            help='Which schema to validate against')
+        parser.add_argument('--repeat', type=int, default=1000,
+                            help='Number of validations')
+
+    def handle(self, *args, **options):
+        cached = getattr(schemas, options['schema'])
+        with open(options['instance']) as f:
+            instance = json.load(f)
+        nrep = options['repeat']
+
+        def uncached():
+            with open(cached.schemafile) as f:
+                jsonschema.validate(instance, json.load(f))
+
+        for name,func in [('uncached', uncached),
+                          ('cached', lambda: cached.validate(instance))]:
+            start = time.time()
+            try:
+                for i in range(nrep):
+                    func()
+            except jsonschema.ValidationError as err:
+                raise CommandError('Instance does not validate; {}'
+                                   .format(err))
+            elapsed = time.time() - start
+            self.stdout.write('{:>10}: {:8.1f} usec/request'
+                              .format(name, 1e6*elapsed/nrep))
@@ -0,0 +1,87 @@
+import time
+import importlib
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from natica.models import FitsFile
+from natica.proto import TRY_QUERIES
+from natica.search_service import make_qobj
+
+# Run each proto.TRY_QUERIES search with and without the search indexes
+# (migration 0010) and print plans and timings.  "Without" drops the
+# indexes inside a transaction that is rolled back: it holds an exclusive
+# lock on the tables meanwhile, so run it against a copy, not production.
+#
+# EXAMPLES:
+#   python3 manage.py time_search_indexes
+#   python3 manage.py time_search_indexes --plans --repeat 5 exposure obs_date
+
+INDEXES = importlib.import_module('natica.migrations.0010_search_indexes').INDEXES
+
+class Rollback(Exception):
+    pass
+
+def explain(qs):
+    sql, params = qs.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN ANALYZE ' + sql, params)
+        return '\n'.join(row[0] for row in cursor.fetchall())
+
+def run(qs, nrep):
+    """(msec per run, rows) of QS.  Each run is a fresh clone of QS, so it
+goes to the database (QS itself never fills its result cache)."""
+    start = time.time()
+    for i in range(nrep):
+        rows = len(list(qs.all()))
+    return 1e3 * (time.time() - start) / nrep, rows
+
+class Command(BaseCommand):
+    help = 'Time proto.TRY_QUERIES searches with and without search indexes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*',
+                            help=('Searches to run (default all): {}'
+                                  .format(', '.join(TRY_QUERIES))))
+        parser.add_argument('--plans', action='store_true',
+                            help='Print EXPLAIN ANALYZE of each search')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Number of runs of each search')
+
+    def querysets(self, names):
+        for name in names:
+            # The filter of the search (what the indexes are for)
+            qs = FitsFile.objects.filter(make_qobj(TRY_QUERIES[name]))
+            yield name, qs.order_by().values_list('id', flat=True)
+
+    def measure(self, names, nrep, plans):
+        results = dict()
+        for name,qs in self.querysets(names):
+            list(qs.all()) # warm database buffers
+            results[name] = run(qs, nrep)
+            if plans:
+                results[name] += (explain(qs),)
+        return results
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(TRY_QUERIES)
+        nrep = options['repeat']
+        with_idx = self.measure(names, nrep, options['plans'])
+        try:
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    for name,_,_ in INDEXES:
+                        cursor.execute('DROP INDEX IF EXISTS {}'.format(name))
+                without_idx = self.measure(names, nrep, options['plans'])
+                raise Rollback()
+        except Rollback:
+            pass
+
+        self.stdout.write('{:>14} {:>7} {:>14} {:>14}'
+                          .format('search', 'rows', 'without (ms)', 'with (ms)'))
+        for name in names:
+            before, after = without_idx[name], with_idx[name]
+            self.stdout.write('{:>14} {:>7} {:>14.2f} {:>14.2f}'
+                              .format(name, after[1], before[0], after[0]))
+            if options['plans']:
+                self.stdout.write('--- {} without indexes:\n{}\n'
+                                  '--- {} with indexes:\n{}\n'
+                                  .format(name, before[2], name, after[2]))
@@ -0,0 +1,81 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from natica.models import FitsFile
+from natica import search_results
+
+# Compare time and number of queries to build search "resultset" dicts:
+# the previous implementation (model instance per row, extras blob decoded,
+# telescope and instrument fetched per row) vs. natica.search_results
+# (only the response columns, keywords extracted in SQL).
+#
+# EXAMPLES:
+#   python3 manage.py time_search_serializer
+#   python3 manage.py time_search_serializer --limit 100 --limit 10000 --repeat 5
+
+def legacy_results(qs):
+    """natica.views.search() loop before natica.search_results"""
+    results = list()
+    for fobj in qs:
+        ra = [fobj.ra.lower, fobj.ra.upper] if fobj.ra != None else None
+        dec = [fobj.dec.lower, fobj.dec.upper] if fobj.dec != None else None
+        exposure = [fobj.exposure.lower, fobj.exposure.upper] if fobj.exposure != None else None
+        obsdate = [fobj.date_obs.lower, fobj.date_obs.upper] if fobj.date_obs != None else None
+        results.append(
+            dict(
+                id=fobj.id,
+                ra=ra,
+                dec=dec,
+                exposure=exposure,
+                filename=fobj.archive_filename,
+                filesize=fobj.filesize,
+                filter=fobj.extras.get('FILTER'),
+                image_type=fobj.extras.get('IMAGETYP'),
+                instrument=fobj.instrument.name,
+                md5sum=fobj.md5sum,
+                obs_date=obsdate,
+                observation_mode=fobj.extras.get('OBSMODE'),
+                observation_type=fobj.extras.get('OBSTYPE'),
+                original_filename=fobj.original_filename,
+                pi=fobj.extras.get('PROPOSER'),
+                product=fobj.extras.get('PRODTYPE'),
+                prop_id=fobj.extras.get('DTPROPID'),
+                release_date=fobj.release_date,
+                seeing=fobj.extras.get('SEEING'),
+                telescope=fobj.telescope.name,
+            ))
+    return results
+
+class Command(BaseCommand):
+    help = 'Time building search result pages (legacy ORM loop vs projection).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, action='append',
+                            help='Page size (repeatable; default 100, 10000)')
+        parser.add_argument('--order', default='original_filename',
+                            help='FitsFile field to order by')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Number of pages built per page size')
+
+    def handle(self, *args, **options):
+        nrep = options['repeat']
+        total = FitsFile.objects.count()
+        self.stdout.write('{} FitsFile rows'.format(total))
+        for limit in options['limit'] or [100, 10000]:
+            qs = FitsFile.objects.order_by(options['order'], 'id')[:limit]
+            for name,func in [('legacy', legacy_results),
+                              ('projection', search_results.fetch)]:
+                # Fresh clone of QS each time: a reused queryset would
+                # serve its cached rows (and FK objects) without the DB
+                with CaptureQueriesContext(connection) as queries:
+                    rows = func(qs.all())
+                nqueries = len(queries)
+                start = time.time()
+                for i in range(nrep):
+                    func(qs.all())
+                elapsed = time.time() - start
+                self.stdout.write('limit={:<6} {:>10}: {:5} rows, {:5} queries,'
+                                  ' {:9.1f} msec/page'
+                                  .format(limit, name, len(rows), nqueries,
+                                          1e3*elapsed/nrep))
@@ -0,0 +1,56 @@
+import json
+import time
+import hashlib
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from natica.views import store_metadata
+
+# Report DB cost (time, number of SQL statements) of storing metadata for
+# one FITS file.  Nothing is left in the DB (each store is rolled back).
+#
+# EXAMPLES:
+#   Pad a scraped header to 70 HDUs (like a DECam file), 20 repetitions:
+#     python3 manage.py time_store_metadata --hdus 70 --repeat 20 /data/small-json-scrape/c4d_170815_054546_ori.fits.json
+
+class Command(BaseCommand):
+    help = 'Time store_metadata() for JSON files that contain FITS HDUs as dicts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('jfits', nargs='+',
+                            help='Path to json file (list of HDU dicts)' )
+        parser.add_argument('--hdus', type=int, default=0,
+                            help=('Pad each file to this many HDUs by '
+                                  'repeating its last HDU'))
+        parser.add_argument('--repeat', type=int, default=10,
+                            help='Number of times to store each file')
+
+    def handle(self, *args, **options):
+        for jfits in options['jfits']:
+            with open(jfits) as f:
+                hdudict_list = json.load(f)
+            while len(hdudict_list) < options['hdus']:
+                hdudict_list.append(dict(hdudict_list[-1]))
+
+            elapsed = list()
+            for rep in range(options['repeat']):
+                valdict = dict(
+                    src_fname = jfits,
+                    arch_fname = jfits,
+                    md5sum = hashlib.md5('{}{}'.format(jfits,rep)
+                                         .encode()).hexdigest(),
+                    size = 0)
+                with CaptureQueriesContext(connection) as ctx:
+                    start = time.time()
+                    try:
+                        with transaction.atomic():
+                            store_metadata(hdudict_list, valdict)
+                            transaction.set_rollback(True)
+                    except Exception as err:
+                        raise CommandError('Could not store {}; {}'
+                                           .format(jfits, err))
+                    elapsed.append(time.time() - start)
+            self.stdout.write(
+                '{}: {} HDUs, {} SQL statements, {:.2f} ms/file (min {:.2f})'
+                .format(jfits, len(hdudict_list), len(ctx.captured_queries),
+                        1000*sum(elapsed)/len(elapsed), 1000*min(elapsed)))
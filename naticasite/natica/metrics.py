@@ -0,0 +1,68 @@
+"""
+Per-stage ingest timing.  Each stage of ingest (receive upload, validate,
+place into archive, store metadata, whole ingest) is timed and its bytes
+counted.  The most recent samples of each stage (at most MAX_SAMPLES, no
+older than WINDOW seconds) are summarized as percentiles and rates.
+
+Counters are per process (each gunicorn worker has its own).
+"""
+import time
+import threading
+from collections import deque, defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+WINDOW = 600.0       # seconds
+MAX_SAMPLES = 5000   # per stage
+
+_lock = threading.Lock()
+_samples = defaultdict(lambda: deque(maxlen=MAX_SAMPLES)) # stage -> (end,secs,bytes)
+_errors = defaultdict(int)  # stage -> count (all time)
+
+def record(stage, seconds, nbytes=0):
+    with _lock:
+        _samples[stage].append((time.time(), seconds, nbytes))
+
+@contextmanager
+def timer(stage, nbytes=0):
+    """Time body as STAGE (of NBYTES).  If body raises, only an error is
+counted."""
+    start = time.perf_counter()
+    try:
+        yield
+    except:
+        with _lock:
+            _errors[stage] += 1
+        raise
+    record(stage, time.perf_counter() - start, nbytes)
+
+def reset():
+    with _lock:
+        _samples.clear()
+        _errors.clear()
+
+def summary(now=None):
+    """Dict keyed by stage of: count, errors, p50/p95/p99/max (ms),
+files_per_sec, mb_per_sec over recent samples."""
+    now = time.time() if now is None else now
+    with _lock:
+        stages = dict((stage, [s for s in samples if s[0] >= now - WINDOW])
+                      for stage,samples in _samples.items())
+        errors = dict(_errors)
+    result = dict()
+    for stage in sorted(set(stages) | set(errors)):
+        recent = stages.get(stage, [])
+        info = dict(count=len(recent), errors=errors.get(stage, 0))
+        if recent:
+            ends, secs, nbytes = (np.array(col) for col in zip(*recent))
+            span = max(now - (ends - secs).min(), 1e-6)
+            p50, p95, p99 = np.percentile(secs, [50, 95, 99]) * 1000
+            info.update(p50_ms=round(p50, 3),
+                        p95_ms=round(p95, 3),
+                        p99_ms=round(p99, 3),
+                        max_ms=round(secs.max() * 1000, 3),
+                        files_per_sec=round(len(recent) / span, 3),
+                        mb_per_sec=round(nbytes.sum() / 1e6 / span, 3))
+        result[stage] = info
+    return dict(window_sec=WINDOW, stages=result)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def load_luts(apps, schema_editor):
+    """Seed filename lookup tables from the LUTs formerly in natica.settings"""
+    from natica import settings as nsettings
+    FilePrefix = apps.get_model('natica', 'FilePrefix')
+    ObsType = apps.get_model('natica', 'ObsType')
+    ProcType = apps.get_model('natica', 'ProcType')
+    ProdType = apps.get_model('natica', 'ProdType')
+
+    FilePrefix.objects.bulk_create(
+        [FilePrefix(site=site, telescope=tele, instrument=inst, prefix=prefix)
+         for (site,tele,inst),prefix in nsettings.stiLUT.items()])
+    ObsType.objects.bulk_create([ObsType(name=k, code=v)
+                                 for k,v in nsettings.obsLUT.items()])
+    ProcType.objects.bulk_create([ProcType(name=k, code=v)
+                                  for k,v in nsettings.procLUT.items()])
+    ProdType.objects.bulk_create([ProdType(name=k, code=v)
+                                  for k,v in nsettings.prodLUT.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('natica', '0005_auto_20180108_1602'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FilePrefix',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('site', models.CharField(help_text='DTSITE (lowercase)', max_length=10)),
+                ('telescope', models.CharField(help_text='DTTELESC (lowercase)', max_length=10)),
+                ('instrument', models.CharField(help_text='DTINSTRU (lowercase)', max_length=20)),
+                ('prefix', models.CharField(help_text='Prefix for archive filename', max_length=4)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='fileprefix',
+            unique_together=set([('site', 'telescope', 'instrument')]),
+        ),
+        migrations.CreateModel(
+            name='ObsType',
+            fields=[
+                ('name', models.CharField(help_text='OBSTYPE (lowercase)', max_length=40, primary_key=True, serialize=False)),
+                ('code', models.CharField(help_text='Code used in filename', max_length=2)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProcType',
+            fields=[
+                ('name', models.CharField(help_text='PROCTYPE (lowercase)', max_length=40, primary_key=True, serialize=False)),
+                ('code', models.CharField(help_text='Code used in filename', max_length=2)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProdType',
+            fields=[
+                ('name', models.CharField(help_text='PRODTYPE (lowercase)', max_length=40, primary_key=True, serialize=False)),
+                ('code', models.CharField(help_text='Code used in filename', max_length=2)),
+            ],
+        ),
+        migrations.RunPython(load_luts, migrations.RunPython.noop),
+    ]
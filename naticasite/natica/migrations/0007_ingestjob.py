@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('natica', '0006_reference_luts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.CharField(choices=[('queued', 'queued'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], db_index=True, default='queued', max_length=8)),
+                ('staged_path', models.TextField(help_text='Upload as staged on server')),
+                ('name', models.TextField(help_text='Filename as given by client')),
+                ('md5sum', models.CharField(max_length=32)),
+                ('size', models.BigIntegerField()),
+                ('overwrite', models.BooleanField(default=False)),
+                ('archive_filename', models.TextField(blank=True)),
+                ('error', models.TextField(blank=True)),
+                ('submitted', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(null=True)),
+                ('finished', models.DateTimeField(null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('natica', '0007_ingestjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fitsfile',
+            index=models.Index(fields=['original_filename', 'id'], name='fitsfile_origfname_id'),
+        ),
+        migrations.AddIndex(
+            model_name='fitsfile',
+            index=models.Index(fields=['archive_filename', 'id'], name='fitsfile_archfname_id'),
+        ),
+        migrations.AddIndex(
+            model_name='fitsfile',
+            index=models.Index(fields=['release_date', 'id'], name='fitsfile_release_id'),
+        ),
+        migrations.AddIndex(
+            model_name='fitsfile',
+            index=models.Index(fields=['filesize', 'id'], name='fitsfile_filesize_id'),
+        ),
+    ]
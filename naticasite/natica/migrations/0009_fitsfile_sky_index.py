@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('natica', '0008_fitsfile_order_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fitsfile',
+            name='ra_center',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='fitsfile',
+            name='dec_center',
+            field=models.FloatField(null=True),
+        ),
+        migrations.AddField(
+            model_name='fitsfile',
+            name='fov_radius',
+            field=models.FloatField(help_text='Degrees from center to corners', null=True),
+        ),
+        migrations.AddField(
+            model_name='fitsfile',
+            name='sky_cells',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), null=True, size=None),
+        ),
+        migrations.AddIndex(
+            model_name='fitsfile',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['sky_cells'], name='fitsfile_sky_cells'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+# Indexes for search filters (see search_filters.py).  Django 1.11 cannot
+# declare these in Meta.indexes (no GiST, no operator classes), so they
+# are plain SQL.  Built CONCURRENTLY so ingest is not blocked on a big
+# table; that cannot run in a transaction, hence atomic = False.
+INDEXES = [
+    # (name, table, method and columns)
+    # __overlap on RA, DEC, EXPTIME ranges
+    ('fitsfile_ra_gist', 'natica_fitsfile', 'USING gist (ra)'),
+    ('fitsfile_dec_gist', 'natica_fitsfile', 'USING gist (dec)'),
+    ('fitsfile_exposure_gist', 'natica_fitsfile', 'USING gist (exposure)'),
+    # Files arrive in roughly DATE-OBS order, so block ranges of date_obs
+    # barely overlap: a BRIN index is a few pages instead of a GiST tree.
+    ('fitsfile_date_obs_brin', 'natica_fitsfile',
+     'USING brin (date_obs range_inclusion_ops)'),
+    # extras @> {...}
+    ('fitsfile_extras_gin', 'natica_fitsfile',
+     'USING gin (extras jsonb_path_ops)'),
+    # extras ?| keys (has_any_keys); needs the default jsonb_ops
+    ('hdu_extras_gin', 'natica_hdu', 'USING gin (extras)'),
+]
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('natica', '0009_fitsfile_sky_index'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} {}'
+            .format(name, table, using),
+            reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS {}'.format(name))
+        for name, table, using in INDEXES
+    ]
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# Copy header keywords from FitsFile.extras into their new columns, one
+# range of ids per statement (and per transaction: atomic = False) so a
+# big table is not locked, or rewritten in one transaction.
+BATCH = 20000
+
+# Values are stored as in the header; searches match them ignoring case
+# (search_filters: __lower), so the indexes are on lower().  Django 1.11
+# cannot declare expression indexes in Meta.indexes, hence plain SQL.
+INDEXES = [
+    ('fitsfile_prodtype_lower', 'natica_fitsfile', '(lower(prodtype))'),
+    ('fitsfile_proctype_lower', 'natica_fitsfile', '(lower(proctype))'),
+]
+
+def first(keyword):
+    """SQL for first value of KEYWORD in extras (stored as list or scalar)"""
+    return ("(CASE jsonb_typeof(extras->'{k}') WHEN 'array'"
+            " THEN extras->'{k}'->>0 ELSE extras->>'{k}' END)"
+            .format(k=keyword))
+
+NUMBER = r"'^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$'"
+
+BACKFILL = '''UPDATE natica_fitsfile SET
+    prodtype = left({prodtype}, 80),
+    proctype = left({proctype}, 80),
+    obstype = left({obstype}, 80),
+    obsmode = left({obsmode}, 80),
+    imagetyp = left({imagetyp}, 80),
+    filter = left({filter}, 80),
+    seeing = CASE WHEN {seeing} ~ {number} THEN {seeing}::float END,
+    dtpropid = left({dtpropid}, 80),
+    proposer = left({proposer}, 80)
+  WHERE id >= %s AND id < %s'''.format(
+      number=NUMBER,
+      **dict((field, first(keyword)) for field, keyword in [
+          ('prodtype', 'PRODTYPE'), ('proctype', 'PROCTYPE'),
+          ('obstype', 'OBSTYPE'), ('obsmode', 'OBSMODE'),
+          ('imagetyp', 'IMAGETYP'), ('filter', 'FILTER'),
+          ('seeing', 'SEEING'), ('dtpropid', 'DTPROPID'),
+          ('proposer', 'PROPOSER')]))
+
+def backfill(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT min(id), max(id) FROM natica_fitsfile')
+        lo, hi = cursor.fetchone()
+        if lo is None:
+            return
+        for start in range(lo, hi + 1, BATCH):
+            cursor.execute(BACKFILL, [start, start + BATCH])
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('natica', '0010_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fitsfile',
+            name='prodtype',
+            field=models.CharField(help_text='PRODTYPE', max_length=80, null=True),
+        ),
+        migrations.AddField(
+            model_name='fitsfile',
+            name='proctype',
+            field=models.CharField(help_text='PROCTYPE', max_length=80, null=True),
+        ),
+        migrations.AddField(
+            model_name='fitsfile',
+            name='obstype',
+            field=models.CharField(help_text='OBSTYPE', max_length=80, null=True),
+        ),
+        migrations.AddField(
+            model_name='fitsfile',
+            name='obsmode',
+            field=models.CharField(help_text='OBSMODE', max_length=80, null=True),
+        ),
+        migrations.AddField(
+            model_name='fitsfile',
+            name='imagetyp',
+            field=models.CharField(help_text='IMAGETYP', max_length=80, null=True),
+        ),
+        migrations.AddField(
+            model_name='fitsfile',
+            name='filter',
+            field=models.CharField(help_text='FILTER', max_length=80, null=True),
+        ),
+        migrations.AddField(
+            model_name='fitsfile',
+            name='seeing',
+            field=models.FloatField(help_text='SEEING', null=True),
+        ),
+        migrations.AddField(
+            model_name='fitsfile',
+            name='dtpropid',
+            field=models.CharField(help_text='DTPROPID', max_length=80, null=True),
+        ),
+        migrations.AddField(
+            model_name='fitsfile',
+            name='proposer',
+            field=models.CharField(help_text='PROPOSER', max_length=80, null=True),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ] + [
+        migrations.RunSQL(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS {} ON {} {}'
+            .format(name, table, expression),
+            reverse_sql='DROP INDEX CONCURRENTLY IF EXISTS {}'.format(name))
+        for name, table, expression in INDEXES
+    ]
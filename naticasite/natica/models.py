@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.postgres.fields import ArrayField, JSONField, DateRangeField, FloatRangeField
+from django.contrib.postgres.indexes import GinIndex
 
 
 # Only needed for the prefix used in the std filename for archive FITS files.
@@ -22,6 +23,43 @@ class Instrument(models.Model):
     def __str__(self): return self.name
 
 
+# Lookup tables used to build the std filename for archive FITS files.
+# (Loaded into refdata cache; see refdata.py)
+class FilePrefix(models.Model):
+    site = models.CharField(max_length=10, help_text='DTSITE (lowercase)')
+    telescope = models.CharField(max_length=10,
+                                 help_text='DTTELESC (lowercase)')
+    instrument = models.CharField(max_length=20,
+                                  help_text='DTINSTRU (lowercase)')
+    prefix = models.CharField(max_length=4,
+                              help_text='Prefix for archive filename')
+
+    class Meta:
+        unique_together = ('site', 'telescope', 'instrument')
+
+    def __str__(self):
+        return ("{}({},{},{})"
+                .format(self.prefix, self.site, self.telescope, self.instrument))
+
+class ObsType(models.Model):
+    name = models.CharField(max_length=40, primary_key=True,
+                            help_text='OBSTYPE (lowercase)')
+    code = models.CharField(max_length=2, help_text='Code used in filename')
+    def __str__(self): return '{}: {}'.format(self.name, self.code)
+
+class ProcType(models.Model):
+    name = models.CharField(max_length=40, primary_key=True,
+                            help_text='PROCTYPE (lowercase)')
+    code = models.CharField(max_length=2, help_text='Code used in filename')
+    def __str__(self): return '{}: {}'.format(self.name, self.code)
+
+class ProdType(models.Model):
+    name = models.CharField(max_length=40, primary_key=True,
+                            help_text='PRODTYPE (lowercase)')
+    code = models.CharField(max_length=2, help_text='Code used in filename')
+    def __str__(self): return '{}: {}'.format(self.name, self.code)
+
+
 class Proposal(models.Model):
     extras = JSONField()
     prop_id = models.CharField(null=True, max_length=10, unique=True)
@@ -60,9 +98,45 @@ class FitsFile(models.Model):
     #!telescope = models.CharField(max_length=80, help_text="TELESCOP")
     instrument = models.ForeignKey(Instrument)    
     telescope = models.ForeignKey(Telescope)
+
+    # Header keywords searched and returned by the Portal: value from the
+    # first HDU that has one (see views.KEYWORD_FIELDS).  Not also in EXTRAS.
+    # Values as in the header (matched ignoring case, see search_filters).
+    prodtype = models.CharField(max_length=80, null=True, help_text='PRODTYPE')
+    proctype = models.CharField(max_length=80, null=True, help_text='PROCTYPE')
+    obstype = models.CharField(max_length=80, null=True, help_text='OBSTYPE')
+    obsmode = models.CharField(max_length=80, null=True, help_text='OBSMODE')
+    imagetyp = models.CharField(max_length=80, null=True, help_text='IMAGETYP')
+    filter = models.CharField(max_length=80, null=True, help_text='FILTER')
+    seeing = models.FloatField(null=True, help_text='SEEING')
+    dtpropid = models.CharField(max_length=80, null=True, help_text='DTPROPID')
+    proposer = models.CharField(max_length=80, null=True, help_text='PROPOSER')
     
     ###
     ############################################
+
+    # Sky index for cone search, from RA, DEC at ingest (see sky.py)
+    ra_center = models.FloatField(null=True)
+    dec_center = models.FloatField(null=True)
+    fov_radius = models.FloatField(null=True,
+                                   help_text='Degrees from center to corners')
+    sky_cells = ArrayField(models.IntegerField(), null=True)
+
+    class Meta:
+        # Search result orders (see paging.py): keyset seek on (field, id)
+        indexes = [
+            models.Index(fields=['original_filename', 'id'],
+                         name='fitsfile_origfname_id'),
+            models.Index(fields=['archive_filename', 'id'],
+                         name='fitsfile_archfname_id'),
+            models.Index(fields=['release_date', 'id'],
+                         name='fitsfile_release_id'),
+            models.Index(fields=['filesize', 'id'],
+                         name='fitsfile_filesize_id'),
+            # Cone search: files sharing a cell with the cone
+            GinIndex(fields=['sky_cells'], name='fitsfile_sky_cells'),
+            # lower(prodtype), lower(proctype): see migration 0011
+        ]
     
 
 class Hdu(models.Model):
@@ -99,3 +173,25 @@ class Hdu(models.Model):
 
 
     
+
+class IngestJob(models.Model):
+    """Queue of asynchronous ingest requests. See jobs.py"""
+    STATES = (('queued', 'queued'),
+              ('running', 'running'),
+              ('done', 'done'),
+              ('failed', 'failed'))
+    state = models.CharField(max_length=8, choices=STATES, default='queued',
+                             db_index=True)
+    staged_path = models.TextField(help_text='Upload as staged on server')
+    name = models.TextField(help_text='Filename as given by client')
+    md5sum = models.CharField(max_length=32)
+    size = models.BigIntegerField()
+    overwrite = models.BooleanField(default=False)
+    archive_filename = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    submitted = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return '{}({}): {}'.format(self.id, self.state, self.name)
@@ -0,0 +1,127 @@
+"""
+Keyset (cursor) paging of search results.
+
+Results are ordered by one whitelisted, indexed FitsFile field plus id (a
+tie-breaker, so the order is total).  Each page carries an opaque cursor
+holding the sort key of its last row; the next page is the rows after that
+key: an index range seek, so a deep page costs the same as the first.
+"""
+import json
+import base64
+import binascii
+import datetime
+from collections import namedtuple
+
+from django.db.models import Q
+
+from . import exceptions as nex
+
+# API order name -> FitsFile field.  Each has an index on (field, id)
+# (see FitsFile.Meta.indexes), except "separation": an annotation of cone
+# searches (see sky.py), sorted after the cone is pruned by the sky index.
+ORDER_FIELDS = {
+    'id': 'id',
+    'original_filename': 'original_filename',
+    'archive_filename': 'archive_filename',
+    'filename': 'archive_filename',
+    'release_date': 'release_date',
+    'filesize': 'filesize',
+    'separation': 'separation',
+}
+DEFAULT_ORDER = 'original_filename'
+
+def parse_order(order):
+    """(field, descending) for ORDER (API name, leading '-' for
+descending, '+' or none for ascending)."""
+    name = (order or DEFAULT_ORDER).strip()
+    descending = name.startswith('-')
+    name = name.lstrip('+-')
+    if name not in ORDER_FIELDS:
+        raise nex.SearchSyntaxError(
+            'Cannot order by "{}"; use one of: {}'
+            .format(order, ', '.join(sorted(ORDER_FIELDS))))
+    return ORDER_FIELDS[name], descending
+
+def order_by(field, descending):
+    """Args for QuerySet.order_by()"""
+    if field == 'id':
+        return ['-id' if descending else 'id']
+    if descending:
+        return ['-' + field, '-id']
+    return [field, 'id']
+
+def encode_cursor(order, value, row_id, count):
+    """Opaque cursor: rows after (VALUE, ROW_ID) in ORDER. COUNT rows
+precede it."""
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat()
+    raw = json.dumps([order, value, row_id, count]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def decode_cursor(cursor, order):
+    """(value, row_id, count) of CURSOR, which must be for ORDER."""
+    try:
+        corder, value, row_id, count = json.loads(
+            base64.urlsafe_b64decode(cursor.encode()).decode())
+    except (ValueError, TypeError, binascii.Error):
+        raise nex.SearchSyntaxError('Bad cursor: {}'.format(cursor))
+    if (not is_int(row_id) or not is_int(count) or count < 0
+        or not (value is None or is_int(value)
+                or isinstance(value, (str, float)))):
+        raise nex.SearchSyntaxError('Bad cursor: {}'.format(cursor))
+    if corder != order:
+        raise nex.SearchSyntaxError(
+            'Cursor is for order "{}" but order is "{}"'.format(corder, order))
+    return value, row_id, count
+
+def seek(qs, field, descending, value, row_id):
+    """Rows of QS after (VALUE, ROW_ID) in order (FIELD, id)."""
+    table = qs.model._meta.db_table
+    op = '<' if descending else '>'
+    if field == 'id':
+        return qs.filter(**{'id__lt' if descending else 'id__gt': row_id})
+    if field in qs.query.annotations:
+        lookup = field + ('__lt' if descending else '__gt')
+        return qs.filter(Q(**{lookup: value})
+                         | Q(**{field: value,
+                                'id__lt' if descending else 'id__gt': row_id}))
+    column = qs.model._meta.get_field(field).column
+    # Row comparison lets Postgres seek on the (field, id) index.
+    return qs.extra(where=['("{t}"."{c}", "{t}"."id") {op} (%s, %s)'
+                           .format(t=table, c=column, op=op)],
+                    params=[value, row_id])
+
+Page = namedtuple('Page', ['rows', 'next_cursor', 'count_before', 'query'])
+
+def page(qs, order, limit, cursor=None, offset=0,
+         fetch=list, value=getattr):
+    """One page of QS (a FitsFile queryset) after CURSOR.  Without a
+cursor, skip OFFSET rows (costs a scan of them; for old clients).
+FETCH(sliced queryset) returns the rows; VALUE(row, field) gets the value
+of a FitsFile field (the sort key) from a row.
+Return Page: next_cursor is None on the last page."""
+    if not is_int(limit) or limit < 1:
+        raise nex.UsageError('Page limit must be at least 1; got {}'
+                             .format(limit))
+    if not is_int(offset) or offset < 0:
+        raise nex.UsageError('Page offset must not be negative; got {}'
+                             .format(offset))
+    order = order or DEFAULT_ORDER
+    field, descending = parse_order(order)
+    count_before = offset
+    if cursor:
+        after, row_id, count_before = decode_cursor(cursor, order)
+        qs = seek(qs, field, descending, after, row_id)
+        offset = 0
+    qs = qs.order_by(*order_by(field, descending))[offset:offset + limit + 1]
+    rows = fetch(qs)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(order, value(last, field),
+                                    value(last, 'id'), count_before + limit)
+    return Page(rows, next_cursor, count_before, str(qs.query))
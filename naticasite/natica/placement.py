@@ -0,0 +1,128 @@
+"""
+Move staged files into the archive with as little copying as possible.
+
+If staging and archive are on the same device the file is renamed.
+Across devices the bytes are copied in the kernel (copy_file_range, else
+sendfile) into a temporary file next to the destination, fsync'ed and
+renamed into place.
+
+Counters (per process) record bytes written while staging uploads and
+bytes copied while placing them, per byte placed.  With staging on the
+archive filesystem the ratio is 1.0: the one unavoidable write of the
+upload itself.
+"""
+import os
+import errno
+import shutil
+import logging
+import tempfile
+import threading
+
+_lock = threading.Lock()
+_counters = dict(files=0,
+                 bytes_placed=0,    # size of files put in archive
+                 bytes_staged=0,    # written while receiving uploads
+                 bytes_copied=0,    # copied while placing
+                 rename=0, copy=0)
+
+def _count(**kwargs):
+    with _lock:
+        for k,v in kwargs.items():
+            _counters[k] += v
+
+def record_staged(nbytes):
+    """Count NBYTES written to staging (by upload handlers)."""
+    _count(bytes_staged=nbytes)
+
+def stats():
+    """Dict of placement counters, including bytes copied per byte placed."""
+    with _lock:
+        s = dict(_counters)
+    placed = s['bytes_placed']
+    s['copy_ratio'] = ((s['bytes_staged'] + s['bytes_copied']) / placed
+                       if placed else None)
+    return s
+
+def reset():
+    with _lock:
+        for k in _counters:
+            _counters[k] = 0
+
+def same_device(src, dstdir):
+    return os.stat(src).st_dev == os.stat(dstdir).st_dev
+
+def kernel_copy(src, dst):
+    """Copy file SRC to DST (fsync'ed) without passing bytes through
+user space where possible. Return bytes copied.  Raise OSError if DST
+does not end up the size of SRC."""
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        size = os.fstat(fin.fileno()).st_size
+        copied = 0
+        try:
+            if hasattr(os, 'copy_file_range'):
+                while copied < size:
+                    n = os.copy_file_range(fin.fileno(), fout.fileno(),
+                                           size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+            else:
+                while copied < size:
+                    n = os.sendfile(fout.fileno(), fin.fileno(), copied,
+                                    size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+        except OSError as err:
+            if err.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                 errno.EOPNOTSUPP):
+                raise
+            # Kernel (or filesystem) can't do it; plain copy of the rest
+            fin.seek(copied)
+            fout.seek(copied)
+            shutil.copyfileobj(fin, fout, 2**20)
+            copied = fout.tell()
+        fout.flush()
+        os.fsync(fout.fileno())
+        written = os.fstat(fout.fileno()).st_size
+        if copied != size or written != size:
+            raise OSError(errno.EIO,
+                          'Short copy of {} to {}: {} of {} bytes'
+                          .format(src, dst, written, size))
+    return copied
+
+def fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def place(src, dst):
+    """Move staged file SRC to archive path DST (replacing any file
+there). Return method used: 'rename' or 'copy'."""
+    src, dst = str(src), str(dst)
+    dstdir = os.path.dirname(dst)
+    size = os.path.getsize(src)
+    if same_device(src, dstdir):
+        os.replace(src, dst) # atomic
+        method = 'rename'
+        copied = 0
+    else:
+        fd, tmp = tempfile.mkstemp(prefix='.placing-', dir=dstdir)
+        os.close(fd)
+        try:
+            # mkstemp makes it 0600; same mode as a renamed file would have
+            os.chmod(tmp, os.stat(src).st_mode & 0o7777)
+            copied = kernel_copy(src, tmp)
+            os.replace(tmp, dst)
+        except:
+            os.remove(tmp)
+            raise
+        fsync_dir(dstdir)
+        os.remove(src)
+        method = 'copy'
+    _count(files=1, bytes_placed=size, bytes_copied=copied, **{method: 1})
+    logging.debug('placement: {} {} -> {} ({} bytes copied)'
+                  .format(method, src, dst, copied))
+    return method
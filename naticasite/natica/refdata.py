@@ -0,0 +1,105 @@
+"""
+In-process cache of reference tables: Telescope, Instrument and the
+lookup tables used to build archive filenames (FilePrefix, ObsType,
+ProcType, ProdType).
+
+Tables are read (once) on first use in each worker.  Saving or deleting a
+row of any of them (e.g. through admin) touches settings.refdata_stamp
+once the transaction commits; every worker notices the new mtime on its
+next lookup and reloads.  So in the steady state ingest does no
+reference table queries.
+"""
+import os
+import logging
+import threading
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+
+from . import settings
+from .models import (Telescope, Instrument,
+                     FilePrefix, ObsType, ProcType, ProdType)
+
+ref_models = (Telescope, Instrument, FilePrefix, ObsType, ProcType, ProdType)
+
+_lock = threading.Lock()
+_cache = None   # dict of reference data
+_stamp = None   # mtime of settings.refdata_stamp when _cache was loaded
+
+def stamp():
+    try:
+        return os.stat(settings.refdata_stamp).st_mtime_ns
+    except OSError:
+        return 0
+
+def load():
+    """Read all reference tables from DB."""
+    return dict(
+        telescopes = set(Telescope.objects.values_list('name', flat=True)),
+        instruments = set(Instrument.objects.values_list('name', flat=True)),
+        stiLUT = dict(((site,tele,inst), prefix)
+                      for (site,tele,inst,prefix)
+                      in FilePrefix.objects.values_list(
+                          'site','telescope','instrument','prefix')),
+        obsLUT = dict(ObsType.objects.values_list('name', 'code')),
+        procLUT = dict(ProcType.objects.values_list('name', 'code')),
+        prodLUT = dict(ProdType.objects.values_list('name', 'code')),
+    )
+
+def get():
+    """Return dict of reference data, (re)loading if needed."""
+    global _cache, _stamp
+    current = stamp()
+    if _cache is None or current != _stamp:
+        with _lock:
+            logging.debug('refdata: loading reference tables')
+            _cache = load()
+            _stamp = current
+    return _cache
+
+def invalidate(**kwargs):
+    """Signal handler. Force reload by all workers once the change is
+committed (before that, a reload would read the old rows and keep them
+until the next edit)."""
+    transaction.on_commit(reset)
+
+def reset():
+    """Force reload by all workers (now)."""
+    global _cache
+    _cache = None
+    try:
+        os.makedirs(os.path.dirname(settings.refdata_stamp), exist_ok=True)
+        with open(settings.refdata_stamp, 'a'):
+            os.utime(settings.refdata_stamp, None)
+    except OSError as err:
+        logging.warning('refdata: could not touch {}; other workers will '
+                        'use stale reference data. {}'
+                        .format(settings.refdata_stamp, err))
+
+def connect_signals():
+    for model in ref_models:
+        post_save.connect(invalidate, sender=model,
+                          dispatch_uid='refdata-save-{}'.format(model.__name__))
+        post_delete.connect(invalidate, sender=model,
+                            dispatch_uid='refdata-del-{}'.format(model.__name__))
+
+##############################################################################
+### Lookups
+
+def telescopes():
+    return get()['telescopes']
+
+def instruments():
+    return get()['instruments']
+
+def file_prefix(site, telescope, instrument, default='uuuu'):
+    return get()['stiLUT'].get((site, telescope, instrument), default)
+
+def obs_code(obstype, default='u'):
+    return get()['obsLUT'].get(obstype, default)
+
+def proc_code(proctype, default='u'):
+    return get()['procLUT'].get(proctype, default)
+
+def prod_code(prodtype, default='u'):
+    return get()['prodLUT'].get(prodtype, default)
@@ -0,0 +1,151 @@
+"""
+Resumable (chunked) uploads.  A large file is sent as a sequence of
+ranged chunks; if the connection drops the client asks how many bytes
+arrived and continues from there instead of starting over.
+
+  POST /natica/uploads/                   {"name": <filename>} -> upload_id
+  PUT  /natica/uploads/<id>/?offset=N     raw bytes of chunk starting at N
+  GET  /natica/uploads/<id>/              bytes received so far ("offset")
+  POST /natica/uploads/<id>/finish/       {"md5sum": ...} -> archive_filename
+
+Partial uploads are kept under settings.upload_root (local disk, same
+filesystem as the archive).  Finishing hands the file to the same
+validation and storage path as /natica/store/.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import logging
+
+from . import settings
+from . import exceptions as nex
+from .models import FitsFile
+from .upload_handlers import StagedFitsFile
+from . import placement
+from . import metrics
+
+chunk_read_size = 2**20 # bytes read from request at a time
+
+def data_path(upload_id):
+    if not re.fullmatch('[0-9a-f]{32}', upload_id):
+        raise nex.UsageError('Bad upload id: {}'.format(upload_id))
+    return os.path.join(settings.upload_root, upload_id + '.part')
+
+def meta_path(upload_id):
+    return data_path(upload_id) + '.json'
+
+def start(name):
+    """Create empty partial upload for file called NAME. Return upload id."""
+    os.makedirs(settings.upload_root, exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    with open(meta_path(upload_id), 'w') as f:
+        json.dump(dict(name=os.path.basename(name)), f)
+    open(data_path(upload_id), 'wb').close()
+    return upload_id
+
+def received(upload_id):
+    """Number of bytes received so far for UPLOAD_ID."""
+    try:
+        return os.stat(data_path(upload_id)).st_size
+    except FileNotFoundError:
+        raise nex.UploadNotFound('No such upload: {}'.format(upload_id))
+
+def append(upload_id, offset, stream, length):
+    """Write LENGTH bytes read from STREAM at OFFSET of partial upload.
+OFFSET may be less than what was received (a resent chunk) but must not
+leave a gap.  Return number of bytes received."""
+    try:
+        f = open(data_path(upload_id), 'r+b')
+    except FileNotFoundError:
+        raise nex.UploadNotFound('No such upload: {}'.format(upload_id))
+    with f, metrics.timer('receive_chunk', length):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        size = os.fstat(f.fileno()).st_size
+        if offset < 0 or offset > size:
+            raise nex.UploadOffsetError(
+                'Chunk offset {} but {} bytes received for upload {}'
+                .format(offset, size, upload_id))
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            chunk = stream.read(min(chunk_read_size, remaining))
+            if not chunk:
+                break
+            f.write(chunk)
+            remaining -= len(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+        placement.record_staged(length - remaining)
+        return max(size, f.tell())
+
+def staged_file(upload_id):
+    """StagedFitsFile for the complete upload UPLOAD_ID."""
+    received(upload_id) # raise if no such upload
+    with open(meta_path(upload_id)) as f:
+        name = json.load(f)['name']
+    return StagedFitsFile.from_path(data_path(upload_id), name=name)
+
+def finish(upload_id, md5sum, overwrite=False):
+    """Validate and archive complete upload. Return archive filename.
+The upload is discarded once archived, or if it is rejected (checksum
+mismatch, not valid FITS, header not acceptable).  On any other failure
+(e.g. database unavailable) it is kept so finish can be retried."""
+    from .views import place_uploaded_file, protected_store_metadata
+    f = staged_file(upload_id)
+    try:
+        with metrics.timer('ingest', f.size):
+            try:
+                hdudicts, valdict = place_uploaded_file(f, md5sum)
+            except nex.BaseNaticaException:
+                discard(upload_id)
+                raise
+            try:
+                protected_store_metadata(hdudicts, valdict,
+                                         overwrite=overwrite)
+            except Exception:
+                unplace(valdict['arch_fname'], upload_id)
+                raise
+    finally:
+        f.close()
+    discard(upload_id)
+    return str(valdict['arch_fname'])
+
+def unplace(archive_path, upload_id):
+    """Return file placed at ARCHIVE_PATH (metadata not stored) to upload
+UPLOAD_ID.  Left in the archive too if older metadata refers to it."""
+    archive_path = str(archive_path)
+    if FitsFile.objects.filter(archive_filename=archive_path).exists():
+        placement.kernel_copy(archive_path, data_path(upload_id))
+    else:
+        shutil.move(archive_path, data_path(upload_id))
+
+def discard(upload_id):
+    for path in (data_path(upload_id), meta_path(upload_id)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def expire(max_age):
+    """Remove partial uploads not written to in MAX_AGE seconds.
+Return list of upload ids removed."""
+    if not os.path.isdir(settings.upload_root):
+        return []
+    cutoff = time.time() - max_age
+    removed = list()
+    for fname in os.listdir(settings.upload_root):
+        if not fname.endswith('.part'):
+            continue
+        upload_id = fname[:-len('.part')]
+        try:
+            if os.stat(data_path(upload_id)).st_mtime < cutoff:
+                discard(upload_id)
+                removed.append(upload_id)
+        except (FileNotFoundError, nex.UsageError):
+            continue
+    logging.debug('resumable.expire: removed {}'.format(removed))
+    return removed
@@ -0,0 +1,51 @@
+"""
+JSON schemas used to validate FITS headers (ingest) and search requests.
+
+Each schema file is read and compiled into a validator once per process,
+and read again only when the file's mtime changes.
+"""
+import os
+import json
+import logging
+import threading
+
+import jsonschema
+
+
+def compile_schema(schema):
+    """Validator for SCHEMA. Class is chosen the way jsonschema.validate
+chooses it (older jsonschema only has Draft3Validator)."""
+    validator_for = getattr(getattr(jsonschema, 'validators', None),
+                            'validator_for', None)
+    cls = validator_for(schema) if validator_for else jsonschema.Draft3Validator
+    cls.check_schema(schema)
+    return cls(schema)
+
+
+class CachedValidator():
+    """Validate against schema in SCHEMAFILE. File is re-read only if it
+changed since last use."""
+    def __init__(self, schemafile):
+        self.schemafile = schemafile
+        self.validator = None
+        self.mtime = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        mtime = os.stat(self.schemafile).st_mtime_ns
+        if mtime != self.mtime:
+            with self.lock:
+                if mtime != self.mtime:
+                    logging.debug('Loading schema: {}'.format(self.schemafile))
+                    with open(self.schemafile) as f:
+                        self.validator = compile_schema(json.load(f))
+                    self.mtime = mtime
+        return self.validator
+
+    def validate(self, instance):
+        """Raise jsonschema.ValidationError if INSTANCE is not valid."""
+        self.get().validate(instance)
+
+
+fits_header = CachedValidator('/etc/natica/fits-header-schema.json')
+search = CachedValidator('/etc/natica/search-schema.json')
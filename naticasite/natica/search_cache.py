@@ -0,0 +1,110 @@
+"""
+Cache of search response pages.  Portal users repeat the same few
+searches; a hit skips the query, the count and serialization.
+
+Key:: hash of the normalized search (counting.query_key) plus the
+    paging parameters (order, limit, page, cursor, count, only).
+Memory tier:: per process, LRU, at most MAX_BYTES of response bodies.
+Disk tier:: optional (settings.search_cache_dir), shared by all workers
+    on a host.  One sub-directory per generation; starting a new one
+    removes the others.
+
+Entries are valid only in the generation they were computed in (see
+generation.py): storing or overwriting metadata invalidates them all.
+"""
+import os
+import json
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+from . import counting
+from . import generation
+from . import settings
+
+MAX_BYTES = 64 * 2**20        # memory tier, per process
+MAX_ENTRY_BYTES = 4 * 2**20   # larger responses are not cached
+
+_lock = threading.Lock()
+_cache = OrderedDict()  # key -> (generation, body)
+_bytes = 0
+
+def key(jsearch, **params):
+    """Hash of search JSEARCH with paging PARAMS."""
+    raw = json.dumps([counting.query_key(jsearch), sorted(params.items())],
+                     separators=(',', ':'))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def _disk_dir(gen):
+    """Directory of disk tier for GEN, or None if there is no disk tier.
+Only the shared (stamp) part of GEN is seen by other workers; without a
+stamp file there is nothing to invalidate the disk tier, so none."""
+    root = settings.search_cache_dir
+    if root is None or gen[0] == 0:
+        return None
+    return os.path.join(root, str(gen[0]))
+
+def _remember(key, body, gen):
+    global _bytes
+    with _lock:
+        old = _cache.pop(key, None)
+        if old is not None:
+            _bytes -= len(old[1])
+        _cache[key] = (gen, body)
+        _bytes += len(body)
+        while _bytes > MAX_BYTES:
+            _, (_, evicted) = _cache.popitem(last=False)
+            _bytes -= len(evicted)
+
+def get(key):
+    """(Response body, tier) cached for KEY in current generation.
+Tier is 'memory' or 'disk'.  (None, None) on miss."""
+    gen = generation.current()
+    with _lock:
+        hit = _cache.get(key)
+        if hit is not None and hit[0] == gen:
+            _cache.move_to_end(key)
+            return hit[1], 'memory'
+    gendir = _disk_dir(gen)
+    if gendir is None:
+        return None, None
+    try:
+        with open(os.path.join(gendir, key), 'rb') as f:
+            body = f.read()
+    except OSError:
+        return None, None
+    _remember(key, body, gen)
+    return body, 'disk'
+
+def put(key, body, gen):
+    """Cache response BODY (bytes) for KEY, computed in generation GEN
+(read before the search ran)."""
+    if len(body) > MAX_ENTRY_BYTES or gen != generation.current():
+        return
+    _remember(key, body, gen)
+    gendir = _disk_dir(gen)
+    if gendir is None:
+        return
+    try:
+        if not os.path.isdir(gendir):
+            root = settings.search_cache_dir
+            os.makedirs(gendir, exist_ok=True)
+            for name in os.listdir(root):
+                if name != os.path.basename(gendir):
+                    shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        fd, tmp = tempfile.mkstemp(dir=gendir, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(body)
+        os.replace(tmp, os.path.join(gendir, key))
+    except OSError as err:
+        logging.warning('search_cache: could not write {}; {}'
+                        .format(gendir, err))
+
+def clear():
+    global _bytes
+    with _lock:
+        _cache.clear()
+        _bytes = 0
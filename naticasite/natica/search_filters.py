@@ -1,20 +1,26 @@
-from django.db.models import Q
+from django.db.models import Q, Value, FloatField, CharField
+from django.db.models.functions import Lower
 from psycopg2.extras import NumericRange, DateRange
+from . import sky
+
+# field__lower=...: matches lower(field), as indexed for prodtype, proctype
+CharField.register_lookup(Lower)
 
 ##############################################################################
 ### for LSA API
 ### These are ALL the fields that can be queried against using the Portal
 def coordinates(val, slop):
+    """Files whose footprint is within SLOP degrees (great-circle) of
+VAL['ra'], VAL['dec'].  See sky.py."""
     if val == None: return Q()
     ra = val['ra']
     dec = val['dec']
-    #!return ( Q(dec__lte=(dec + slop)) & Q(dec__gte=(dec - slop))
-    #!    & Q(ra__lte=(ra + slop)) & Q(ra__gte=(ra - slop))       )
-    qq = Q(dec__overlap=NumericRange(dec-slop, dec+slop)) \
-         & Q(ra__overlap=NumericRange(ra-slop, ra+slop))
+    qq = Q(fov_radius__gte=(sky.Separation(ra, dec)
+                            - Value(slop, output_field=FloatField())))
+    cells = sky.cone_cells(ra, dec, slop)
+    if cells is not None:
+        qq &= Q(sky_cells__overlap=cells)
     return qq
-            
-              
 
 #!!! WARNING: this is Inclusive only (ignores the BOUNDS part of tuple)
 def exposure_time(val):
@@ -33,8 +39,15 @@ filename=archive_filename
 
 def image_filter(val):  
     if val == None: return Q()
-    # Case insensitive match against extras['PRODTYPE'] (json field)
-    return Q(extras__PRODTYPE__iexact='image') #!!!
+    # Index on lower(prodtype)
+    return Q(prodtype__lower='image') #!!!
+
+def proctype(val):
+    """VAL is a PROCTYPE (e.g. "raw", "instcal") or a list of them."""
+    if val == None: return Q()
+    vals = val if isinstance(val, list) else [val]
+    # Index on lower(proctype)
+    return Q(proctype__lower__in=[v.lower() for v in vals])
 
 #!!! WARNING: this is Inclusive only (ignores the BOUNDS part of tuple)
 def dateobs(val):
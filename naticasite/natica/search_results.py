@@ -0,0 +1,117 @@
+"""
+Rows of the search "resultset", built straight from column tuples.
+
+Only the columns in the response are selected (header keywords included:
+they are FitsFile columns, see views.KEYWORD_FIELDS), so a page costs one
+query and no model instances (the blob of extras is never transferred).
+Telescope and Instrument names are their primary keys: no join needed.
+
+Export streams every row of a search as NDJSON or CSV from a server-side
+cursor, in constant memory.
+"""
+import io
+import csv
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+def _range(val):
+    return None if val is None else [val.lower, val.upper]
+
+def _listed(val):
+    # Returned as a list of values since these were aggregated that way
+    return [val]
+
+# (result key, FitsFile column, convert)  Order of the response dicts.
+COLUMNS = [
+    ('id',                'id',                None),
+    ('ra',                'ra',                _range),
+    ('dec',               'dec',               _range),
+    ('exposure',          'exposure',          _range),
+    ('filename',          'archive_filename',  None),
+    ('filesize',          'filesize',          None),
+    ('instrument',        'instrument_id',     None),
+    ('md5sum',            'md5sum',            None),
+    ('obs_date',          'date_obs',          _range),
+    ('original_filename', 'original_filename', None),
+    ('release_date',      'release_date',      None),
+    ('telescope',         'telescope_id',      None),
+    ('filter',            'filter',            _listed),
+    ('image_type',        'imagetyp',          _listed),
+    ('observation_mode',  'obsmode',           _listed),
+    ('observation_type',  'obstype',           _listed),
+    ('pi',                'proposer',          None),
+    ('product',           'prodtype',          None),
+    ('prop_id',           'dtpropid',          None),
+    ('seeing',            'seeing',            _listed),
+]
+# Annotations (e.g. by cone search) added to the results when present
+OPTIONAL = ['separation']
+KEYS = [key for key,_,_ in COLUMNS]
+CONVERTERS = [convert for _,_,convert in COLUMNS] + [None] * len(OPTIONAL)
+# FitsFile field -> result key (for paging cursors)
+KEY_OF_FIELD = dict((column, key) for key,column,_ in COLUMNS)
+KEY_OF_FIELD.update((key, key) for key in OPTIONAL)
+
+def project(qs):
+    """QS (FitsFile queryset) as tuples of exactly the response columns."""
+    optional = [key for key in OPTIONAL if key in qs.query.annotations]
+    return qs.values_list(*([column for _,column,_ in COLUMNS] + optional))
+
+def to_dict(row):
+    return dict(zip(KEYS + OPTIONAL, (val if convert is None or val is None
+                                      else convert(val)
+                                      for convert,val in zip(CONVERTERS, row))))
+
+def fetch(qs):
+    """List of result dicts for QS (one query)."""
+    return [to_dict(row) for row in project(qs)]
+
+def field_value(row, field):
+    """Value of FitsFile FIELD in result dict ROW."""
+    return row[KEY_OF_FIELD[field]]
+
+def iterate(qs):
+    """Result dicts for QS, read through a server-side cursor."""
+    for row in project(qs).iterator():
+        yield to_dict(row)
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+EXPORT_BATCH = 500   # rows per chunk written to the response
+
+def _ndjson(rows):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(row) + '\n'
+
+def _csv_value(val, encoder):
+    if isinstance(val, list):
+        return encoder.encode(val)
+    if val is None:
+        return ''
+    return encoder.default(val) if hasattr(val, 'isoformat') else val
+
+def _csv(rows):
+    encoder = DjangoJSONEncoder()
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(KEYS)
+    for row in rows:
+        writer.writerow([_csv_value(row[key], encoder) for key in KEYS])
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+def export(qs, fmt):
+    """Chunks of text (FMT, one of EXPORT_FORMATS) of every row of QS."""
+    lines = (_ndjson if fmt == 'ndjson' else _csv)(iterate(qs))
+    batch = list()
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= EXPORT_BATCH:
+            yield ''.join(batch)
+            batch = list()
+    if batch:
+        yield ''.join(batch)
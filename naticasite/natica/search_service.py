@@ -0,0 +1,181 @@
+"""
+Search of the archive, shared by every way in: the JSON API
+(views.search), the form (views.search2), DAL (dal.views.search_by_json)
+and proto.try_queries.  Callers validate a search dict (JSON search
+request) and get back the response structure; no HTTP round trip.
+"""
+import datetime
+import logging
+from collections import OrderedDict, namedtuple
+
+from .models import FitsFile
+from . import exceptions as nex
+from . import search_filters as sf
+from . import schemas
+from . import paging
+from . import counting
+from . import search_results
+from . import sky
+
+api_version = '0.1.7' # prototype only
+
+search_fields = set([
+    'search_box_min',
+    'coordinates',
+    'proctype',
+    'pi',
+    'prop_id',
+    'obs_date',
+    'filename',
+    'original_filename',
+    'telescope_instrument',
+    'release_date',
+    'flag_raw',
+    'image_filter',
+    'exposure_time',
+    #'xtension', # new
+    'extras',
+])
+
+# How to page through (and count) the matches of a search
+#   limit:: num of records per page
+#   page:: page number (old clients; CURSOR is preferred)
+#   cursor:: from meta.next_cursor of previous page
+#   order:: one of paging.ORDER_FIELDS, leading +/- (ascending/descending)
+#   count:: how total_count is found; one of counting.MODES
+#   only:: "count" (no results) or "exists" (no results, no count)
+#   export:: stream every match (no paging, no count); see EXPORT_FORMATS
+Params = namedtuple('Params', ['limit', 'page', 'cursor', 'order', 'count',
+                               'only', 'export'])
+
+def params(get):
+    """Params from GET (query string parameters)."""
+    only = get.get('only', None)
+    if only not in (None, 'count', 'exists'):
+        raise nex.UsageError('Unknown value for "only": {}'.format(only))
+    export = get.get('export', None)
+    formats = search_results.EXPORT_FORMATS
+    if export is not None and export not in formats:
+        raise nex.UsageError('Unknown export format "{}"; use one of: {}'
+                             .format(export, ', '.join(sorted(formats))))
+    try:
+        limit = int(get.get('limit', '100'))
+        page = int(get.get('page', '1'))
+    except ValueError as err:
+        raise nex.UsageError('"limit" and "page" must be integers; {}'
+                             .format(err))
+    if limit < 1 or page < 1:
+        raise nex.UsageError('"limit" and "page" must be at least 1')
+    return Params(limit=limit,
+                  page=page,
+                  cursor=get.get('cursor', None),
+                  order=get.get('order', paging.DEFAULT_ORDER),
+                  count=get.get('count', 'auto'),
+                  only=only,
+                  export=export)
+
+def validate(jsearch):
+    """Raise if JSEARCH is not a valid search."""
+    try:
+        schemas.search.validate(jsearch)
+    except Exception as err:
+        raise nex.SearchSyntaxError('JSON did not validate against'
+                                    ' {}; {}'.format(schemas.search.schemafile,
+                                                     err))
+    used_fields = set(jsearch.keys())
+    if not (search_fields >= used_fields):
+        unavail = used_fields - search_fields
+        raise nex.ExtraSearchFieldError('Extra fields ({}) in search'
+                                     .format(unavail))
+
+def make_qobj(jsearch):
+    """Construct query (anchored on FitsFile)"""
+    slop = jsearch.get('search_box_min', .001)
+    q = (sf.coordinates(jsearch.get('coordinates', None), slop)
+         & sf.exposure_time(jsearch.get('exposure_time', None))
+         & sf.archive_filename(jsearch.get('filename', None))
+         & sf.image_filter(jsearch.get('image_filter', None))
+         & sf.proctype(jsearch.get('proctype', None))
+         & sf.dateobs(jsearch.get('obs_date', None))
+         & sf.original_filename(jsearch.get('original_filename', None))
+         & sf.pi(jsearch.get('pi', None))
+         & sf.prop_id(jsearch.get('propid', None))
+         & sf.release_date(jsearch.get('release_date', None))
+         & sf.telescope_instrument(jsearch.get('telescope_instrument', None))
+         )
+         #& sf.extras(jsearch.get('extras', None))
+         #& sf.xtension(jsearch.get('xtension', None))
+    logging.debug('DBG: q={}'.format(str(q)))
+    return q
+
+def matches(jsearch, order):
+    """FitsFile queryset of matches of JSEARCH (unordered).  Annotated with
+separation if ORDER is by separation."""
+    fullqs = FitsFile.objects.filter(make_qobj(jsearch))
+    if paging.parse_order(order)[0] == 'separation':
+        coords = jsearch.get('coordinates', None)
+        if coords is None:
+            raise nex.SearchSyntaxError(
+                'Order by "separation" requires "coordinates" in search')
+        fullqs = fullqs.annotate(
+            separation=sky.Separation(coords['ra'], coords['dec']))
+    return fullqs
+
+def export(jsearch, prm):
+    """Chunks of text (PRM.export format) of every match of JSEARCH."""
+    field, descending = paging.parse_order(prm.order)
+    qs = matches(jsearch, prm.order).order_by(*paging.order_by(field,
+                                                               descending))
+    return search_results.export(qs, prm.export)
+
+def search(jsearch, prm):
+    """Response (dict of meta, resultset) to search JSEARCH (validated)
+with paging PRM."""
+    fullqs = matches(jsearch, prm.order)
+    if prm.only == 'exists':
+        meta = OrderedDict(api_version=api_version,
+                           timestamp=datetime.datetime.now(),
+                           exists=fullqs.exists())
+        return OrderedDict(meta=meta, resultset=[])
+    total_count, count_used = counting.count(fullqs, jsearch, mode=prm.count)
+    if prm.only == 'count':
+        meta = OrderedDict(api_version=api_version,
+                           timestamp=datetime.datetime.now(),
+                           total_count=total_count,
+                           count_mode=count_used)
+        return OrderedDict(meta=meta, resultset=[])
+    pg = paging.page(fullqs, prm.order, prm.limit,
+                     cursor=prm.cursor, offset=(prm.page - 1) * prm.limit,
+                     fetch=search_results.fetch,
+                     value=search_results.field_value)
+    offset = pg.count_before
+    results = pg.rows
+    if count_used == 'estimate':
+        # Never less than what we know is there
+        total_count = max(total_count, offset + len(results)
+                          + (1 if pg.next_cursor else 0))
+    meta = OrderedDict.fromkeys(['total_count',
+                                 'page_result_count',
+                                 'to_here_count',
+                                 'api_version',
+                                 'timestamp',
+                                 'comment',
+                                 'query', ])
+    meta.update(
+        api_version = api_version,
+        timestamp = datetime.datetime.now(),
+        comment = ('WARNING: RESULTS missing values: surver_id, depth.'
+                   '  (Where do they come from???)'
+                   ),
+        query = pg.query,
+        page_result_count = len(results),
+        to_here_count = offset + len(results),
+        total_count = total_count,
+        count_mode = count_used,
+        offset = offset,
+        page_limit = prm.limit,
+        order = prm.order,
+        next_cursor = pg.next_cursor,
+        debug=1
+    )
+    return OrderedDict(meta=meta, resultset=results)
@@ -1,6 +1,30 @@
 archive_root = '/data/natica-archive'
+# Uploads are staged here (one unique file per request) then renamed into
+# place.  Should be on the same filesystem as ARCHIVE_ROOT so placement is
+# an atomic rename; otherwise every file is copied (see placement.py).
+staging_root = '/data/natica-archive/.staging'
+# Partial resumable uploads (see resumable.py).  Same filesystem as above.
+upload_root = '/data/natica-archive/.staging/uploads'
 
-# !!! REPLACE LUTs with read of files in /etc/natica. Populate those from DB.
+# Seconds an ingest worker may take over a job before the job is given to
+# another worker (the first is assumed dead).  See jobs.py.
+ingest_job_lease = 3600
+
+# Touched whenever reference tables (Telescope, Instrument, FilePrefix,
+# ObsType, ProcType, ProdType) change so every worker reloads its refdata
+# cache.  See refdata.py.
+refdata_stamp = '/var/run/natica/refdata.stamp'
+
+# Touched whenever FitsFile metadata is stored or updated so every worker
+# drops cached search counts and results.  See generation.py.
+search_generation_stamp = '/var/run/natica/search-generation.stamp'
+
+# Search response pages cached here are shared by all workers on a host
+# (None: each worker caches in memory only).  See search_cache.py.
+search_cache_dir = None
+
+# Initial content of FilePrefix, ObsType, ProcType, ProdType tables
+# (loaded by migration 0006).  Runtime lookups use the DB (via refdata.py).
 stiLUT = {
     # (site, telescope,instrument): Prefix 
     ('cp', 'soar', 'goodman'):   'psg',  
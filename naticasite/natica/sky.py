@@ -0,0 +1,117 @@
+"""
+Sky index of FitsFile footprints, for cone search.
+
+The sky is cut into zones of ZONE_HEIGHT degrees of declination; each
+zone into as many equal RA cells as fit at least ZONE_HEIGHT wide (fewer
+toward the poles).  At ingest each FitsFile gets the ids of the cells its
+RA/DEC box touches (sky_cells, GIN indexed), its centre and the radius of
+the circle around the centre that holds the box (fov_radius).
+
+A cone search first keeps files sharing a cell with the cone (index
+scan), then those whose footprint circle is within great-circle distance
+of the cone.  RA boxes that cross RA=0/360 are handled at both steps.
+"""
+import math
+
+from django.db.models import Func, FloatField
+
+ZONE_HEIGHT = 0.5      # degrees
+NZONES = int(180 / ZONE_HEIGHT)
+CELLS_PER_ZONE = 1024  # cell id = zone * CELLS_PER_ZONE + RA cell
+MAX_PRUNE_CELLS = 5000 # wider cones skip the index and only check distance
+
+def separation(ra1, dec1, ra2, dec2):
+    """Great-circle distance (degrees) between two points (degrees)."""
+    ra1, dec1, ra2, dec2 = map(math.radians, (ra1, dec1, ra2, dec2))
+    hav = (math.sin((dec2 - dec1) / 2)**2
+           + math.cos(dec1) * math.cos(dec2) * math.sin((ra2 - ra1) / 2)**2)
+    return math.degrees(2 * math.asin(min(1.0, math.sqrt(hav))))
+
+def zone(dec):
+    return min(max(int((dec + 90) / ZONE_HEIGHT), 0), NZONES - 1)
+
+def zone_cells(z):
+    """Number of RA cells in zone Z."""
+    lower = -90 + z * ZONE_HEIGHT
+    upper = lower + ZONE_HEIGHT
+    nearest_equator = 0 if lower < 0 < upper else min(abs(lower), abs(upper))
+    return max(1, int(360 * math.cos(math.radians(nearest_equator))
+                      / ZONE_HEIGHT))
+
+def cells(ra_lo, ra_hi, dec_lo, dec_hi):
+    """Sorted ids of cells touching box RA_LO..RA_HI, DEC_LO..DEC_HI.
+RA_HI may exceed 360 (box crosses RA=0)."""
+    ids = list()
+    for z in range(zone(dec_lo), zone(dec_hi) + 1):
+        n = zone_cells(z)
+        width = 360 / n
+        if ra_hi - ra_lo >= 360 - width:
+            ra_cells = range(n)
+        else:
+            first = int((ra_lo % 360) / width)
+            count = int((ra_lo % 360 + ra_hi - ra_lo) / width) - first + 1
+            ra_cells = sorted(set((first + i) % n for i in range(count)))
+        ids.extend(z * CELLS_PER_ZONE + c for c in ra_cells)
+    return ids
+
+def footprint(ra, dec):
+    """(ra_center, dec_center, fov_radius, sky_cells) of a FitsFile with RA,
+DEC ranges (NumericRange, degrees).  All None if either is missing.
+Bounds read back from the DB (numrange) are Decimal; used as float."""
+    if ra is None or dec is None or ra.lower is None or dec.lower is None:
+        return None, None, None, None
+    ra_lo, ra_hi = float(ra.lower), float(ra.upper)
+    if ra_hi - ra_lo > 180:
+        # HDUs on both sides of RA=0: the box is ra_hi..ra_lo+360
+        ra_lo, ra_hi = ra_hi, ra_lo + 360
+    dec_lo, dec_hi = float(dec.lower), float(dec.upper)
+    ra_c = ((ra_lo + ra_hi) / 2) % 360
+    dec_c = (dec_lo + dec_hi) / 2
+    radius = max(separation(ra_c, dec_c, r, d)
+                 for r in (ra_lo, ra_c, ra_hi)
+                 for d in (dec_lo, dec_c, dec_hi))
+    return ra_c, dec_c, radius, cells(ra_lo, ra_hi, dec_lo, dec_hi)
+
+def cone_cells(ra, dec, radius):
+    """Ids of cells touching the cone, or None if there are too many to
+be worth an index scan."""
+    ra, dec, radius = float(ra), float(dec), float(radius)
+    dec_lo, dec_hi = max(dec - radius, -90), min(dec + radius, 90)
+    if abs(dec) + radius >= 90:
+        half_width = 180
+    else:
+        half_width = math.degrees(math.asin(
+            min(1.0, math.sin(math.radians(radius))
+                / math.cos(math.radians(dec)))))
+    if (zone(dec_hi) - zone(dec_lo) + 1) * (half_width / ZONE_HEIGHT + 2) \
+       > MAX_PRUNE_CELLS:
+        return None
+    return cells(ra - half_width, ra + half_width, dec_lo, dec_hi)
+
+class Separation(Func):
+    """Great-circle distance (degrees) from (RA, DEC) to FitsFile centre."""
+    def __init__(self, ra, dec):
+        super().__init__('ra_center', 'dec_center', output_field=FloatField())
+        self.ra, self.dec = ra, dec
+
+    def as_sql(self, compiler, connection):
+        ra_sql, _ = compiler.compile(self.source_expressions[0])
+        dec_sql, _ = compiler.compile(self.source_expressions[1])
+        sql = ('degrees(2 * asin(least(1.0, sqrt('
+               'power(sin(radians({dec} - %s) / 2), 2)'
+               ' + cos(radians({dec})) * cos(radians(%s))'
+               ' * power(sin(radians({ra} - %s) / 2), 2)))))'
+               .format(ra=ra_sql, dec=dec_sql))
+        return sql, [self.dec, self.dec, self.ra]
+
+def backfill(qs):
+    """Compute sky index of FitsFiles QS (e.g. stored before the index
+existed).  Return number of files updated."""
+    updated = 0
+    for fits in qs.only('id', 'ra', 'dec').iterator():
+        ra_c, dec_c, radius, sky_cells = footprint(fits.ra, fits.dec)
+        qs.model.objects.filter(pk=fits.pk).update(
+            ra_center=ra_c, dec_center=dec_c,
+            fov_radius=radius, sky_cells=sky_cells)
+        updated += 1
+    return updated
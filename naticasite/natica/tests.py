@@ -18,10 +18,13 @@ import hashlib
 import json
 
 from django.core.urlresolvers import reverse
-from django.test import TestCase, Client, RequestFactory
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import TestCase, SimpleTestCase, Client, RequestFactory
 from naticasite import settings
 from . import expected as exp
 from . import views
+from . import fits_header
+from . import generation
 from .search_query_response import search_dict
 
 def md5(fname):
@@ -104,8 +107,579 @@ class StoreTest(TestCase):
         self.assertJSONEqual(json.dumps(jresponse), json.dumps(expected),
                              msg='Unexpected response3')
 
+    @testcase_log_console(logger)
+    def test_store_2(self):
+        """Error: client md5sum does not match uploaded bytes"""
+        badmd5 = '0' * 32
+        with open(self.fits1, 'rb') as f:
+            response = self.client.post(
+                '/natica/store/',
+                dict(md5sum=badmd5, file=f))
+        expected = {'errorMessage':
+                    'Checksum mismatch for c13a_141226_070040_ori.fits.fz; '
+                    'client={}, server={}'.format(badmd5, md5(self.fits1))}
+        self.assertEqual(response.status_code, 400)
+        self.assertJSONEqual(json.dumps(response.json()), json.dumps(expected))
+
+    @testcase_log_console(logger)
+    def test_store_batch_0(self):
+        """Batch: one good file, one non-FITS; per-file results"""
+        import tempfile, os
+        with tempfile.NamedTemporaryFile(suffix='.txt', delete=False) as tf:
+            tf.write(b'not a FITS file')
+        with open(self.fits1, 'rb') as f1, open(tf.name, 'rb') as f2:
+            response = self.client.post(
+                '/natica/store/batch/',
+                dict(md5sum=[md5(self.fits1), md5(tf.name)], file=[f1, f2]))
+        os.remove(tf.name)
+        results = response.json()['results']
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            results,
+            [{'name': 'c13a_141226_070040_ori.fits.fz',
+              'archive_filename': '/data/natica-archive/20141225/ct13m/smarts/c13a_141226_070040_ori.fits.fz'},
+             {'name': os.path.basename(tf.name),
+              'errorMessage': 'Not a FITS file (no SIMPLE card)'}])
+
+    @testcase_log_console(logger)
+    def test_store_batch_1(self):
+        """Batch: two files with the same name each get their own result"""
+        import tempfile, os
+        tmpdir = tempfile.mkdtemp()
+        bad = os.path.join(tmpdir, os.path.basename(self.fits1))
+        with open(bad, 'wb') as f:
+            f.write(b'not a FITS file')
+        with open(self.fits1, 'rb') as f1, open(bad, 'rb') as f2:
+            response = self.client.post(
+                '/natica/store/batch/',
+                dict(md5sum=[md5(self.fits1), md5(bad)], file=[f1, f2]))
+        os.remove(bad)
+        os.rmdir(tmpdir)
+        results = response.json()['results']
+        self.assertEqual([r['name'] for r in results],
+                         ['c13a_141226_070040_ori.fits.fz'] * 2)
+        self.assertIn('archive_filename', results[0])
+        self.assertEqual(results[1]['errorMessage'],
+                         'Not a FITS file (no SIMPLE card)')
+
+    def test_store_resumable_0(self):
+        """Resumable: chunks (one resent, one gapped), query, finish"""
+        with open(self.fits1, 'rb') as f:
+            content = f.read()
+        half = len(content) // 2
+        response = self.client.post('/natica/uploads/', dict(name='c.fits.fz'))
+        self.assertEqual(response.status_code, 201)
+        url = response.json()['url']
+        put = lambda offset, data: self.client.put(
+            '{}?offset={}'.format(url, offset), data,
+            content_type='application/octet-stream')
+        self.assertEqual(put(0, content[:half]).json()['offset'], half)
+        self.assertEqual(put(half + 10, content[half:]).status_code, 409)
+        self.assertEqual(put(0, content[:half]).json()['offset'], half)
+        self.assertEqual(self.client.get(url).json()['offset'], half)
+        self.assertEqual(put(half, content[half:]).json()['offset'],
+                         len(content))
+        response = self.client.post(url + 'finish/',
+                                    dict(md5sum=md5(self.fits1)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['archive_filename'],
+                         '/data/natica-archive/20141225/ct13m/smarts/c13a_141226_070040_ori.fits.fz')
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_store_resumable_1(self):
+        """Resumable: finish fails storing metadata; upload kept for retry"""
+        from unittest import mock
+        from . import exceptions as nex
+        with open(self.fits1, 'rb') as f:
+            content = f.read()
+        response = self.client.post('/natica/uploads/', dict(name='c.fits.fz'))
+        url = response.json()['url']
+        self.client.put('{}?offset=0'.format(url), content,
+                        content_type='application/octet-stream')
+        with mock.patch('natica.views.protected_store_metadata',
+                        side_effect=nex.DBStoreError('database unavailable')):
+            response = self.client.post(url + 'finish/',
+                                        dict(md5sum=md5(self.fits1)))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).json()['offset'], len(content))
+        response = self.client.post(url + 'finish/',
+                                    dict(md5sum=md5(self.fits1)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_store_resumable_2(self):
+        """Resumable: checksum mismatch discards the upload"""
+        with open(self.fits1, 'rb') as f:
+            content = f.read()
+        response = self.client.post('/natica/uploads/', dict(name='c.fits.fz'))
+        url = response.json()['url']
+        self.client.put('{}?offset=0'.format(url), content,
+                        content_type='application/octet-stream')
+        response = self.client.post(url + 'finish/', dict(md5sum='0' * 32))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_ingest_metrics_0(self):
+        """Metrics endpoint reports each server-side stage of an ingest"""
+        from . import metrics
+        metrics.reset()
+        with open(self.fits1, 'rb') as f:
+            self.client.post('/natica/store/',
+                             dict(md5sum=md5(self.fits1), file=f))
+        response = self.client.get('/natica/ana/metrics/')
+        self.assertEqual(response.status_code, 200)
+        stages = response.json()['stages']
+        for stage in ('receive', 'validate', 'place', 'store_metadata',
+                      'ingest'):
+            self.assertEqual(stages[stage]['count'], 1)
+
+    def test_checksums_0(self):
+        """Pre-check: archived md5sum gives its archive filename"""
+        with open(self.fits1, 'rb') as f:
+            self.client.post('/natica/store/',
+                             dict(md5sum=md5(self.fits1), file=f))
+        missing = 'd41d8cd98f00b204e9800998ecf8427e'
+        response = self.client.get('/natica/checksums/',
+                                   dict(md5sum=','.join([md5(self.fits1),
+                                                         missing])))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(),
+                         {'archived': {md5(self.fits1): '/data/natica-archive/20141225/ct13m/smarts/c13a_141226_070040_ori.fits.fz'},
+                          'missing': [missing]})
+
+    @testcase_log_console(logger)
+    def test_store_async_0(self):
+        """Async: 202 with job id, worker archives it, status says so"""
+        from . import jobs
+        with open(self.fits1, 'rb') as f:
+            response = self.client.post(
+                '/natica/store/?async=1',
+                dict(md5sum=md5(self.fits1), file=f))
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['job_id']
+        self.assertEqual(jobs.work(once=True), 1)
+        status = self.client.get('/natica/jobs/{}/'.format(job_id)).json()
+        self.assertEqual(status['state'], 'done')
+        self.assertEqual(status['archive_filename'], self.fits1)
+
+    def test_store_async_1(self):
+        """Async: job of a dead worker is claimed again once its lease is
+over; a job that fails removes its staged file"""
+        import os, tempfile, datetime
+        from django.utils import timezone
+        from . import jobs
+        from .models import IngestJob
+        fd, staged = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(b'not a FITS file')
+        started = timezone.now() - datetime.timedelta(
+            seconds=jobs.settings.ingest_job_lease + 60)
+        job = IngestJob.objects.create(staged_path=staged, name='x.fits',
+                                       md5sum='0' * 32, size=15,
+                                       state='running', started=started)
+        self.assertEqual(jobs.work(once=True), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.state, 'failed')
+        self.assertGreater(job.started, started)
+        self.assertFalse(os.path.exists(staged))
+
+    def hdudicts(self, nhdus):
+        primary = dict(SIMPLE=True, BITPIX=16, NAXIS=0,
+                       DTTELESC='ct4m', DTINSTRU='decam',
+                       DTPROPID='2017B-0951', PRODTYPE='image',
+                       PROCTYPE='raw', EXPTIME=10.0,
+                       RA='21:33:27.02', DEC='-00:49:23.7')
+        ext = dict(XTENSION='IMAGE', BITPIX=16, NAXIS=2, PCOUNT=0, GCOUNT=1,
+                   **{'DATE-OBS': '2017-08-15T05:45:46.000000'})
+        return [primary] + [dict(ext, EXTNAME='S{}'.format(i))
+                            for i in range(1, nhdus)]
+
+    def test_store_metadata_0(self):
+        """Number of SQL statements does not grow with number of HDUs"""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        counts = list()
+        for nhdus in (2, 70):
+            valdict = dict(src_fname='foo.fits', arch_fname='foo.fits',
+                           md5sum='{:032d}'.format(nhdus), size=0)
+            with CaptureQueriesContext(connection) as ctx:
+                fits = views.store_metadata(self.hdudicts(nhdus), valdict)
+            counts.append(len(ctx.captured_queries))
+            self.assertEqual(fits.hdu_set.count(), nhdus)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_store_metadata_1(self):
+        """Overwrite updates only what changed, keeping row ids"""
+        valdict = dict(src_fname='foo.fits', arch_fname='foo.fits',
+                       md5sum='{:032d}'.format(1), size=0)
+        from .models import FitsFile
+        fits = views.store_metadata(self.hdudicts(4), valdict)
+        hdu_ids = dict(fits.hdu_set.values_list('hdu_idx', 'id'))
+        # As read back from the DB (e.g. numrange bounds are Decimal)
+        fits = FitsFile.objects.get(pk=fits.pk)
+        self.assertEqual(views.update_metadata(fits, self.hdudicts(4), valdict),
+                         dict(fitsfile_fields=0, hdus_updated=0,
+                              hdus_inserted=0, hdus_deleted=0))
+        hdudicts = self.hdudicts(3)        # one HDU fewer
+        hdudicts[1]['FILTER'] = 'r'         # one card (so FitsFile extras)
+        valdict['md5sum'] = '{:032d}'.format(2)
+        counts = views.update_metadata(fits, hdudicts, valdict)
+        self.assertEqual(counts, dict(fitsfile_fields=2, hdus_updated=1,
+                                      hdus_inserted=0, hdus_deleted=1))
+        fits2 = views.store_metadata(hdudicts, valdict, overwrite=True)
+        self.assertEqual(fits2.id, fits.id)
+        self.assertEqual(dict(fits2.hdu_set.values_list('hdu_idx', 'id')),
+                         dict((i, hdu_ids[i]) for i in range(3)))
+        self.assertEqual(fits2.hdu_set.get(hdu_idx=1).extras['FILTER'], 'r')
+
+    def test_refdata_0(self):
+        """Reference lookups hit DB once, and reload after table edit"""
+        from .models import Telescope
+        from . import refdata
+        refdata.get()
+        with self.assertNumQueries(0):
+            self.assertIn('ct4m', refdata.telescopes())
+            self.assertEqual(refdata.file_prefix('ct','ct4m','decam'), 'c4d')
+            self.assertEqual(refdata.obs_code('object'), 'o')
+        Telescope(name='newtele').save()
+        # Not until the edit is committed (TestCase never commits: run what
+        # transaction.on_commit would)
+        self.assertNotIn('newtele', refdata.telescopes())
+        refdata.reset()
+        self.assertIn('newtele', refdata.telescopes())
+
         
 
+class AggregateTest(SimpleTestCase):
+    """One-pass aggregation of HDU values for FitsFile"""
+
+    def test_aggregate_0(self):
+        """Each mode: first, distinct (capped), range, skip"""
+        from psycopg2.extras import NumericRange, DateRange
+        from .aggregate import aggregate_hdus
+        hdudicts = [dict(DTPROPID='2017B-0951', EXPTIME=10, CHECKSUM='a',
+                         RA='01:00:00', DEC='-10:30:00')]
+        hdudicts += [dict(DTPROPID='other', EXPTIME=30, CHECKSUM='b',
+                          OBJECT='M31', EXTNAME='S{}'.format(i),
+                          **{'DATE-OBS': '2017-08-1{}T00:00:00'.format(i)})
+                     for i in range(1, 5)]
+        agg, range_keys = aggregate_hdus(hdudicts, cap=3)
+        self.assertEqual(range_keys, {'DATE-OBS', 'EXPTIME', 'RA', 'DEC'})
+        self.assertEqual(agg['DTPROPID'], '2017B-0951')
+        self.assertEqual(agg['OBJECT'], ['M31'])
+        self.assertEqual(agg['EXTNAME'], ['S1', 'S2', 'S3'])
+        self.assertNotIn('CHECKSUM', agg)
+        self.assertEqual(agg['EXPTIME'], NumericRange(10, 30, '[]'))
+        self.assertEqual(agg['RA'], NumericRange(15.0, 15.0, '[]'))
+        self.assertEqual(agg['DEC'], NumericRange(-10.5, -10.5, '[]'))
+        self.assertEqual(agg['DATE-OBS'],
+                         DateRange('2017-08-11T00:00:00',
+                                   '2017-08-14T00:00:00', '[]'))
+
+class SkyTest(SimpleTestCase):
+    """Sky index for cone search"""
+
+    def test_sky_0(self):
+        """Footprints across RA=0 and cones near the pole share cells"""
+        from psycopg2.extras import NumericRange
+        from . import sky
+        # HDUs at RA 359.8 and 0.3: box is 359.8..360.3, not 0.3..359.8
+        ra_c, dec_c, radius, cells = sky.footprint(
+            NumericRange(0.3, 359.8, '[]'), NumericRange(-0.2, 0.2, '[]'))
+        self.assertAlmostEqual(ra_c, 0.05)
+        self.assertLess(radius, 0.5)
+        for ra in (359.9, 0.1):
+            self.assertTrue(set(sky.cone_cells(ra, 0, 0.01)) & set(cells))
+        self.assertFalse(set(sky.cone_cells(180, 0, 0.01)) & set(cells))
+        # Every RA cell of the polar zone
+        polar = sky.cone_cells(0, 89.9, 0.2)
+        self.assertEqual(len([c for c in polar
+                              if c // sky.CELLS_PER_ZONE == sky.NZONES - 1]),
+                         sky.zone_cells(sky.NZONES - 1))
+        self.assertAlmostEqual(sky.separation(359.9, 0, 0.1, 0), 0.2)
+        self.assertAlmostEqual(sky.separation(0, 60, 2, 60), 1.0, places=2)
+
+    def test_sky_1(self):
+        """Decimal bounds (numrange read back from the DB) work as floats"""
+        from decimal import Decimal
+        from psycopg2.extras import NumericRange
+        from . import sky
+        ra, dec = (NumericRange(10.5, 10.7, '[]'),
+                   NumericRange(-20.1, -19.9, '[]'))
+        self.assertEqual(
+            sky.footprint(NumericRange(Decimal('10.5'), Decimal('10.7'), '[]'),
+                          NumericRange(Decimal('-20.1'), Decimal('-19.9'),
+                                       '[]')),
+            sky.footprint(ra, dec))
+        self.assertEqual(sky.cone_cells(Decimal('10.6'), Decimal('-20'),
+                                        Decimal('0.1')),
+                         sky.cone_cells(10.6, -20, 0.1))
+
+class FacetsTest(SimpleTestCase):
+    """Facet counts of dal.get_categories_for_query in one query"""
+    siap = [dict(prop_id='2017B-0951', survey_id=None, pi='Vivas',
+                 telescope_instrument='ct4m,decam', filter='g',
+                 observation_type='object', observation_mode=None,
+                 product='image', processing='raw'),
+            dict(prop_id='2017B-0951', survey_id=None, pi='Vivas',
+                 telescope_instrument='ct4m,decam', filter='r',
+                 observation_type='object', observation_mode=None,
+                 product='dqmask', processing='instcal'),
+            dict(prop_id='2017B-0169', survey_id='des', pi='R Foley',
+                 telescope_instrument='kp4m,kosmos', filter='g',
+                 observation_type='zero', observation_mode='sos_slit',
+                 product='image', processing='raw')]
+
+    def test_facet_sql_0(self):
+        """One grouping set per category; values capped per category"""
+        from dal import facets
+        sql = facets.facet_sql("WHERE (telescope = 'ct4m')", max_values=5)
+        names = [name for _,name in facets.CATEGORIES]
+        self.assertIn('GROUP BY GROUPING SETS ({})'.format(
+            ', '.join('({})'.format(name) for name in names)), sql)
+        self.assertIn('GROUPING({}) AS grp'.format(', '.join(names)), sql)
+        self.assertIn("FROM voi.siap WHERE (telescope = 'ct4m')", sql)
+        self.assertIn("concat(telescope, ',', instrument)"
+                      " AS telescope_instrument", sql)
+        self.assertIn('surveyid AS survey_id', sql)
+        self.assertTrue(sql.endswith('WHERE nth <= 5'))
+
+    def test_categories_of_0(self):
+        """Rows of every grouping set decode to the dict the per-category
+GROUP BY queries returned"""
+        from collections import Counter
+        from dal import facets
+        names = [name for _,name in facets.CATEGORIES]
+        ncat = len(names)
+        # What Postgres returns for facet_sql(): per grouping set, the
+        # grouped column has the value, the others NULL
+        rows = list()
+        old = dict()
+        for i,name in enumerate(names):
+            counts = Counter(r[name] for r in self.siap)
+            old[name] = [{name: value, 'total': total}
+                         for value,total in counts.items()]
+            mask = ((1 << ncat) - 1) ^ (1 << (ncat - 1 - i))
+            for nth,(value,total) in enumerate(counts.most_common(), 1):
+                values = [None] * ncat
+                values[i] = value
+                rows.append(tuple([mask] + values + [total, nth]))
+        got = facets.categories_of(reversed(rows))
+        self.assertEqual(list(got), names)
+        for name in names:
+            self.assertEqual(sorted(got[name], key=repr),
+                             sorted(old[name], key=repr), msg=name)
+            totals = [r['total'] for r in got[name]]
+            self.assertEqual(totals, sorted(totals, reverse=True), msg=name)
+        self.assertEqual(got['prop_id'],
+                         [{'prop_id': '2017B-0951', 'total': 2},
+                          {'prop_id': '2017B-0169', 'total': 1}])
+
+class CoordsTest(SimpleTestCase):
+    """Sexagesimal to degrees vs. astropy"""
+    ra_corpus = ['21:33:27.02', '00:00:00', '23:59:59.999', '12 30 00',
+                 '12h30m00s', '05:35:17.3', '5:35:17.3', '12:30.5',
+                 '18.5', '0.0001', 12.25]
+    dec_corpus = ['-00:49:23.7', '+00:49:23.7', '-89:59:59.99', '90:00:00',
+                  '-05 23 28', '41d16m09s', '-30:00', '-12.5', '0', 45.0]
+
+    def test_coords_0(self):
+        """Agree with astropy to 1e-9 deg"""
+        import numpy as np
+        import astropy.coordinates as coord
+        import astropy.units as u
+        from . import coords
+        for corpus,func,unit in ((self.ra_corpus, coords.ra_to_deg, u.h),
+                                 (self.dec_corpus, coords.dec_to_deg, u.deg)):
+            expected = np.array([coord.Angle(v, unit=unit).degree
+                                 for v in corpus])
+            got = func(corpus + corpus) # repeats come from cache
+            self.assertEqual(got.shape, (2*len(corpus),))
+            self.assertLess(np.abs(got[:len(corpus)] - expected).max(), 1e-9)
+            self.assertLess(np.abs(got[len(corpus):] - expected).max(), 1e-9)
+
+    def test_coords_1(self):
+        """Invalid formats and values are rejected"""
+        from . import coords
+        from . import exceptions as nex
+        for bad in (['12:61:00'], ['ten hours'], ['12:30:60'], ['-01:00:00'],
+                    ['nan'], ['25:00:00']):
+            with self.assertRaises(nex.BadFitsHdrContent):
+                coords.ra_to_deg(bad)
+        with self.assertRaises(nex.BadFitsHdrContent):
+            coords.dec_to_deg(['-91:00:00'])
+
+class MetricsTest(SimpleTestCase):
+    """Per-stage ingest timing"""
+
+    def test_metrics_0(self):
+        """Percentiles, rates and errors of recent samples"""
+        import time
+        from . import metrics
+        metrics.reset()
+        now = time.time()
+        for ms in range(1, 101):
+            metrics.record('place', ms/1000, nbytes=10**6)
+        with self.assertRaises(ValueError):
+            with metrics.timer('place'):
+                raise ValueError('boom')
+        metrics._samples['old'].append((now - 2*metrics.WINDOW, 1.0, 0))
+        stages = metrics.summary(now=now + 1)['stages']
+        self.assertEqual(stages['place']['count'], 100)
+        self.assertEqual(stages['place']['errors'], 1)
+        self.assertAlmostEqual(stages['place']['p50_ms'], 50.5)
+        self.assertAlmostEqual(stages['place']['p99_ms'], 99.01)
+        self.assertEqual(stages['old']['count'], 0)
+
+class PlacementTest(SimpleTestCase):
+    """Moving staged files into archive"""
+
+    def test_place_0(self):
+        """Same device: rename, nothing copied; across: kernel copy.
+Either way the placed file has the umask default mode (not 0600)"""
+        import tempfile, os
+        from unittest import mock
+        from . import placement
+        from . import settings as nsettings
+        from . import file_naming as fn
+        umask = os.umask(0o022)
+        os.umask(umask)
+        for dstroot in ('/tmp', '/dev/shm'):
+            with tempfile.TemporaryDirectory(dir=dstroot) as dstdir, \
+                 tempfile.TemporaryDirectory(dir='/tmp') as staging, \
+                 mock.patch.object(nsettings, 'staging_root', staging):
+                src = fn.new_staging_path()
+                with open(src, 'wb') as f:
+                    f.write(b'x' * 10000)
+                placement.reset()
+                dst = os.path.join(dstdir, 'a.fits')
+                method = placement.place(src, dst)
+                if not placement.same_device('/tmp', dstroot):
+                    self.assertEqual(method, 'copy')
+                    self.assertEqual(placement.stats()['bytes_copied'], 10000)
+                else:
+                    self.assertEqual(method, 'rename')
+                    self.assertEqual(placement.stats()['bytes_copied'], 0)
+                self.assertFalse(os.path.exists(src))
+                with open(dst, 'rb') as f:
+                    self.assertEqual(f.read(), b'x' * 10000)
+                self.assertEqual(os.stat(dst).st_mode & 0o777,
+                                 0o666 & ~umask)
+
+    def test_place_1(self):
+        """Short kernel copy is an error; nothing placed"""
+        import tempfile, os
+        from unittest import mock
+        from . import placement
+        with tempfile.TemporaryDirectory() as tmpdir:
+            src = os.path.join(tmpdir, 'src.fits')
+            with open(src, 'wb') as f:
+                f.write(b'x' * 10000)
+            dst = os.path.join(tmpdir, 'a.fits')
+            with mock.patch.object(placement.os, 'copy_file_range',
+                                   side_effect=[4096, 0], create=True):
+                with self.assertRaises(OSError):
+                    placement.kernel_copy(src, dst)
+            with mock.patch.object(placement, 'same_device',
+                                   return_value=False), \
+                 mock.patch.object(placement, 'kernel_copy',
+                                   side_effect=OSError('short copy')):
+                with self.assertRaises(OSError):
+                    placement.place(src, os.path.join(tmpdir, 'b.fits'))
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['a.fits', 'src.fits'])
+
+class StagingTest(SimpleTestCase):
+    """Each upload gets its own staging file"""
+
+    def test_staging_0(self):
+        """Concurrent uploads of files with the same name don't clobber"""
+        import tempfile
+        from concurrent.futures import ThreadPoolExecutor
+        from unittest import mock
+        from . import settings as nsettings
+        from . import file_naming as fn
+        from .upload_handlers import FitsStagingUploadHandler
+        with tempfile.TemporaryDirectory() as tmpdir, \
+             mock.patch.object(nsettings, 'staging_root', tmpdir):
+            handlers = [FitsStagingUploadHandler() for i in range(2)]
+            for h in handlers:
+                h.new_file('file', 'obj_355.fits.fz', 'application/fits',
+                           None)
+            # Chunks of the two uploads arrive interleaved
+            for i in range(3):
+                for h,byte in zip(handlers, (b'a', b'b')):
+                    h.receive_data_chunk(byte * 1000, i * 1000)
+            files = [h.file_complete(3000) for h in handlers]
+            paths = [f.temporary_file_path() for f in files]
+            self.assertNotEqual(paths[0], paths[1])
+            self.assertEqual([f.name for f in files], ['obj_355.fits.fz'] * 2)
+            for path,byte in zip(paths, (b'a', b'b')):
+                with open(path, 'rb') as f:
+                    self.assertEqual(f.read(), byte * 3000)
+            for f in files:
+                f.close()
+            with ThreadPoolExecutor(8) as pool:
+                many = list(pool.map(lambda i: fn.new_staging_path(),
+                                     range(200)))
+            self.assertEqual(len(set(many)), 200)
+
+class SchemaTest(SimpleTestCase):
+    """Schemas are compiled once and reloaded when the file changes"""
+
+    def test_schema_reload_0(self):
+        """New schema file content is used without a restart"""
+        import os, tempfile, jsonschema
+        from . import schemas
+        with tempfile.NamedTemporaryFile('w', suffix='.json',
+                                         delete=False) as f:
+            json.dump({'type': 'object'}, f)
+        try:
+            validator = schemas.CachedValidator(f.name)
+            validator.validate({'limit': 'ten'})
+            compiled = validator.get()
+            self.assertIs(validator.get(), compiled) # not reloaded
+            with open(f.name, 'w') as f2:
+                json.dump({'type': 'object',
+                           'properties': {'limit': {'type': 'integer'}}}, f2)
+            mtime = os.stat(f.name).st_mtime_ns + 10**9
+            os.utime(f.name, ns=(mtime, mtime))
+            with self.assertRaises(jsonschema.ValidationError):
+                validator.validate({'limit': 'ten'})
+            self.assertIsNot(validator.get(), compiled)
+        finally:
+            os.remove(f.name)
+
+class FitsHeaderTest(SimpleTestCase):
+    """Header-only parser vs. astropy"""
+    maxDiff = None
+
+    def setUp(self):
+        self.fits1 = '/data/natica-archive/20141225/ct13m/smarts/c13a_141226_070040_ori.fits.fz'
+
+    def test_headers_0(self):
+        """Same cards (values) as astropy for compressed file"""
+        import astropy.io.fits as pyfits
+        hdudicts = fits_header.read_headers(self.fits1)
+        with pyfits.open(self.fits1) as hdulist:
+            expected = [dict(hdu.header.items()) for hdu in hdulist]
+        self.assertEqual(len(hdudicts), len(expected))
+        for got,want in zip(hdudicts, expected):
+            for k in ('BITPIX', 'NAXIS', 'DTTELESC', 'DTINSTRU', 'DATE-OBS',
+                      'DTPROPID', 'EXPTIME'):
+                self.assertEqual(got.get(k), want.get(k), msg=k)
+
+    def test_offsets_0(self):
+        """HDU offsets are block aligned and within file"""
+        import os
+        hdudicts,offsets = fits_header.read_headers(self.fits1, offsets=True)
+        self.assertEqual(len(hdudicts), len(offsets))
+        for off in offsets:
+            self.assertEqual(off['header'] % fits_header.BLOCK_SIZE, 0)
+            self.assertEqual(off['data'] % fits_header.BLOCK_SIZE, 0)
+        self.assertLessEqual(offsets[-1]['data'] + offsets[-1]['datasize'],
+                             os.path.getsize(self.fits1))
+
+
 class SearchTest(TestCase):
 
     maxDiff = None # too see full values in DIFF on assert failure
@@ -115,7 +689,31 @@ class SearchTest(TestCase):
                 'search_hits.Proposal.yaml',
                 'search_hits.FitsFile.yaml',
     ]
+
+    def setUp(self):
+        # Fixtures are loaded without bumping the generation; forget counts
+        # and pages cached by other tests.
+        generation.bump()
+        # Fixtures predate the sky index
+        from . import sky
+        from .models import FitsFile
+        sky.backfill(FitsFile.objects.exclude(ra=None).exclude(dec=None))
     
+    def test_sky_backfill_0(self):
+        """Sky index computed from ranges as stored in (read from) the DB"""
+        from . import sky
+        from .models import FitsFile
+        qs = FitsFile.objects.exclude(ra=None).exclude(dec=None)
+        qs.update(sky_cells=None, ra_center=None, dec_center=None,
+                  fov_radius=None)
+        self.assertEqual(sky.backfill(qs), qs.count())
+        for fits in qs:
+            self.assertEqual(
+                (fits.ra_center, fits.dec_center, fits.fov_radius,
+                 fits.sky_cells),
+                sky.footprint(fits.ra, fits.dec))
+            self.assertTrue(fits.sky_cells)
+
     #############################################################################
     ### /natica/search
     ###
@@ -208,6 +806,200 @@ class SearchTest(TestCase):
         self.assertEqual(response.status_code, 200)
 
 
+    def test_search_cursor_0(self):
+        """Cursor pages (and old page=N) match one big page, in order"""
+        def ids(query):
+            response = self.client.post('/natica/search/' + query,
+                                        content_type='application/json',
+                                        data='{ }')
+            self.assertEqual(response.status_code, 200)
+            return ([r['id'] for r in response.json()['resultset']],
+                    response.json()['meta']['next_cursor'])
+        for order in ('original_filename', '-release_date'):
+            everything,cursor = ids('?limit=10000&order={}'.format(order))
+            self.assertIsNone(cursor)
+            paged = list()
+            cursor = ''
+            while cursor is not None:
+                page,cursor = ids('?limit=3&order={}&cursor={}'
+                                  .format(order, cursor))
+                paged.extend(page)
+            self.assertEqual(paged, everything)
+            self.assertEqual(ids('?limit=3&page=2&order={}'.format(order))[0],
+                             everything[3:6])
+
+    def test_search_cursor_1(self):
+        """Bad limit, page or cursor is a 400, not a server error"""
+        import base64
+        def status(query):
+            return self.client.post('/natica/search/' + query,
+                                    content_type='application/json',
+                                    data='{ }').status_code
+        def cursor(*fields):
+            return base64.urlsafe_b64encode(
+                json.dumps(fields).encode()).decode()
+        for query in ('?limit=0', '?limit=-5', '?limit=ten', '?page=0',
+                      '?cursor=notbase64',
+                      '?cursor=' + cursor('original_filename', 'a', 1, 'x'),
+                      '?cursor=' + cursor('original_filename', 'a', 'x', 3),
+                      '?cursor=' + cursor('original_filename', 'a', 1, -3),
+                      '?cursor=' + cursor('original_filename', [], 1, 3)):
+            self.assertEqual(status(query), 400, msg=query)
+
+    def test_search_results_0(self):
+        """Projected result rows: one query, same values as model instances"""
+        from . import search_results
+        from .models import FitsFile
+        qs = FitsFile.objects.order_by('id')
+        with self.assertNumQueries(1):
+            rows = search_results.fetch(qs)
+        self.assertEqual(len(rows), qs.count())
+        for row,fobj in zip(rows, qs):
+            self.assertEqual(sorted(row), sorted(search_results.KEYS))
+            self.assertEqual(row['filename'], fobj.archive_filename)
+            self.assertEqual(row['instrument'], fobj.instrument.name)
+            self.assertEqual(row['prop_id'], fobj.extras.get('DTPROPID'))
+            if fobj.ra is not None:
+                self.assertEqual(row['ra'], [fobj.ra.lower, fobj.ra.upper])
+
+    def test_search_export_0(self):
+        """Export streams every match, same rows as one big page"""
+        from . import search_results
+        response = self.client.post('/natica/search/?limit=10000',
+                                    content_type='application/json',
+                                    data='{ }')
+        everything = response.json()['resultset']
+        response = self.client.post('/natica/search/?export=ndjson',
+                                    content_type='application/json',
+                                    data='{ }')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        text = b''.join(response.streaming_content).decode()
+        rows = [json.loads(line) for line in text.splitlines()]
+        self.assertJSONEqual(json.dumps(rows), json.dumps(everything))
+        response = self.client.post('/natica/search/?export=csv',
+                                    content_type='application/json',
+                                    data='{ }')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(','), search_results.KEYS)
+        self.assertEqual(len(lines), 1 + len(everything))
+
+    def test_search_cache_0(self):
+        """Repeated search is served from cache until generation changes"""
+        def post():
+            return self.client.post('/natica/search/?limit=5',
+                                    content_type='application/json',
+                                    data='{ }')
+        first = post()
+        self.assertEqual(first['X-Natica-Cache'], 'miss')
+        second = post()
+        self.assertEqual(second['X-Natica-Cache'], 'memory')
+        self.assertEqual(second.json(), first.json())
+        generation.bump()   # e.g. metadata stored
+        self.assertEqual(post()['X-Natica-Cache'], 'miss')
+
+    def test_search_cone_0(self):
+        """Cone search across RA=0 and ordered by separation"""
+        def filenames(req, query=''):
+            response = self.client.post('/natica/search/' + query,
+                                        content_type='application/json',
+                                        data=json.dumps(req))
+            self.assertEqual(response.status_code, 200)
+            return response.json()['resultset']
+        # k4k_170815_092726_ori is at RA 18.897, DEC -0.845
+        hits = filenames({"coordinates": {"ra": 378.897, "dec": -0.845},
+                          "search_box_min": 0.01})
+        self.assertEqual([r['original_filename'].split('/')[-1] for r in hits],
+                         ['k4k_170815_092726_ori.fits.json'])
+        # In the corner of the old RA/DEC box, but 1.59 degrees away
+        self.assertEqual(filenames({"coordinates": {"ra": 20.0, "dec": 0.3},
+                                    "search_box_min": 1.2}), [])
+        everything = filenames({"coordinates": {"ra": 300, "dec": 0},
+                                "search_box_min": 90},
+                               '?order=separation&limit=3')
+        seps = [r['separation'] for r in everything]
+        self.assertEqual(seps, sorted(seps))
+
+    def test_search_keywords_0(self):
+        """Header keyword columns: indexed filters, results from columns"""
+        from . import search_filters as sf
+        from .models import FitsFile
+        # Stored as in the header; matched ignoring case
+        FitsFile.objects.filter(pk=108331).update(prodtype='IMAGE',
+                                                  proctype='Raw',
+                                                  obstype='OBJECT')
+        raw = FitsFile.objects.filter(sf.proctype(['RAW']))
+        self.assertEqual(sorted(raw.values_list('id', flat=True)),
+                         [108331, 108332])
+        self.assertEqual(
+            sorted(FitsFile.objects.filter(sf.image_filter(['raw']))
+                   .values_list('id', flat=True)),
+            [108331, 108332])
+        response = self.client.post('/natica/search/?order=id&limit=1',
+                                    content_type='application/json',
+                                    data='{ }')
+        row = response.json()['resultset'][0]
+        self.assertEqual(row['id'], 108331)
+        self.assertEqual(row['product'], 'IMAGE')
+        self.assertEqual(row['prop_id'], '2017B-0951')
+        self.assertEqual(row['observation_type'], ['OBJECT'])
+
+    def test_search_service_0(self):
+        """JSON view, form view and direct service calls agree"""
+        from urllib.parse import urlencode
+        from . import search_service
+        of = '/data/small-json-scrape/c09i_040811_051619_ori.fits.json'
+        jsearch = {"original_filename": of}
+        via_json = self.client.post('/natica/search/',
+                                    content_type='application/json',
+                                    data=json.dumps(jsearch)).json()
+        via_form = self.client.post(
+            '/natica/search2/', urlencode(jsearch),
+            content_type='application/x-www-form-urlencoded').json()
+        search_service.validate(jsearch)
+        direct = search_service.search(jsearch, search_service.params({}))
+        self.assertEqual([r['original_filename'] for r in via_json['resultset']],
+                         [of])
+        self.assertEqual(via_form['resultset'], via_json['resultset'])
+        self.assertEqual(json.loads(json.dumps(direct['resultset'],
+                                               cls=DjangoJSONEncoder)),
+                         via_json['resultset'])
+
+    def test_search_error_3(self):
+        "Error in request: order by field that is not allowed"
+        response = self.client.post('/natica/search/?order=extras',
+                                    content_type='application/json',
+                                    data='{ }')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Cannot order by "extras"',
+                      response.json()['errorMessage'])
+
+    def test_search_count_0(self):
+        """Count modes agree on small result; only=count/exists"""
+        from . import counting
+        def meta(query, req='{ }'):
+            response = self.client.post('/natica/search/' + query,
+                                        content_type='application/json',
+                                        data=req)
+            self.assertEqual(response.status_code, 200)
+            return response.json()
+        exact = meta('?count=exact')['meta']
+        self.assertEqual(exact['count_mode'], 'exact')
+        cached = meta('?count=cached')['meta']
+        self.assertEqual(cached['total_count'], exact['total_count'])
+        self.assertEqual(meta('?count=auto')['meta']['count_mode'], 'cached')
+        generation.bump()   # e.g. new file ingested
+        self.assertIsNone(counting.cached(counting.query_key({})))
+        self.assertEqual(meta('?count=estimate')['meta']['count_mode'],
+                         'estimate')
+        only = meta('?only=count&count=exact')
+        self.assertEqual(only['meta']['total_count'], exact['total_count'])
+        self.assertEqual(only['resultset'], [])
+        self.assertTrue(meta('?only=exists')['meta']['exists'])
+        self.assertFalse(meta('?only=exists',
+                              '{"original_filename": "nosuchfile"}'
+                              )['meta']['exists'])
+
     def test_search_error_1(self):
         "Error in request content: extra fields sent"
         req = '''{"coordinates": {
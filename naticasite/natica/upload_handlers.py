@@ -0,0 +1,142 @@
+"""
+Upload handler that stages a FITS file for ingest in a single pass.
+
+As each chunk of the upload arrives it is: added to an MD5 digest, fed to a
+FITS header parser, and written to the staging file.  No other copy of the
+upload is made by Django.
+"""
+import hashlib
+import logging
+import os
+import time
+
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+from . import exceptions as nex
+from . import file_naming as fn
+from .fits_header import HeaderStream
+from . import placement
+from . import metrics
+
+
+class StagedFitsFile(UploadedFile):
+    """An uploaded FITS file already written to its staging path.
+
+    md5sum:: hex digest of uploaded bytes (computed on the server)
+    hdudicts:: list of header dicts (one per HDU)
+    fits_error:: exception raised when parsing headers (else None)
+    """
+    def __init__(self, path, name, content_type, size, charset,
+                 md5sum, hdudicts, fits_error, content_type_extra=None):
+        super().__init__(open(path, 'rb'), name, content_type, size,
+                         charset, content_type_extra)
+        self.path = path
+        self.md5sum = md5sum
+        self.hdudicts = hdudicts
+        self.fits_error = fits_error
+
+    def temporary_file_path(self):
+        return self.path
+
+    @classmethod
+    def from_path(cls, path, chunk_size=2**20, name=None):
+        """Hash and parse headers of existing file PATH in one pass.
+NAME is the client's name for the file (default: basename of PATH)."""
+        md5 = hashlib.md5()
+        headers = HeaderStream()
+        fits_error = None
+        size = 0
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                md5.update(chunk)
+                size += len(chunk)
+                if fits_error is None:
+                    try:
+                        headers.feed(chunk)
+                    except nex.FitsError as err:
+                        fits_error = err
+        hdudicts = None
+        if fits_error is None:
+            try:
+                hdudicts = headers.close()
+            except nex.FitsError as err:
+                fits_error = err
+        return cls(path, name or os.path.basename(path), 'application/fits', size,
+                   None, md5.hexdigest(), hdudicts, fits_error)
+
+
+class FitsStagingUploadHandler(FileUploadHandler):
+    """Hash, parse headers of, and write each upload to a staging file as it
+arrives.  Every file uploaded in field FIELD gets its own (unique) staging
+file; their paths are in self.staged.  Other fields go to the next handler.
+If DURABLE, staging files are fsync'ed before the upload is complete.
+"""
+    def __init__(self, field='file', durable=False, request=None):
+        super().__init__(request)
+        self.field = field
+        self.durable = durable
+        self.active = False
+        self.staged = list()
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.active = (field_name == self.field)
+        if not self.active:
+            return
+        self.started = time.perf_counter()
+        self.staging_path = fn.new_staging_path()
+        self.staged.append(self.staging_path)
+        self.md5 = hashlib.md5()
+        self.headers = HeaderStream()
+        self.fits_error = None
+        self.destination = open(self.staging_path, 'wb')
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        self.md5.update(raw_data)
+        if self.fits_error is None:
+            try:
+                self.headers.feed(raw_data)
+            except nex.FitsError as err:
+                self.fits_error = err
+        self.destination.write(raw_data)
+        return None # we consumed it; don't pass to other handlers
+
+    def file_complete(self, file_size):
+        if not self.active:
+            return None
+        self.active = False
+        if self.durable:
+            self.destination.flush()
+            os.fsync(self.destination.fileno())
+        self.destination.close()
+        placement.record_staged(file_size)
+        metrics.record('receive', time.perf_counter() - self.started,
+                       file_size)
+        hdudicts = None
+        if self.fits_error is None:
+            try:
+                hdudicts = self.headers.close()
+            except nex.FitsError as err:
+                self.fits_error = err
+        logging.debug('DBG: staged upload {} ({} bytes) to {}'
+                      .format(self.file_name, file_size, self.staging_path))
+        return StagedFitsFile(self.staging_path,
+                              self.file_name,
+                              self.content_type,
+                              file_size,
+                              self.charset,
+                              self.md5.hexdigest(),
+                              hdudicts,
+                              self.fits_error,
+                              self.content_type_extra)
+
+    def upload_interrupted(self):
+        if self.active:
+            self.destination.close()
+            try:
+                os.remove(self.staging_path)
+            except OSError:
+                pass
@@ -3,6 +3,14 @@ from . import views
 
 urlpatterns = [
     url(r'^store/$', views.store, name='store'),       # ESSENTIAL
+    url(r'^store/batch/$', views.store_batch, name='store_batch'),
+    url(r'^jobs/(?P<job_id>[0-9]+)/$', views.job_status, name='job_status'),
+    url(r'^checksums/$', views.checksums, name='checksums'),
+    url(r'^uploads/$', views.upload_start, name='upload_start'),
+    url(r'^uploads/(?P<upload_id>[0-9a-f]{32})/$', views.upload_chunk,
+        name='upload_chunk'),
+    url(r'^uploads/(?P<upload_id>[0-9a-f]{32})/finish/$', views.upload_finish,
+        name='upload_finish'),
     url(r'^search/$', views.search, name='search'),      # ESSENTIAL
     #url(r'^retrieve/$', views.retrieve, name='retrieve'),# ESSENTIAL
 
@@ -13,6 +21,9 @@ urlpatterns = [
     url(r'^search2/$', views.search2, name='search2'),
     url(r'^prot/$', views.prot, name='prot'),
     url(r'^ana/$', views.analysis, name='analysis'),
+    url(r'^ana/metrics/$', views.ingest_metrics, name='ingest_metrics'),
+    url(r'^ana/placement/$', views.placement_metrics,
+        name='placement_metrics'),
     url(r'^query/$', views.query, name='query'),
 
 ]
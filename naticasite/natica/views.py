@@ -6,26 +6,24 @@ import argparse
 import logging
 import hashlib
 import json
-import jsonschema
 import requests
 import datetime
 import pytz
 import warnings
 import random
-from collections import OrderedDict, defaultdict, Counter
-import shutil
+from collections import OrderedDict, Counter
 import os
+import errno
 
-import astropy.coordinates as coord
-import astropy.units as u
 from psycopg2.extras import NumericRange, DateRange
 
 import dateutil.parser
 from django.shortcuts import render
+from django.core.urlresolvers import reverse
 from django.http import HttpResponse, JsonResponse, HttpResponseBadRequest
+from django.http import StreamingHttpResponse
 from rest_framework.decorators import api_view, renderer_classes
 
-from django.test import Client
 from django.utils import timezone
 from django.db.models import Q
 from django.views.decorators.csrf import csrf_exempt
@@ -33,25 +31,31 @@ from django.core.management.base import CommandError
 from django.views.decorators.cache import never_cache
 import django_tables2 as tables
 from django.core.exceptions import ObjectDoesNotExist
-from django.db  import IntegrityError
+from django.db  import IntegrityError, transaction
 
-from .models import FitsFile, Hdu, Proposal, Site, Telescope, Instrument
+from .models import FitsFile, Hdu, Proposal, Site
+from .models import IngestJob
 from .forms import SearchForm
 from . import exceptions as nex
-from . import search_filters as sf
 from . import proto
 from . import file_naming as fn
+from . import fits_header
+from . import resumable
+from . import placement
+from . import metrics
+from . import search_results
+from . import search_cache
+from . import search_service
+from . import sky
+from . import generation
+from . import refdata
+from . import schemas
+from . import jobs
+from .upload_handlers import FitsStagingUploadHandler, StagedFitsFile
+from . import settings
+from .aggregate import aggregate_hdus
 
-api_version = '0.1.7' # prototype only
 
-# Sean: RA is measured in units of time (hours, minutes, seconds)
-# while Dec is measured in the usual units of angular measurement
-# (degrees, minutes, seconds),
-# https://community.dur.ac.uk/physics.astrolab/one_lab/pm_coord.html
-def RAtodeg(sexstr):
-    return coord.Angle(sexstr, unit=u.h).degree
-def DECtodeg(sexstr):
-    return coord.Angle(sexstr, unit=u.deg).degree
 
 def proto_html(ttime, qcount, query_list, all_ids):
     html = '''<ul>
@@ -184,6 +188,13 @@ def index(request):
     </tr>
     </table>'''.format(**counts))
 
+def silentremove(filename):
+    try:
+        os.remove(filename)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise # re-raise exception if a different error occurred
+
 def md5(fname):
     hash_md5 = hashlib.md5()
     with open(fname, "rb") as f:
@@ -230,57 +241,29 @@ is not good enuf for Archive.
     #! proposer = just_one('PROPOSER')
     #! obj_set = at_least_one('OBJECT') 
 
-    try:
-        Telescope.objects.get(name=telescope)
-    except Exception as err:
-        tele_list = [obj.name for obj in Telescope.objects.all()]
+    # Against cached reference tables (no query in steady state)
+    if telescope not in refdata.telescopes():
+        tele_list = sorted(refdata.telescopes())
         raise nex.TelescopeError(
-            'Telescope from hdr \'{}\' not in known DB list {}; {}'.
-                               format(telescope, tele_list, err))
-    try:
-        Instrument.objects.get(name=instrument)
-    except Exception as err:
-        tele_list = [obj.name for obj in Instrument.objects.all()]
+            'Telescope from hdr \'{}\' not in known DB list {}'.
+                               format(telescope, tele_list))
+    if instrument not in refdata.instruments():
+        inst_list = sorted(refdata.instruments())
         raise nex.InstrumentError(
-            'Instrument from hdr \'{}\' not in known DB list {}; {}'.
-                               format(instrument, inst_list, err))
+            'Instrument from hdr \'{}\' not in known DB list {}'.
+                               format(instrument, inst_list))
 
     # Validate against schema
     try:
-        schemafile = '/etc/natica/fits-header-schema.json'
-        with open(schemafile) as f:
-            schema = json.load(f)
-            jsonschema.validate(hdudictlist, schema)
+        schemas.fits_header.validate(hdudictlist)
     except Exception as err:
         raise nex.BadFitsHdrContent('JSON did not validate against'
-                                  ' {}; {}'.format(schemafile, err))
+                                  ' {}; {}'.format(schemas.fits_header.schemafile,
+                                                   err))
     
     return True # exception on invalid
     
 
-def get_range_values(agg):
-    logging.debug('DBG-get_range_values agg={}'.format(agg))
-    ra = None
-    dec = None
-    exposure = None
-    
-    dateobs = DateRange(min(agg['DATE-OBS']), max(agg['DATE-OBS']), bounds='[]')
-    if 'RA' in agg:
-        vals =  [RAtodeg(val) for val in agg['RA']]
-        ra = NumericRange(min(vals), max(vals), '[]')
-    if 'DEC' in agg:
-        vals =  [DECtodeg(val) for val in agg['DEC']]
-        dec = NumericRange(min(vals), max(vals), '[]')
-    if 'EXPTIME' in agg:
-        exposure=NumericRange(min(agg['EXPTIME']), max(agg['EXPTIME']),'[]')
-
-    return {'RA': ra,
-            'DEC': dec,
-            'EXPTIME': exposure,
-            'DATE-OBS': dateobs,
-            }
-    
-
 # Aggregate these from HDUs
 api_extras = [
     'DATE-OBS',
@@ -309,22 +292,6 @@ api_extras = [
 #!
 #!    return jagg
 
-def aggregate_extras(hdudict_list):
-    agg = defaultdict(set)   
-    for hdudict in hdudict_list:
-        #!for k in api_extras:
-        #!    if k in hdudict:
-        #!        agg[k].add(hdudict.get(k))
-        for k,v in hdudict.items():
-            agg[k].add(v)
-
-    list_agg = dict()
-    for k in agg:
-        list_agg[k] = list(agg[k])
-    range_dict = get_range_values(agg)
-    list_agg.update(range_dict)
-    return list_agg, set(range_dict.keys())
-
 # as single value (='' if none found in HDUs)
 def aggregate_extras_single_value(hdudict_list):
     agg = dict()
@@ -352,7 +319,7 @@ def reset_singletons(fobj):
 # a Patch func
 def set_range_fields(fobj):
     """Set ranges for RA, DEC, EXPOSURE, DATE_OBS"""
-    agg,rkeys = aggregate_extras([ob.extras for ob in fobj.hdu_set.all()])
+    agg,rkeys = aggregate_hdus([ob.extras for ob in fobj.hdu_set.all()])
     #range_vals = get_range_values(agg)
     fobj.ra = agg['RA']
     fobj.dec = agg['DEC']
@@ -364,7 +331,7 @@ def set_range_fields(fobj):
 # a Patch func
 def load_fitsfile(fobj):
     """Load one FitsFile from content of HDUs (mostly EXTRAS field)"""
-    agg,rkeys = aggregate_extras([ob.extras for ob in fobj.hdu_set.all()])
+    agg,rkeys = aggregate_hdus([ob.extras for ob in fobj.hdu_set.all()])
     #print('DBG: agg={}'.format(agg))
 
     try:
@@ -392,7 +359,7 @@ def load_fitsfile(fobj):
     #!fobj.exposure = range_vals['EXPTIME']
     #!fobj.date_obs = range_vals['DATE-OBS']
 
-    propid = list(agg.get('DTPROPID'))[0]
+    propid = agg.get('DTPROPID')
     #fobj.prop_id = list(agg.get('DTPROPID'))[0]
     try:
         prop = Proposal.objects.get(propid=propid)
@@ -473,27 +440,73 @@ def PATCH(progress=100):
     return cnt
 
 
+def hdu_objects(fits, hdudict_list):
+    """Unsaved Hdu instances (one per dict in HDUDICT_LIST) for FITS."""
+    notstored = {'SIMPLE', 'COMMENT', 'HISTORY', 'EXTEND', ''} #!
+    core = set([ f.name.upper() for f in Hdu._meta.get_fields()])
+    hdus = list()
+    for idx,hdudict in enumerate(hdudict_list):
+        extras = set(hdudict.keys()) - core - notstored
+        #logging.debug('DBG-extras={}'.format(extras))
+        extradict = {}
+        for k in extras:
+            extradict[k] = hdudict[k]
+        hdus.append(Hdu(fitsfile=fits,
+                        hdu_idx=idx,
+                        xtension=hdudict.get('XTENSION',''),
+                        bitpix=hdudict['BITPIX'],
+                        naxis=hdudict['NAXIS'],
+                        pcount=hdudict.get('PCOUNT',None),
+                        gcount=hdudict.get('GCOUNT',None),
+                        #!instrument=hdudict.get('INSTRUME',''),
+                        #!telescope=hdudict.get('TELESCOP',''),
+                        #!date_obs  = localize(hdudict.get('DATE-OBS',None)),
+                        #!obj = hdudict.get('OBJECT',''),
+                        extras = extradict
+        ))
+        #!!! Add to naxisN array if appropriate
+    return hdus
+
 #src_fname, arch_fname, md5sum, size,  
-def store_metadata(hdudict_list, non_hdu_vals):
-    """Store ALL of the FITS header values into DB. Assumed to be validated."""
+def to_float(val):
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
+
+# FitsFile column <- (aggregated header keyword, normalize).  Searched and
+# returned by the Portal, so they are columns rather than EXTRAS values.
+KEYWORD_FIELDS = [
+    ('prodtype', 'PRODTYPE', None),
+    ('proctype', 'PROCTYPE', None),
+    ('obstype',  'OBSTYPE',  None),
+    ('obsmode',  'OBSMODE',  None),
+    ('imagetyp', 'IMAGETYP', None),
+    ('filter',   'FILTER',   None),
+    ('seeing',   'SEEING',   to_float),
+    ('dtpropid', 'DTPROPID', None),
+    ('proposer', 'PROPOSER', None),
+]
+
+def build_fitsfile(hdudict_list, non_hdu_vals):
+    """Unsaved FitsFile for validated HDUDICT_LIST. Proposal is saved if
+new. Caller is responsible for the transaction."""
 
     ## FITS File
-    agg,rkeys = aggregate_extras(hdudict_list)
+    agg,rkeys = aggregate_hdus(hdudict_list)
     #print('\nDBG: agg=',agg)
 
-    propid = list(agg.get('DTPROPID'))[0]
+    propid = agg.get('DTPROPID')
     pi = list(agg.get('DTPI',['No PI Provided']))[0]
     fid = non_hdu_vals['md5sum']
     try:
-        prop = Proposal.objects.get(prop_id=propid)
-    except ObjectDoesNotExist:
         # No related or found Proposal, but we have a DTPROPID
-        prop = Proposal(
+        prop,created = Proposal.objects.get_or_create(
             prop_id = propid,
-            pi = pi,
-            proprietary_period = random.choice([0, 1,12]), #months !!!
-            extras={}  )
-        prop.save()
+            defaults = dict(
+                pi = pi,
+                proprietary_period = random.choice([0, 1,12]), #months !!!
+                extras={}  ))
     except Exception as err:
         msg = ('Propid "{}" not found in DB. No proposal assigned to file {}.'
                .format(propid, fid))
@@ -505,7 +518,7 @@ def store_metadata(hdudict_list, non_hdu_vals):
     fits_extras = dict()
     for k in set(agg.keys()) - fits_core - rkeys:
         fits_extras[k] = agg[k]
-    
+
     fits = FitsFile(md5sum=non_hdu_vals['md5sum'],
                     filesize=non_hdu_vals['size'],
                     proposal=prop,
@@ -516,117 +529,442 @@ def store_metadata(hdudict_list, non_hdu_vals):
                     date_obs = agg['DATE-OBS'],
                     original_filename=non_hdu_vals['src_fname'],
                     release_date=timezone.now(), #!!!
-                    instrument=Instrument.objects.get(pk=agg['DTINSTRU'][0]),
-                    telescope=Telescope.objects.get(pk=agg['DTTELESC'][0]),
-                    
+                    # validate_header checked these against refdata
+                    instrument_id=agg['DTINSTRU'][0],
+                    telescope_id=agg['DTTELESC'][0],
+
                     extras = fits_extras
     )
+    (fits.ra_center, fits.dec_center,
+     fits.fov_radius, fits.sky_cells) = sky.footprint(fits.ra, fits.dec)
+    for field, keyword, normalize in KEYWORD_FIELDS:
+        val = agg.get(keyword)
+        if val is not None and normalize is not None:
+            val = normalize(val)
+        setattr(fits, field, val)
     logging.debug('DBG-2: store_metadata, early date-obs={}'
                   .format(fits.date_obs.lower))
     fits.release_date = (dateutil.parser.parse(fits.date_obs.lower)
                          + datetime.timedelta(days=30*prop.proprietary_period))
-    reset_singletons(fits)
-    fits.save()
-
-    notstored = {'SIMPLE', 'COMMENT', 'HISTORY', 'EXTEND', ''} #!
-    core = set([ f.name.upper() for f in Hdu._meta.get_fields()])
-    for idx,hdudict in enumerate(hdudict_list):
-        extras = set(hdudict.keys()) - core - notstored
-        #logging.debug('DBG-extras={}'.format(extras))
-        extradict = {}
-        for k in extras:
-            extradict[k] = hdudict[k]
-        hduobj = Hdu(fitsfile=fits,
-                     hdu_idx=idx,
-                     xtension=hdudict.get('XTENSION',''),
-                     bitpix=hdudict['BITPIX'],
-                     naxis=hdudict['NAXIS'],
-                     pcount=hdudict.get('PCOUNT',None),
-                     gcount=hdudict.get('GCOUNT',None),
-                     #!instrument=hdudict.get('INSTRUME',''),
-                     #!telescope=hdudict.get('TELESCOP',''),
-                     #!date_obs  = localize(hdudict.get('DATE-OBS',None)),
-                     #!obj = hdudict.get('OBJECT',''),
-                     extras = extradict
-        )
-        #!!! Add to naxisN array if appropriate
-        hduobj.save()
+    return fits
 
-def protected_store_metadata(hdudict_list, non_hdu_vals):
+def save_fitsfile(hdudict_list, non_hdu_vals):
+    """Save FitsFile (and Proposal if new) for validated HDUDICT_LIST.
+Hdu rows are NOT saved. Caller is responsible for the transaction."""
+    fits = build_fitsfile(hdudict_list, non_hdu_vals)
+    fits.save()
+    return fits
+
+def to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return dateutil.parser.parse(str(value)).date()
+
+def stored_value(field, value):
+    """VALUE of model FIELD as it will read back from the DB, so a stored
+value and a new one can be compared. (Postgres canonicalizes daterange
+to '[)' bounds; numrange bounds read back as Decimal, new ones are float.)"""
+    if isinstance(value, NumericRange):
+        if value.isempty:
+            return value
+        bounds = (('[' if value.lower_inc else '(')
+                  + (']' if value.upper_inc else ')'))
+        return NumericRange(None if value.lower is None else float(value.lower),
+                            None if value.upper is None else float(value.upper),
+                            bounds)
+    if isinstance(value, DateRange):
+        if value.isempty:
+            return value
+        lower = None if value.lower is None else to_date(value.lower)
+        upper = None if value.upper is None else to_date(value.upper)
+        if lower is not None and not value.lower_inc:
+            lower += datetime.timedelta(days=1)
+        if upper is not None and value.upper_inc:
+            upper += datetime.timedelta(days=1)
+        return DateRange(lower, upper, '[)')
+    return field.to_python(value)
+
+def changed_fields(old, new, exclude=()):
+    """Fields (not primary key, not EXCLUDE) whose value differs between
+model instances OLD and NEW."""
+    return [f for f in old._meta.concrete_fields
+            if not f.primary_key and f.name not in exclude
+            and (stored_value(f, getattr(old, f.attname))
+                 != stored_value(f, getattr(new, f.attname)))]
+
+def update_metadata(fits, hdudict_list, non_hdu_vals):
+    """Make stored metadata of FITS (an existing FitsFile) match
+HDUDICT_LIST.  Only changes are written: changed FitsFile columns, changed
+Hdu rows, new Hdu rows (one INSERT) and Hdu rows no longer in the file.
+Caller is responsible for the transaction.  Return dict of row counts."""
+    new = build_fitsfile(hdudict_list, non_hdu_vals)
+    changed = changed_fields(fits, new)
+    for f in changed:
+        setattr(fits, f.attname, getattr(new, f.attname))
+    if changed:
+        fits.save(update_fields=[f.name for f in changed])
+
+    old_hdus = dict((hdu.hdu_idx, hdu) for hdu in fits.hdu_set.all())
+    inserts = list()
+    updated = 0
+    for hdu in hdu_objects(fits, hdudict_list):
+        old = old_hdus.pop(hdu.hdu_idx, None)
+        if old is None:
+            inserts.append(hdu)
+            continue
+        diff = changed_fields(old, hdu, exclude={'fitsfile', 'hdu_idx'})
+        if diff:
+            Hdu.objects.filter(pk=old.pk).update(
+                **dict((f.attname, getattr(hdu, f.attname)) for f in diff))
+            updated += 1
+    if inserts:
+        Hdu.objects.bulk_create(inserts)
+    if old_hdus:
+        Hdu.objects.filter(pk__in=[hdu.pk for hdu in old_hdus.values()]
+                           ).delete()
+    counts = dict(fitsfile_fields=len(changed),
+                  hdus_updated=updated,
+                  hdus_inserted=len(inserts),
+                  hdus_deleted=len(old_hdus))
+    logging.debug('update_metadata({}): {}'.format(fits.archive_filename,
+                                                   counts))
+    return counts
+
+def archived_fitsfile(archive_filename):
+    """FitsFile (locked FOR UPDATE) already stored for ARCHIVE_FILENAME,
+else None. Any duplicate rows for the same file are deleted."""
+    found = list(FitsFile.objects
+                 .select_for_update()
+                 .filter(archive_filename=str(archive_filename))
+                 .order_by('id'))
+    if len(found) == 0:
+        return None
+    for dup in found[1:]:
+        dup.delete()
+    return found[0]
+
+def store_metadata(hdudict_list, non_hdu_vals, overwrite=False):
+    """Store ALL of the FITS header values into DB. Assumed to be validated.
+Proposal, FitsFile and (bulk inserted) Hdu rows are written in one
+transaction.  If OVERWRITE and the archive file already has metadata, it
+is updated in place (see update_metadata)."""
+    with transaction.atomic():
+        transaction.on_commit(generation.bump)
+        if overwrite:
+            fits = archived_fitsfile(non_hdu_vals['arch_fname'])
+            if fits is not None:
+                update_metadata(fits, hdudict_list, non_hdu_vals)
+                return fits
+        fits = save_fitsfile(hdudict_list, non_hdu_vals)
+        # One INSERT for all HDUs (instead of one per HDU)
+        Hdu.objects.bulk_create(hdu_objects(fits, hdudict_list))
+    return fits
+
+def store_metadata_batch(items, overwrite=False):
+    """Store metadata for many files. ITEMS is list of
+(hdudict_list, non_hdu_vals).  One transaction for all; a file that fails
+(FitsFile or any of its Hdu rows) is rolled back to its savepoint without
+affecting the others.  Hdu rows of each new file are written with one
+bulk INSERT.  If OVERWRITE, files already stored are updated in place.
+Return list (parallel to ITEMS) of FitsFile or DBStoreError."""
+    results = list()
+    with transaction.atomic():
+        transaction.on_commit(generation.bump)
+        for hdudict_list, non_hdu_vals in items:
+            try:
+                with transaction.atomic():
+                    fits = None
+                    if overwrite:
+                        fits = archived_fitsfile(non_hdu_vals['arch_fname'])
+                    if fits is not None:
+                        update_metadata(fits, hdudict_list, non_hdu_vals)
+                    else:
+                        fits = save_fitsfile(hdudict_list, non_hdu_vals)
+                        Hdu.objects.bulk_create(hdu_objects(fits,
+                                                            hdudict_list))
+            except Exception as err:
+                results.append(nex.DBStoreError(
+                    'Could not store metadata; {}'.format(err)))
+                continue
+            results.append(fits)
+    return results
+
+def protected_store_metadata(hdudict_list, non_hdu_vals, overwrite=False):
     try:
-        store_metadata(hdudict_list, non_hdu_vals)
+        with metrics.timer('store_metadata'):
+            store_metadata(hdudict_list, non_hdu_vals, overwrite=overwrite)
     except Exception as err:
         logging.error('huddict_list={}, non_hdu_vals={}'
                       .format(hdudict_list, non_hdu_vals))
         raise nex.DBStoreError('Could not store metadata; {}'.format(err))
     
 
-def hdudictlist(hdulist):
-    return [OrderedDict(hdu.header.items()) for hdu in hdulist]
+def hdudictlist(fitsfile):
+    """Header dicts (one per HDU) of FITSFILE. Data units are not read."""
+    return fits_header.read_headers(fitsfile)
                 
-def handle_uploaded_file(f, md5sum, overwrite=False):
-    import astropy.io.fits as pyfits
-    tgtfile = '/data/upload/foo.fits' #!!!
-    with open(tgtfile, 'wb+') as destination:
-        hdulist = pyfits.open(f)
+def place_uploaded_file(f, md5sum):
+    """Validate F, a StagedFitsFile (see upload_handlers.py), and move it
+into the archive. Return (hdudicts, valdict) for storing its metadata.
+The file has already been hashed and header-parsed (in one pass)."""
+    with metrics.timer('validate'):
+        if f.md5sum != md5sum:
+            raise nex.ChecksumError(
+                'Checksum mismatch for {}; client={}, server={}'
+                .format(f.name, md5sum, f.md5sum))
+        if f.fits_error is not None:
+            raise f.fits_error
+        hdudicts = f.hdudicts
         # Validate headers, abort with approriate error if bad for Archive
-        validate_header(hdudictlist(hdulist))
+        validate_header(hdudicts)
 
-        for chunk in f.chunks():
-            destination.write(chunk)
-        hdudicts = hdudictlist(hdulist)
+    with metrics.timer('place', f.size):
         archive_path = fn.generate_archive_path(hdudicts[0])
         valdict = dict(src_fname = hdudicts[0].get('DTACQNAM',''),
                        arch_fname = archive_path,
-                       md5sum = md5sum,
+                       md5sum = f.md5sum,
                        size = f.size)
         logging.debug('DBG: archive_path={}'.format(archive_path))
         os.makedirs(str(archive_path.parent), exist_ok=True)
-        if overwrite:
-            FitsFile.objects.filter(archive_filename=archive_path).delete()
-            os.replace(tgtfile, str(archive_path))
+        placement.place(f.temporary_file_path(), archive_path)
+    return hdudicts, valdict
+
+def handle_uploaded_file(f, md5sum, overwrite=False):
+    """Validate and archive F, a StagedFitsFile (see upload_handlers.py).
+The upload has already been hashed, header-parsed and written to a staging
+file unique to this request (in one pass) by the time we get here."""
+    try:
+        with metrics.timer('ingest', f.size):
+            hdudicts, valdict = place_uploaded_file(f, md5sum)
+            protected_store_metadata(hdudicts, valdict, overwrite=overwrite)
+        return str(valdict['arch_fname'])
+    finally:
+        silentremove(f.temporary_file_path()) # only still there if we failed
+
+def ingest_batch(items, overwrite=False):
+    """Archive many staged files.  ITEMS is list of (StagedFitsFile, md5sum).
+Metadata of all files is stored in one transaction.  A file placed in the
+archive whose metadata could not be stored is removed again (unless older
+metadata still refers to it).  Return list (parallel to ITEMS) of:
+dict(archive_filename=...) or dict(errorMessage=...)"""
+    results = [None] * len(items)
+    placed = list()
+    for idx, (f, md5sum) in enumerate(items):
+        try:
+            hdudicts, valdict = place_uploaded_file(f, md5sum)
+        except nex.BaseNaticaException as err:
+            results[idx] = err.to_dict()
+            continue
+        except Exception as err:
+            results[idx] = dict(errorMessage='Could not archive {}; {}'
+                                .format(f.name, err))
+            continue
+        placed.append((idx, hdudicts, valdict))
+
+    with metrics.timer('store_metadata_batch'):
+        stored = store_metadata_batch([(hdudicts, valdict)
+                                       for (idx, hdudicts, valdict) in placed],
+                                      overwrite=overwrite)
+    for (idx, hdudicts, valdict), res in zip(placed, stored):
+        archive_filename = str(valdict['arch_fname'])
+        if isinstance(res, nex.BaseNaticaException):
+            results[idx] = res.to_dict()
+            if not FitsFile.objects.filter(
+                    archive_filename=archive_filename).exists():
+                silentremove(archive_filename)
         else:
-            shutil.move(tgtfile, str(archive_path))
-        protected_store_metadata(hdudicts, valdict)
-        return str(archive_path)
-    
+            results[idx] = dict(archive_filename=archive_filename)
+    return results
+
 
 @api_view(['POST'])
 def store(request):
+    """Ingest one FITS file.  With ?async=1 the upload is only staged and
+queued; response is 202 with a job_id (see job_status)."""
     overwrite = (13 == int(request.GET.get('overwrite','123')))
+    asynchronous = (1 == int(request.GET.get('async','0')))
+    # Must be installed before request.data or request.FILES is touched.
+    # Unique staging file per upload lets many workers ingest at once.
+    handler = FitsStagingUploadHandler(durable=asynchronous)
+    request.upload_handlers.insert(0, handler)
+    if request.method == 'POST' and asynchronous:
+        try:
+            job = jobs.enqueue(request.FILES['file'],
+                               request.data['md5sum'],
+                               overwrite=overwrite)
+        except Exception:
+            for tgtfile in handler.staged:
+                silentremove(tgtfile)
+            raise
+        return JsonResponse(dict(result='file queued: {}'
+                                 .format(request.FILES['file'].name),
+                                 job_id=job.id,
+                                 status_url=reverse('natica:job_status',
+                                                    args=[job.id])),
+                            status=202)
     if request.method == 'POST':
         #try:
-        arc_fname = handle_uploaded_file(request.FILES['file'],
-                                         request.data['md5sum'],
-                                         overwrite=overwrite)
+        try:
+            arc_fname = handle_uploaded_file(request.FILES['file'],
+                                             request.data['md5sum'],
+                                             overwrite=overwrite)
+        finally:
+            for tgtfile in handler.staged:
+                silentremove(tgtfile)
         return JsonResponse(dict(result='file uploaded: {}'
                                  .format(request.FILES['file'].name),
                                  archive_filename=arc_fname ))
         #!except Exception as err:
         #!    #raise nex.DBStoreError(err)
         #!    return HttpResponseBadRequest(err)
-                        
-
-
-search_fields = set([
-    'search_box_min',
-    'coordinates',
-    'pi',
-    'prop_id',
-    'obs_date',
-    'filename',
-    'original_filename',
-    'telescope_instrument',
-    'release_date',
-    'flag_raw',
-    'image_filter',
-    'exposure_time',
-    #'xtension', # new
-    'extras',
-])
-
-def wrap(qdict):
-    return dict(search=qdict)
+
+@api_view(['POST'])
+def upload_start(request):
+    """Start a resumable upload (see resumable.py)."""
+    upload_id = resumable.start(request.data.get('name', 'upload.fits'))
+    return JsonResponse(dict(upload_id=upload_id,
+                             offset=0,
+                             url=reverse('natica:upload_chunk',
+                                         args=[upload_id])),
+                        status=201)
+
+@api_view(['GET', 'PUT'])
+@never_cache
+def upload_chunk(request, upload_id):
+    """PUT: store body as chunk of upload starting at ?offset=N.
+GET: number of bytes received so far.  Both return {"offset": <received>}"""
+    if request.method == 'PUT':
+        offset = int(request.GET.get('offset', '0'))
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        received = resumable.append(upload_id, offset, request.stream, length)
+    else:
+        received = resumable.received(upload_id)
+    return JsonResponse(dict(upload_id=upload_id, offset=received))
+
+@api_view(['POST'])
+def upload_finish(request, upload_id):
+    """Archive completed resumable upload (same checks as store)."""
+    overwrite = (13 == int(request.GET.get('overwrite','123')))
+    arc_fname = resumable.finish(upload_id, request.data['md5sum'],
+                                 overwrite=overwrite)
+    return JsonResponse(dict(result='file uploaded: {}'.format(upload_id),
+                             archive_filename=arc_fname))
+
+@api_view(['GET'])
+@never_cache
+def ingest_metrics(request):
+    """Per-stage ingest timing and rates over recent ingests (this worker).
+See metrics.py"""
+    return JsonResponse(dict(metrics.summary(),
+                             placement=placement.stats()))
+
+@api_view(['GET'])
+@never_cache
+def placement_metrics(request):
+    """Bytes staged and copied per byte placed into archive (this worker)."""
+    return JsonResponse(placement.stats())
+
+max_checksums = 10000 # per request
+
+@api_view(['GET', 'POST'])
+@never_cache
+def checksums(request):
+    """
+    Which of the given md5sums are already archived (and where).
+    GET ?md5sum=<md5>,<md5>,...  or  POST {"md5sums": [<md5>, ...]}
+    Returns {"archived": {<md5>: <archive_filename>, ...}, "missing": [<md5>,...]}
+    """
+    if request.method == 'POST':
+        md5sums = request.data.get('md5sums', [])
+    else:
+        md5sums = [m for m in request.GET.get('md5sum','').split(',') if m]
+    if len(md5sums) > max_checksums:
+        raise nex.UsageError('Too many md5sums ({}); max is {}'
+                             .format(len(md5sums), max_checksums))
+    archived = dict(FitsFile.objects
+                    .filter(md5sum__in=md5sums)
+                    .values_list('md5sum', 'archive_filename'))
+    return JsonResponse(OrderedDict(
+        archived=archived,
+        missing=[m for m in md5sums if m not in archived]))
+
+@api_view(['GET'])
+@never_cache
+def job_status(request, job_id):
+    """State of an asynchronous ingest job (and archive_filename when done)."""
+    try:
+        job = IngestJob.objects.get(pk=job_id)
+    except ObjectDoesNotExist:
+        return JsonResponse(dict(errorMessage='No such ingest job: {}'
+                                 .format(job_id)), status=404)
+    return JsonResponse(jobs.status(job))
+
+
+def staged_manifest_file(path):
+    """StagedFitsFile for a manifest entry. Must be under staging_root."""
+    real = os.path.realpath(path)
+    if not real.startswith(os.path.join(settings.staging_root, '')):
+        raise nex.UsageError('Manifest file {} is not under {}'
+                             .format(path, settings.staging_root))
+    if not os.path.isfile(real):
+        raise nex.UsageError('Manifest file {} does not exist'.format(path))
+    return StagedFitsFile.from_path(real)
+
+@api_view(['POST'])
+def store_batch(request):
+    """
+    Ingest many FITS files in one request.  Either:
+      multipart: several "file" fields, each with a "md5sum" field (same order)
+      application/json: {"files": [{"path": ..., "md5sum": ...}, ...]}
+        where each path is a file already staged under settings.staging_root
+    Returns {"results": [{"name": <file name or path>,
+                          "archive_filename": ... or "errorMessage": ...},
+                         ...]}
+    with one result per file, in the order given (names need not be unique).
+    """
+    overwrite = (13 == int(request.GET.get('overwrite','123')))
+    handler = FitsStagingUploadHandler()
+    request.upload_handlers.insert(0, handler)
+    try:
+        names = list()
+        results = list()
+        items = list()
+        slots = list() # index in RESULTS of each of ITEMS
+        if request.content_type == 'application/json':
+            for entry in request.data.get('files', []):
+                names.append(entry['path'])
+                try:
+                    items.append((staged_manifest_file(entry['path']),
+                                  entry.get('md5sum')))
+                except nex.BaseNaticaException as err:
+                    results.append(err.to_dict())
+                    continue
+                results.append(None)
+                slots.append(len(results) - 1)
+        else:
+            files = request.FILES.getlist('file')
+            md5sums = request.data.getlist('md5sum')
+            if len(files) != len(md5sums):
+                raise nex.UsageError('Got {} files but {} md5sums'
+                                     .format(len(files), len(md5sums)))
+            names = [f.name for f in files]
+            items = list(zip(files, md5sums))
+            results = [None] * len(items)
+            slots = list(range(len(items)))
+        for idx, res in zip(slots, ingest_batch(items, overwrite=overwrite)):
+            results[idx] = res
+    finally:
+        for tgtfile in handler.staged:
+            silentremove(tgtfile)
+    results = [OrderedDict(name=name, **res)
+               for name, res in zip(names, results)]
+    nerrors = len([r for r in results if 'errorMessage' in r])
+    return JsonResponse(OrderedDict(
+        result='{} of {} files archived'.format(len(results) - nerrors,
+                                                len(results)),
+        results=results))
 
 
 @api_view(['POST'])
@@ -646,35 +984,11 @@ def search2(request):
     for k in formdict.keys():
         if len(formdict[k]) == 0:
             continue
-        if k in search_fields:
+        if k in search_service.search_fields:
             jsearch[k] = formdict[k]
     
     logging.debug('search2-jsearch={}'.format(jsearch))
-    #!return JsonResponse(formdict)
-    c = Client()
-    return c.post('/natica/search/',
-                      content_type='application/json',
-                      data=json.dumps(wrap(jsearch)))
-
-def make_qobj(jsearch):
-    """Construct query (anchored on FitsFile)"""
-    slop = jsearch.get('search_box_min', .001)
-    q = (sf.coordinates(jsearch.get('coordinates', None), slop)
-         & sf.exposure_time(jsearch.get('exposure_time', None))  
-         & sf.archive_filename(jsearch.get('filename', None))
-         & sf.image_filter(jsearch.get('image_filter', None))
-         & sf.dateobs(jsearch.get('obs_date', None))
-         & sf.original_filename(jsearch.get('original_filename', None))
-         & sf.pi(jsearch.get('pi', None))
-         & sf.prop_id(jsearch.get('propid', None))
-         & sf.release_date(jsearch.get('release_date', None))
-         & sf.telescope_instrument(jsearch.get('telescope_instrument', None))
-         )
-         #& sf.extras(jsearch.get('extras', None))
-         #& sf.xtension(jsearch.get('xtension', None))
-    #!q = (sf.telescope_instrument(jsearch.get('telescope_instrument', None))   )
-    logging.debug('DBG: q={}'.format(str(q)))
-    return q
+    return search_response(jsearch, search_service.params(request.GET))
 
 # pushd /home/pothiers/sandbox/natica/naticasite/natica/search-requests
 # curl -H "Content-Type: application/json" -X POST -d @search-1.json http://localhost:8080/natica/search/ | python -m json.tool
@@ -683,128 +997,96 @@ def search(request):
     """
     Search Archive, returns FITS metadata (header field/values).
     """
-    logging.debug('DBG-0 search({})'.format(request))
     if request.method != 'POST':
         raise Exception('Only accepts POST http method')
     if request.content_type != "application/json" :
         raise Exception("Only accepts content_type = application/json. Got '{}'"
                         .format(request.content_type))
-
-    logging.debug('DBG-1 search.request.body={}'.format(request.body))
-
-    page_limit = int(request.GET.get('limit','100')) # num of records per page
-    page = int(request.GET.get('page','1'))
-    offset = (page-1) * page_limit
-    # order:: comma delimitied, leading +/-  (ascending/descending)
-    order_fields = request.GET.get('order','original_filename')
+    prm = search_service.params(request.GET)
     jsearch = json.loads(request.body.decode('utf-8'))
-    logging.debug('DBG jsearch={}'.format(jsearch))
-
-    # Validate against schema
-    try:
-        schemafile = '/etc/natica/search-schema.json'
-        with open(schemafile) as f:
-            schema = json.load(f)
-            jsonschema.validate(jsearch, schema)
-    except Exception as err:
-        raise nex.SearchSyntaxError('JSON did not validate against'
-                                    ' {}; {}'.format(schemafile, err))
-
-
-    used_fields = set(jsearch.keys())
-    if not (search_fields >= used_fields):
-        unavail = used_fields - search_fields
-        raise nex.ExtraSearchFieldError('Extra fields ({}) in search'
-                                     .format(unavail))
-    assert(search_fields >= used_fields)
-
-    q = make_qobj(jsearch)
-
-    #fullqs = FitsFile.objects.filter(q).distinct().order_by(order_fields)
-    fullqs = FitsFile.objects.filter(q)
-    #total_count = len(fullqs) #.count()   tot seconds: 2.8
-    total_count = fullqs.count() #       tot seconds: 4.9
-    logging.debug('DBG: do query')
-    try:
-        qs = fullqs.order_by(order_fields)[offset:page_limit]
-    except Exception as err:
-        return JsonResponse(dict(error='query failed: {}'.format(err)))
-    query = str(qs.query)
-    logging.debug('DBG: query={}'.format(query))
-
-    results = list()
-    #!for fobj in qs.iterator():
-    for fobj in qs:
-        logging.debug('DBG: fobj.md5sum={}, instrum={}'.format(fobj.md5sum, fobj.instrument))
-        ra = [fobj.ra.lower, fobj.ra.upper] if fobj.ra != None else None
-        dec = [fobj.dec.lower, fobj.dec.upper] if fobj.dec != None else None
-        exposure = [fobj.exposure.lower, fobj.exposure.upper] if fobj.exposure != None else None
-        obsdate = [fobj.date_obs.lower, fobj.date_obs.upper] if fobj.date_obs != None else None
-        results.append(
-            dict(
-                id=fobj.id,
-                ra=ra,
-                dec=dec,
-                #depth,
-                exposure=exposure,
-                filename=fobj.archive_filename,
-                filesize=fobj.filesize,
-                filter=fobj.extras.get('FILTER'), # FILTER, FILTERS, FILTER1, FILTER2
-                image_type=fobj.extras.get('IMAGETYP'), 
-                instrument=fobj.instrument.name,
-                md5sum=fobj.md5sum,
-                obs_date=obsdate,
-                observation_mode=fobj.extras.get('OBSMODE'),
-                observation_type=fobj.extras.get('OBSTYPE'), 
-                original_filename=fobj.original_filename,
-                pi=fobj.extras.get('PROPOSER'),
-                product=fobj.extras.get('PRODTYPE'),
-                prop_id=fobj.extras.get('DTPROPID'),
-                release_date=fobj.release_date,
-                seeing=fobj.extras.get('SEEING'),
-                #survey_id
-                telescope=fobj.telescope.name,
-            ))
-    logging.debug('DBG: results={}'.format(results))
-    meta = OrderedDict.fromkeys(['total_count',
-                                 'page_result_count',
-                                 'to_here_count',
-                                 'api_version',
-                                 'timestamp',
-                                 'comment',
-                                 'query', ])
-    meta.update(
-        api_version = api_version,
-        timestamp = datetime.datetime.now(),
-        comment = ('WARNING: RESULTS missing values: surver_id, depth.'
-                   '  (Where do they come from???)'
-                   ),
-        query = query,
-        page_result_count = len(results),
-        to_here_count = offset + len(results),
-        total_count = total_count,
-        offset = offset,
-        page_limit = page_limit,
-        debug=1
-    )
-    #logging.debug('DBG: query={}'.format(qs.query))
-    jresponse = OrderedDict(meta=meta, resultset=results)
-    #!logging.debug('DBG: jresponse={}'.format(jresponse)) # BIG
-    return JsonResponse(jresponse)
-                        
-def submit_fits_file(fits_file_path):
+    return search_response(jsearch, prm)
+
+def search_response(jsearch, prm):
+    """HTTP response to search JSEARCH with paging PRM (search_service.Params):
+streamed export, cached page, or a new page (then cached)."""
+    search_service.validate(jsearch)
+    if prm.export is not None:
+        response = StreamingHttpResponse(
+            search_service.export(jsearch, prm),
+            content_type=search_results.EXPORT_FORMATS[prm.export])
+        response['Content-Disposition'] = ('attachment; filename="search.{}"'
+                                           .format(prm.export))
+        return response
+    cache_key = search_cache.key(jsearch, **prm._asdict())
+    body, tier = search_cache.get(cache_key)
+    if body is not None:
+        response = HttpResponse(body, content_type='application/json')
+        response['X-Natica-Cache'] = tier
+        return response
+    gen = generation.current() # before searching; a bump during is seen
+    response = JsonResponse(search_service.search(jsearch, prm))
+    search_cache.put(cache_key, response.content, gen)
+    response['X-Natica-Cache'] = 'miss'
+    return response
+
+def submit_fits_file(fits_file_path,
+                     urls='http://0.0.0.0:8000/natica/store/'):
     """For use in a natica MANAGE command"""
     #!logging.debug('DBG-1: natica.submit_fits_file({})'.format(fits_file_path))
+    md5sum = md5(fits_file_path)
+    if md5sum in archived_checksums([md5sum]):
+        return False # already archived, don't upload again
     f = open(fits_file_path, 'rb')
-    urls = 'http://0.0.0.0:8000/natica/ingest/'
     r = requests.post(urls,
-                      data=dict(md5sum=md5(fits_file_path)),
+                      data=dict(md5sum=md5sum),
                       files={'file':f})
     logging.debug('submit_fits_file: {}, {}'.format(r.status_code,r.json()))
     if r.status_code != 200:
         raise CommandError(r.json()['errorMessage'])
     return False
     
+def submit_fits_files(fits_file_paths,
+                      urls='http://0.0.0.0:8000/natica/store/batch/'):
+    """Upload many FITS files in one request. For use in a natica MANAGE
+command.  Return dict keyed by path (as given in FITS_FILE_PATHS) of
+dict(archive_filename=...) or dict(errorMessage=...).  Files already in
+the archive (by md5sum) are not uploaded."""
+    sums = OrderedDict((path, md5(path)) for path in fits_file_paths)
+    archived = archived_checksums(list(sums.values()))
+    results = OrderedDict()
+    upload = list()
+    for path,md5sum in sums.items():
+        if md5sum in archived:
+            results[path] = dict(archive_filename=archived[md5sum])
+        else:
+            upload.append(path)
+    if len(upload) == 0:
+        return results
+    files = [('file', open(path, 'rb')) for path in upload]
+    try:
+        r = requests.post(urls,
+                          data=dict(md5sum=[sums[path] for path in upload]),
+                          files=files)
+    finally:
+        for _,f in files:
+            f.close()
+    logging.debug('submit_fits_files: {}, {}'.format(r.status_code,r.json()))
+    if r.status_code != 200:
+        raise CommandError(r.json()['errorMessage'])
+    # store_batch results are in upload order
+    for path,res in zip(upload, r.json()['results']):
+        res.pop('name', None)
+        results[path] = res
+    return results
+
+def archived_checksums(md5sums,
+                       urls='http://0.0.0.0:8000/natica/checksums/'):
+    """Dict of md5sum:archive_filename for those MD5SUMS already archived."""
+    r = requests.post(urls, json=dict(md5sums=md5sums))
+    if r.status_code != 200:
+        raise CommandError(r.json()['errorMessage'])
+    return r.json()['archived']
+
 def query(request):
    # if this is a POST request we need to process the form data
     if request.method == 'POST':
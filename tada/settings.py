@@ -1,2 +1,9 @@
 natica_ingest_url = 'http://0.0.0.0:8000/natica/store/'
 
+natica_checksum_url = 'http://0.0.0.0:8000/natica/checksums/'
+
+# Files larger than this (bytes) are sent as a resumable (chunked) upload
+natica_upload_url = 'http://0.0.0.0:8000/natica/uploads/'
+resumable_threshold = 256 * 2**20
+resumable_chunk_size = 16 * 2**20
+resumable_retries = 5 # consecutive failed chunks before giving up
@@ -19,6 +19,9 @@ import astropy.io.fits as pyfits
 import requests
 import settings
 import errno
+import collections
+import time
+from contextlib import contextmanager
 
 import exceptions as tex
 
@@ -55,10 +58,11 @@ def file_type(filename):
 
 
 def hdudictlist(fitsfile):
-    hdulist = pyfits.open(fitsfile)
-    for hdu in hdulist:
-        hdu.verify('fix')
-    return [collections.OrderedDict(hdu.header.items()) for hdu in hdulist]
+    """Header dicts (one per HDU). Headers are parsed lazily and data units
+are never touched (no per-HDU verify)."""
+    with pyfits.open(fitsfile, lazy_load_hdus=True) as hdulist:
+        return [collections.OrderedDict(hdu.header.items())
+                for hdu in hdulist]
 
 ##############################################################################
 
@@ -103,21 +107,111 @@ def md5(fname):
     return hash_md5.hexdigest()
 
         
-def http_archive_ingest(modifiedfits, overwrite=False):
-    """Deliver FITS to NATICA webservice for ingest."""
+@contextmanager
+def stage(timings, name):
+    """Add elapsed seconds of body to TIMINGS[NAME] (if TIMINGS not None).
+Stage names match NATICA's ingest metrics where they overlap."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[name] = timings.get(name, 0) + time.perf_counter() - start
+
+def log_stages(fitspath, nbytes, timings):
+    total = timings.get('total', 0)
+    logging.info('submit_to_archive stages {}: {}; {:.1f} MB, {:.2f} MB/s'
+                 .format(fitspath,
+                         ', '.join('{}={:.1f}ms'.format(k, 1000*v)
+                                   for k,v in timings.items()),
+                         nbytes/1e6,
+                         nbytes/1e6/total if total else 0))
+
+def http_archived_as(md5sum):
+    """Archive filename of file with MD5SUM if already archived, else None.
+Asks NATICA (cheap lookup) so we don't upload bytes it already has."""
+    r = requests.get(settings.natica_checksum_url, params=dict(md5sum=md5sum))
+    if r.status_code != 200:
+        logging.warning('http_archived_as: {}, {}'.format(r.status_code,r.text))
+        return None
+    return r.json()['archived'].get(md5sum)
+
+def http_archive_ingest(modifiedfits, overwrite=False, timings=None):
+    """Deliver FITS to NATICA webservice for ingest.
+If TIMINGS (dict) is given, seconds spent in each stage are added to it."""
+    with stage(timings, 'checksum'):
+        md5sum = md5(modifiedfits)
+    if not overwrite:
+        with stage(timings, 'precheck'):
+            archive_filename = http_archived_as(md5sum)
+        if archive_filename is not None:
+            logging.debug('http_archive_ingest: {} already archived as {}'
+                          .format(modifiedfits, archive_filename))
+            return (200, dict(archive_filename=archive_filename,
+                              already_archived=True))
+    if os.path.getsize(modifiedfits) > settings.resumable_threshold:
+        with stage(timings, 'upload'):
+            return http_resumable_ingest(modifiedfits, md5sum,
+                                         overwrite=overwrite)
     f = open(modifiedfits, 'rb')
     #urls = 'http://0.0.0.0:8000/natica/store/'
     urls = settings.natica_ingest_url
-    r = requests.post(urls,
-                      params=dict(overwrite=13) if overwrite else dict(),
-                      data=dict(md5sum=md5(modifiedfits)),
-                      files={'file':f})
+    with stage(timings, 'upload'): # server: receive, validate, place, store
+        r = requests.post(urls,
+                          params=dict(overwrite=13) if overwrite else dict(),
+                          data=dict(md5sum=md5sum),
+                          files={'file':f})
     logging.debug('http_archive_ingest: {}, {}'.format(r.status_code,r.json()))
     return (r.status_code, r.json())
 
 
 
 
+def http_resumable_ingest(modifiedfits, md5sum, overwrite=False):
+    """Deliver FITS to NATICA as a resumable upload: sequence of chunks.
+If sending a chunk fails, ask NATICA how much it has and continue from
+there (up to settings.resumable_retries times in a row)."""
+    r = requests.post(settings.natica_upload_url,
+                      data=dict(name=os.path.basename(modifiedfits)))
+    if r.status_code != 201:
+        return (r.status_code, r.json())
+    url = requests.compat.urljoin(settings.natica_upload_url, r.json()['url'])
+    size = os.path.getsize(modifiedfits)
+    offset = 0
+    failures = 0
+    with open(modifiedfits, 'rb') as f:
+        while offset < size:
+            f.seek(offset)
+            chunk = f.read(settings.resumable_chunk_size)
+            try:
+                r = requests.put(url, params=dict(offset=offset), data=chunk,
+                        headers={'Content-Type': 'application/octet-stream'})
+                if r.status_code == 200:
+                    offset = r.json()['offset']
+                    failures = 0
+                    continue
+                logging.warning('http_resumable_ingest: {}, {}'
+                                .format(r.status_code, r.text))
+                if r.status_code == 404:
+                    return (r.status_code, r.json())
+            except requests.exceptions.RequestException as err:
+                logging.warning('http_resumable_ingest: chunk at {} of {}; {}'
+                                .format(offset, modifiedfits, err))
+            failures += 1
+            if failures > settings.resumable_retries:
+                return (503, dict(errorMessage=
+                                  'Gave up sending {} after {} failures'
+                                  .format(modifiedfits, failures)))
+            try:
+                offset = requests.get(url).json()['offset']
+            except requests.exceptions.RequestException:
+                pass # retry from same offset
+    r = requests.post(url + 'finish/',
+                      params=dict(overwrite=13) if overwrite else dict(),
+                      data=dict(md5sum=md5sum))
+    logging.debug('http_resumable_ingest: {}, {}'.format(r.status_code,r.json()))
+    return (r.status_code, r.json())
+
 def submit_to_archive(fitspath,
                       md5sum=None,
                       overwrite=False,
@@ -131,20 +225,30 @@ fitspath:: full path of original fits file (in cache). There must be a
     personality file in <fitspath>.yaml to be used to modify FITS.
 
 md5sum:: checksum of original file from dome
+
+Time spent in each stage is logged (INFO).
     """
-    validate_original_fits(fitspath) # raise on invalid
-    if md5sum == None:
-        md5sum = md5(fitspath)
-    fitscache = str(PurePath(cachedir,
-                             md5sum + ''.join(PurePath(fitspath).suffixes)))
-
-    # Apply personality to FITS in-place (roughly "prep_for_ingest")
-    if personality_yaml == None:
-        personality_yaml = fitspath+'.yaml'
-    changed = apply_personality(fitspath, fitscache, personality_yaml)
-
-    # ingest NATICA service
-    (status,jmsg) = http_archive_ingest(fitscache, overwrite=overwrite)
+    timings = collections.OrderedDict()
+    with stage(timings, 'total'):
+        with stage(timings, 'validate'):
+            validate_original_fits(fitspath) # raise on invalid
+        if md5sum == None:
+            with stage(timings, 'checksum'):
+                md5sum = md5(fitspath)
+        fitscache = str(PurePath(cachedir,
+                                 md5sum + ''.join(PurePath(fitspath).suffixes)))
+
+        # Apply personality to FITS in-place (roughly "prep_for_ingest")
+        if personality_yaml == None:
+            personality_yaml = fitspath+'.yaml'
+        with stage(timings, 'personality'):
+            changed = apply_personality(fitspath, fitscache, personality_yaml)
+        nbytes = os.path.getsize(fitscache)
+
+        # ingest NATICA service
+        (status,jmsg) = http_archive_ingest(fitscache, overwrite=overwrite,
+                                            timings=timings)
+    log_stages(fitspath, nbytes, timings)
     if status == 200:  # SUCCESS
         # Remove cache files; FITS + YAML
         os.remove(fitscache) 
@@ -45,13 +45,12 @@ class TestTada(unittest.TestCase):
         arch_file='NA'
         #print('fits1={}'.format(self.fits1))
 
-        # Duplicate submit to raise error
-        #with self.assertRaises(Exception) as cm:
+        # Duplicate submit is not uploaded; gets name already in archive
         arch_file = tada.submit_to_archive(self.fits1, overwrite=False)
         arch_file = tada.submit_to_archive(self.fits1, overwrite=False)
         #print('DBG-2: arch_file: "{}"'.format(arch_file))
 
-        expected="Failed to ingest using natica/store webservice with /var/tada/cache/2148387e3e6eec69f04e9360043f61e4.fits.fz; {'errorMessage': 'Could not store metadata; duplicate key value violates unique constraint \"natica_fitsfile_md5sum_key\"\\nDETAIL:  Key (md5sum)=(8db07cedd1dda5098901792e890feb7a) already exists.\\n'}"
+        expected='/data/natica-archive/20141219/wiyn/2012B-0500/kww_141220_130138_ori.fits.fz'
         self.assertEqual(arch_file, expected)
 
             